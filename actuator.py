@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+
+#imports
+import time
+import logging
+import subprocess
+from collections import OrderedDict
+from threading import Thread, Condition
+
+log = logging.getLogger(__name__)
+
+'''
+    class ActuatorChannel
+
+    Description:
+      Command queue to an actuator device, written by a background thread so handlers
+      never wait on the device.  Commands queued while the device is busy go out
+      together in the next batch.  Commands sent with a key replace any queued command
+      with the same key (latest wins), so a servo that falls behind moves straight to
+      the newest position instead of replaying stale ones.  Subclasses implement
+      _write_batch(commands).
+
+      name      : str, channel name for logs
+      max_batch : int, default=16.  Maximum commands per batch.
+'''
+class ActuatorChannel():
+
+    def __init__(self, name='actuator', max_batch=16):
+        self.name = name
+        self.max_batch = max_batch
+        self.n_sent = 0
+        self.n_coalesced = 0
+        self.n_batches = 0
+        self._cond = Condition()
+        self._pending = OrderedDict()
+        self._n_unkeyed = 0
+        self._busy = False
+        self._closed = False
+        self._thread = Thread(target=self._run, args=(), name=name, daemon=True)
+        self._thread.start()
+
+    '''
+        send(self, command, key=None)
+
+        Description:
+          Queues a command (a text line for process channels).  With a key, a queued
+          command with the same key is replaced.  Never blocks on the device.
+    '''
+    def send(self, command, key=None):
+        with self._cond:
+            if self._closed:
+                return
+            if key is None:
+                key = ('unkeyed', self._n_unkeyed)
+                self._n_unkeyed += 1
+            elif key in self._pending:
+                del self._pending[key]
+                self.n_coalesced += 1
+            self._pending[key] = command
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while len(self._pending) == 0 and not self._closed:
+                    self._cond.wait()
+                if len(self._pending) == 0:
+                    return
+                batch = list()
+                while len(self._pending) > 0 and len(batch) < self.max_batch:
+                    batch.append(self._pending.popitem(last=False)[1])
+                self._busy = True
+            try:
+                self._write_batch(batch)
+            except Exception:
+                log.exception("[" + self.name + "] failed to send " + str(batch))
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self.n_sent += len(batch)
+                    self.n_batches += 1
+                    self._cond.notify_all()
+
+    '''
+        flush(self, timeout=None)
+
+        Description:
+          Blocks until every queued command has been written.  Returns False if the
+          timeout (seconds) expired first.
+    '''
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while len(self._pending) > 0 or self._busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # Sends what is queued, then stops the channel
+    def close(self, timeout=1.0):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._close()
+
+    def stats(self):
+        return { 'sent' : self.n_sent,
+                 'coalesced' : self.n_coalesced,
+                 'batches' : self.n_batches }
+
+    #@abstractmethod
+    def _write_batch(self, commands):
+        raise NotImplementedError("Abstract class does not implement this method.")
+
+    def _close(self):
+        pass
+
+'''
+    class ProcessChannel
+
+    Description:
+      Actuator channel to one long-lived helper process, with commands written to its
+      stdin one per line.  Saves a fork+exec per command.  The process is restarted if
+      it exits.
+
+      argv : helper command line, e.g. ['espeak'] (reads and speaks one line at a time)
+'''
+class ProcessChannel(ActuatorChannel):
+
+    def __init__(self, argv, name=None, **kwargs):
+        self.argv = list(argv)
+        self._process = None
+        ActuatorChannel.__init__(self, name=(name or self.argv[0]), **kwargs)
+
+    def _start(self, stdout=subprocess.DEVNULL):
+        if self._process is not None:
+            log.warning("[" + self.name + "] helper exited with " +
+                        str(self._process.poll()) + ", restarting")
+        self._process = subprocess.Popen(self.argv, stdin=subprocess.PIPE,
+                                         stdout=stdout, universal_newlines=True)
+
+    def _ensure_started(self):
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+
+    def _write_batch(self, commands):
+        self._ensure_started()
+        text = "".join([command.replace("\n", " ") + "\n" for command in commands])
+        try:
+            self._process.stdin.write(text)
+            self._process.stdin.flush()
+        except BrokenPipeError:
+            self._start()
+            self._process.stdin.write(text)
+            self._process.stdin.flush()
+
+    def _close(self):
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+                self._process.wait(1.0)
+            except Exception:
+                self._process.kill()
+            self._process = None
+
+'''
+    class ShellChannel
+
+    Description:
+      Actuator channel to a persistent shell for command line tools such as gpio_pwm.
+      Each batch runs its commands in parallel and waits for them, so commands queued
+      meanwhile coalesce instead of piling up on the device.
+'''
+class ShellChannel(ProcessChannel):
+
+    MARKER = '__cv2utils_batch_done__'
+
+    def __init__(self, name='sh', **kwargs):
+        ProcessChannel.__init__(self, ['sh'], name=name, **kwargs)
+
+    def _start(self, stdout=subprocess.PIPE):
+        ProcessChannel._start(self, stdout=stdout)
+
+    def _write_batch(self, commands):
+        script = "{ " + " & ".join(commands) + " & wait; } ; echo " + ShellChannel.MARKER
+        ProcessChannel._write_batch(self, [script])
+        # Wait for the batch to finish; the commands' own output is discarded
+        while True:
+            line = self._process.stdout.readline()
+            if line == '' or line.strip() == ShellChannel.MARKER:
+                return
+
+'''
+    class RecordingChannel
+
+    Description:
+      Stand-in channel for tests and development machines without the hardware.
+      Records each batch as (timestamp, [commands]) in self.batches instead of running
+      it; delay_s simulates a busy device.
+'''
+class RecordingChannel(ActuatorChannel):
+
+    def __init__(self, name='recording', delay_s=0., **kwargs):
+        self.delay_s = delay_s
+        self.batches = list()
+        ActuatorChannel.__init__(self, name=name, **kwargs)
+
+    def _write_batch(self, commands):
+        self.batches.append((time.time(), list(commands)))
+        if self.delay_s > 0:
+            time.sleep(self.delay_s)
+
+    # All recorded commands in order
+    @property
+    def commands(self):
+        return [command for (timestamp, batch) in self.batches for command in batch]
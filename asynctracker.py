@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+
+#imports
+import asyncio
+import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+from cv2utils.tracker import Tracker
+
+log = logging.getLogger(__name__)
+
+# Detected event as reported by AsyncTracker.stream()
+class Event():
+
+    def __init__(self, subscriber, seq, contours, metadata, timestamp=None):
+        self.subscriber = subscriber
+        self.seq = seq
+        self.contours = contours
+        self.metadata = metadata
+        self.timestamp = timestamp
+
+    def __str__(self):
+        return "[" + self.subscriber + "] frame " + str(self.seq) + " " + str(self.metadata)
+
+# Runs an `async def handle(contours, frame_buf, frame_index)` handler on the event loop.
+# Called on the subscriber's handler worker, which waits for the coroutine so events
+# arriving meanwhile still coalesce.
+class _AsyncHandler():
+
+    def __init__(self, handler, tracker):
+        self._handler = handler
+        self._tracker = tracker
+
+    def handle(self, contours, frame_buf, frame_index):
+        loop = self._tracker._loop
+        if loop is None or loop.is_closed():
+            return
+        future = asyncio.run_coroutine_threadsafe(
+            self._handler.handle(contours, frame_buf, frame_index), loop)
+        self._tracker._handler_futures.add(future)
+        try:
+            future.result()
+        except CancelledError:
+            pass
+        finally:
+            self._tracker._handler_futures.discard(future)
+
+'''
+    class AsyncTracker
+
+    Description:
+      asyncio front end for a Tracker.  Capture, frame processing and event detection
+      keep running on the Tracker's worker threads; blocking calls (opening the source,
+      stopping, draining) run in a small thread pool, and frames, events and async
+      handlers are delivered on the event loop.
+
+      async with AsyncTracker(usb_dev=0) as tracker:
+          tracker.add_subscriber(Subscriber(handler=my_async_handler))
+          await tracker.start(UsbSource(0))
+          async for frame, events in tracker.stream():
+              ...
+
+      stream() yields (frame, events) for processed frames: a copy of the frame and the
+      Events detected since the previous item.  Detection finishes after the frame is
+      handed out, so an event usually arrives with a later frame; Event.seq identifies the
+      frame it was detected on.  A consumer slower than the camera gets the newest frame
+      (queue_size frames are buffered), and no events are lost while the stream runs;
+      events detected while no stream() is being iterated are not kept.  The stream
+      ends when a non-live source is exhausted or the tracker is stopped.
+
+      Handlers whose handle() is a coroutine function run on the event loop, dispatched
+      from a handler worker (async_handler is turned on for them); they should await
+      rather than block.  Other handlers run as configured on their Subscriber.
+
+      tracker    : Tracker to wrap.  Default=None creates one from tracker_kwargs.
+      queue_size : int, default=2.  Frames buffered for stream().
+'''
+class AsyncTracker:
+
+    def __init__(self, tracker=None, queue_size=2, **tracker_kwargs):
+        self.tracker = tracker or Tracker(**tracker_kwargs)
+        self.queue_size = queue_size
+        self.n_dropped_frames = 0
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='async-tracker')
+        self._loop = None
+        self._queue = None
+        self._pending_events = list()
+        self._streaming = False
+        self._stopping = False
+        self._watcher = None
+        self._handler_futures = set()
+        self.tracker.add_frame_listener(self._on_frame)
+
+    def add_subscriber(self, subscriber):
+        handler = subscriber._handler
+        if handler is not None and inspect.iscoroutinefunction(handler.handle):
+            subscriber._handler = _AsyncHandler(handler, self)
+            # Coroutines run on a handler worker, so detection doesn't wait on the loop
+            subscriber.async_handler = True
+        subscriber.add_event_listener(self._on_event)
+        self.tracker.add_subscriber(subscriber)
+
+    '''
+        start(self, source)
+
+        Description:
+          Opens source and starts tracking (see Tracker.run).  Must be awaited from the
+          event loop that consumes stream() and runs async handlers.
+    '''
+    async def start(self, source):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        await self._loop.run_in_executor(self._executor, self.tracker.run, source)
+        self._watcher = self._loop.run_in_executor(self._executor, self._watch)
+
+    # End of stream: wait for the processing thread, then drain the pipeline
+    def _watch(self):
+        self.tracker._process_thread.join()
+        if not self._stopping:
+            self.tracker.wait()
+
+    async def stream(self):
+        self._streaming = True
+        watcher = asyncio.ensure_future(asyncio.shield(self._watcher))
+        getter = None
+        try:
+            while True:
+                if self._queue.empty() and watcher.done():
+                    if len(self._pending_events) > 0:
+                        yield None, self._take_events()
+                    return
+                getter = asyncio.ensure_future(self._queue.get())
+                await asyncio.wait([getter, watcher], return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    frame, seq = getter.result()
+                    yield frame, self._take_events()
+                else:
+                    getter.cancel()
+        finally:
+            # Closed or cancelled while waiting: don't leave the queue read behind
+            if getter is not None and not getter.done():
+                getter.cancel()
+            watcher.cancel()
+            self._streaming = False
+            self._pending_events = list()
+
+    def _take_events(self):
+        events = self._pending_events
+        self._pending_events = list()
+        return events
+
+    # Processing thread
+    def _on_frame(self, seq, frame):
+        if not self._streaming or frame is None:
+            return
+        self._loop.call_soon_threadsafe(self._put_frame, frame.copy(), seq)
+
+    def _put_frame(self, frame, seq):
+        if self._queue.qsize() >= self.queue_size:
+            self._queue.get_nowait()
+            self.n_dropped_frames += 1
+        self._queue.put_nowait((frame, seq))
+
+    # Detection workers.  Events are only collected for a running stream(): each one
+    # holds its contours.
+    def _on_event(self, subscriber, contours, frame_buf, frame_index):
+        if not self._streaming or self._loop is None or self._loop.is_closed():
+            return
+        seq = getattr(frame_buf, 'seq', None)
+        timestamp = frame_buf.timestamp() if hasattr(frame_buf, 'timestamp') else None
+        event = Event(subscriber.name, seq, contours, subscriber.event_metadata, timestamp)
+        self._loop.call_soon_threadsafe(self._add_event, event)
+
+    def _add_event(self, event):
+        if self._streaming:
+            self._pending_events.append(event)
+
+    '''
+        wait(self)
+
+        Description:
+          Waits until a non-live source has been fully processed.
+    '''
+    async def wait(self):
+        await asyncio.shield(self._watcher)
+
+    '''
+        stop(self)
+
+        Description:
+          Cancels running async handlers, stops the tracker and releases the source.
+          Safe to call more than once, and from a cancelled task.
+    '''
+    async def stop(self):
+        if self._stopping:
+            return
+        self._stopping = True
+        for future in list(self._handler_futures):
+            future.cancel()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.tracker.stop)
+        if self._watcher is not None:
+            await self._watcher
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
@@ -0,0 +1,340 @@
+#!/usr/bin/python3
+
+'''
+    Offline benchmark harness.
+
+    Replays recorded video files or deterministic synthetic scenes through each
+    FrameProcessor / EventDetector directly and through the full Tracker / Subscriber
+    pipeline, either as fast as possible or paced at a given frame rate, and reports
+    throughput, per-stage latency and detection counts as JSON.
+
+    Usage:
+      python3 -m cv2utils.benchmark [--video FILE ...] [--frames N] [--fps F]
+                                    [--mode processor|tracker|all] [--output FILE]
+                                    [--compare BASELINE.json] [--label TEXT]
+
+    Detection counts are reproducible across runs and machines: synthetic scenes are
+    seeded, the tracker runs in lock-step (every frame processed, blocking queues) and
+    the benchmark detectors have no time-based debounce.
+'''
+
+#imports
+import sys
+import time
+import json
+import logging
+import argparse
+import subprocess
+import contextlib
+import cv2
+import numpy as np
+
+from cv2utils.tracker import Tracker, Handler, EventDetector
+from cv2utils.subscriber import Subscriber
+from cv2utils.frameprocessor import MotionProcessor, BackgroundModelProcessor, ColorDetector
+from cv2utils.dispatcher import BLOCK
+from cv2utils.profiler import Profiler
+from cv2utils.framesource import VideoFileSource
+from cv2utils.framering import FrameBuffer
+
+'''
+    class SyntheticCapture
+
+    Description:
+      Deterministic, cv2.VideoCapture-compatible source of synthetic frames: coloured
+      blobs bouncing around the frame over a textured background, with sensor noise and
+      optional global lighting steps.  read() returns (False, None) after n_frames.
+'''
+class SyntheticCapture():
+
+    def __init__(self, n_frames=300, width=640, height=480, n_blobs=3,
+                 blob_radius=20, speed=6.0, noise=8, lighting_step_every=0,
+                 lighting_step=40, seed=0):
+        """
+        Initialize SyntheticCapture
+
+        Parameters:
+
+        n_frames - number of frames before the stream ends
+        width, height - frame size in pixels
+        n_blobs - number of moving blobs
+        blob_radius - blob radius in pixels
+        speed - blob speed in pixels per frame
+        noise - amplitude of uniform per-pixel noise (0 disables)
+        lighting_step_every - frames between global lighting changes (0 disables)
+        lighting_step - brightness change per lighting step
+        seed - random seed; equal seeds give identical frame sequences
+        """
+        self.n_frames = n_frames
+        self.width = width
+        self.height = height
+        self.blob_radius = blob_radius
+        self.lighting_step_every = lighting_step_every
+        self.lighting_step = lighting_step
+        self._index = 0
+        rng = np.random.default_rng(seed)
+        self._background = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+        self._background = cv2.GaussianBlur(self._background, (31, 31), 0)
+        self._positions = rng.uniform((blob_radius, blob_radius),
+                                      (width-blob_radius, height-blob_radius), (n_blobs, 2))
+        angles = rng.uniform(0, 2*np.pi, n_blobs)
+        self._velocities = speed * np.stack((np.cos(angles), np.sin(angles)), axis=1)
+        self._colors = [tuple(int(c) for c in rng.integers(150, 256, 3))
+                        for i in range(0, n_blobs)]
+        # A small pool of noise planes cycled through keeps generation cheap
+        self._noise = [rng.integers(0, noise, (height, width, 3), dtype=np.uint8)
+                       for i in range(0, 7)] if noise > 0 else None
+
+    def read(self, image=None):
+        if self._index >= self.n_frames:
+            return False, None
+        if image is None or image.shape != self._background.shape:
+            image = np.empty_like(self._background)
+        np.copyto(image, self._background)
+        if self.lighting_step_every > 0:
+            level = (self._index // self.lighting_step_every) % 2
+            if level:
+                cv2.add(image, (self.lighting_step,)*3, dst=image)
+        for (position, color) in zip(self._positions, self._colors):
+            cv2.circle(image, (int(position[0]), int(position[1])), self.blob_radius,
+                       color, thickness=-1)
+        if self._noise is not None:
+            cv2.add(image, self._noise[self._index % len(self._noise)], dst=image)
+        self._step()
+        self._index += 1
+        return True, image
+
+    def _step(self):
+        self._positions += self._velocities
+        low = self.blob_radius
+        high = np.array((self.width, self.height)) - self.blob_radius
+        bounce = (self._positions < low) | (self._positions > high)
+        self._velocities[bounce] *= -1
+        self._positions = np.clip(self._positions, low, high)
+
+    def release(self):
+        pass
+
+# Wraps a capture object so read() returns frames no faster than fps
+class PacedCapture():
+
+    def __init__(self, cap, fps):
+        self._cap = cap
+        self._period = 1./fps
+        self._next = None
+
+    def read(self, image=None):
+        now = time.time()
+        if self._next is None:
+            self._next = now
+        elif now < self._next:
+            time.sleep(self._next-now)
+        self._next += self._period
+        return self._cap.read(image=image)
+
+    def release(self):
+        self._cap.release()
+
+# Handler counting the events it receives
+class CountingHandler(Handler):
+
+    def __init__(self):
+        self.count = 0
+
+    def handle(self, contours, frame_buf, frame_index):
+        self.count += 1
+
+def default_processors():
+    return [ ('MotionProcessor', lambda: MotionProcessor()),
+             ('MotionProcessor-scale0.5', lambda: MotionProcessor(scale=0.5)),
+             ('MotionProcessor-blobs', lambda: MotionProcessor(blobs=True)),
+             ('BackgroundModel-average', lambda: BackgroundModelProcessor(method='average')),
+             ('BackgroundModel-mog2', lambda: BackgroundModelProcessor(method='mog2')),
+             ('ColorDetector', lambda: ColorDetector()) ]
+
+# Detector with no time-based debounce, so counts don't depend on machine speed
+def default_detector():
+    return EventDetector(time_between_triggers_s=0., min_sequential_frames=1,
+                         min_contour_area_px=200, max_contour_area_px=1e9)
+
+'''
+    benchmark_processor(name, processor, cap, frame_buf_size=2, fps=None)
+
+    Description:
+      Runs frames from cap through processor.process and an EventDetector on the calling
+      thread, without the Tracker.  Returns a result dict.
+'''
+def benchmark_processor(name, processor, cap, frame_buf_size=2, fps=None):
+    if fps:
+        cap = PacedCapture(cap, fps)
+    detector = default_detector()
+    profiler = Profiler(name)
+    frame_buf = FrameBuffer(frame_buf_size)
+    frame_index = 0
+    frames = 0; contour_count = 0; detections = 0
+    start = time.time()
+    while True:
+        with profiler.stage('read'):
+            ret, frame = cap.read()
+        if not ret:
+            break
+        frame_buf[frame_index] = frame
+        with profiler.activate(), profiler.stage('process'):
+            contours, detectFrame = processor.process(frame_buf=frame_buf,
+                                                      frame_index=frame_index)
+        with profiler.stage('detect'):
+            if detector.detect(contours):
+                detections += 1
+        if contours is not None:
+            contour_count += len(contours)
+        frame_index = (frame_index + 1) % frame_buf_size
+        frames += 1
+    seconds = time.time() - start
+    return { 'name' : 'processor:' + name,
+             'frames' : frames,
+             'seconds' : seconds,
+             'fps' : frames / seconds if seconds > 0 else 0.,
+             'contours' : contour_count,
+             'detections' : detections,
+             'profile' : profiler.summary() }
+
+'''
+    benchmark_tracker(name, processors, cap, fps=None, n_workers=None, backend=None)
+
+    Description:
+      Runs frames from cap through a Tracker with one subscriber per processor (plus a
+      second subscriber sharing the first processor, to exercise shared stages).  The
+      tracker runs in lock-step so every frame reaches every subscriber.  Returns a
+      result dict including Tracker.stats().
+'''
+def benchmark_tracker(name, processors, cap, fps=None, n_workers=None, backend=None):
+    if fps:
+        cap = PacedCapture(cap, fps)
+    tracker = Tracker(heartbeat_frames=10**9, n_workers=n_workers, backend=backend,
+                      skip_stale_frames=False)
+    handlers = dict()
+    subscribers = [(processor_name, processor) for (processor_name, processor) in processors]
+    subscribers.append((processors[0][0] + '-shared', processors[0][1]))
+    for (subscriber_name, processor) in subscribers:
+        handlers[subscriber_name] = CountingHandler()
+        tracker.add_subscriber(Subscriber(frame_processor=processor,
+                                          event_detector=default_detector(),
+                                          handler=handlers[subscriber_name],
+                                          name=subscriber_name, log_events=False,
+                                          overflow_policy=BLOCK,
+                                          # Inline handlers: coalescing would make counts
+                                          # depend on timing
+                                          async_handler=False))
+    start = time.time()
+    tracker.run_capture(cap, stop_at_end=True)
+    tracker.wait()
+    seconds = time.time() - start
+    stats = tracker.stats()
+    tracker.stop()
+    frames = stats['frames']
+    return { 'name' : 'tracker:' + name,
+             'frames' : frames,
+             'seconds' : seconds,
+             'fps' : frames / seconds if seconds > 0 else 0.,
+             'detections' : { subscriber_name : handler.count
+                              for (subscriber_name, handler) in handlers.items() },
+             'stats' : stats }
+
+def _sources(args):
+    if args.video:
+        return [ (path, (lambda path=path: VideoFileSource(path).open())) for path in args.video ]
+    return [ ('synthetic', lambda: SyntheticCapture(n_frames=args.frames, seed=args.seed)),
+             ('synthetic-lighting', lambda: SyntheticCapture(n_frames=args.frames,
+                                                             seed=args.seed,
+                                                             lighting_step_every=50)) ]
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+'''
+    run(args)
+
+    Description:
+      Runs the benchmark suite selected by the parsed command line arguments and returns
+      the report dict.
+'''
+def run(args):
+    results = list()
+    for (source_name, source) in _sources(args):
+        if args.mode in ('processor', 'all'):
+            for (name, factory) in default_processors():
+                result = benchmark_processor(name, factory(), source(), fps=args.fps)
+                result['source'] = source_name
+                results.append(result)
+        if args.mode in ('tracker', 'all'):
+            processors = [(name, factory()) for (name, factory) in default_processors()]
+            result = benchmark_tracker('all-processors', processors, source(), fps=args.fps,
+                                       n_workers=args.workers)
+            result['source'] = source_name
+            results.append(result)
+    return { 'label' : args.label,
+             'commit' : _git_commit(),
+             'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+             'opencv' : cv2.__version__,
+             'numpy' : np.__version__,
+             'python' : sys.version.split()[0],
+             'results' : results }
+
+'''
+    compare(baseline, report)
+
+    Description:
+      Returns a list of (name, source, baseline_fps, fps, change_percent) for every
+      result present in both reports.
+'''
+def compare(baseline, report):
+    previous = { (r['name'], r.get('source')) : r for r in baseline['results'] }
+    rows = list()
+    for result in report['results']:
+        key = (result['name'], result.get('source'))
+        if key in previous and previous[key]['fps'] > 0:
+            change = 100. * (result['fps'] / previous[key]['fps'] - 1.)
+            rows.append((key[0], key[1], previous[key]['fps'], result['fps'], change))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='cv2utils offline benchmark')
+    parser.add_argument('--video', action='append',
+                        help='video file to replay (repeatable); default synthetic scenes')
+    parser.add_argument('--frames', type=int, default=300,
+                        help='synthetic frames per scene')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fps', type=float, default=None,
+                        help='pace input at this frame rate; default as fast as possible')
+    parser.add_argument('--mode', choices=('processor', 'tracker', 'all'), default='all')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='tracker subscriber worker pool size')
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='baseline JSON report to compare fps against')
+    args = parser.parse_args(argv)
+
+    Tracker.get_logger().setLevel(logging.WARNING)
+    # Keep stdout clean for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+    text = json.dumps(report, indent=2, default=float)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for (name, source, before, after, change) in compare(baseline, report):
+            sys.stderr.write(name + " [" + str(source) + "] " + str(np.round(before,1)) +
+                             " -> " + str(np.round(after,1)) + " fps (" +
+                             ("+" if change >= 0 else "") + str(np.round(change,1)) + "%)\n")
+
+if __name__ == '__main__':
+    main()
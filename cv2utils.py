@@ -3,11 +3,18 @@
 # import the necessary packages
 #from picamera.array import PiRGBArray
 #from picamera import PiCamera
+import os
+import glob
 import time
+import shutil
 import cv2
 import numpy as np
 import sys
 import logging
+from collections import OrderedDict, deque
+from threading import Lock, Event
+from cv2utils.profiler import profiled
+from cv2utils.imagewriter import unique_timestamp_name
 #from .tracker import Tracker
 
 def imdiff(image1, image2) :
@@ -16,7 +23,7 @@ def imdiff(image1, image2) :
 
 def imdiff_gray(image1, image2) :
     diff = imdiff(image1, image2)
-    return cv2.cvtColor( diff, cv2.COLOR_RGB2GRAY )
+    return cv2.cvtColor( diff, cv2.COLOR_BGR2GRAY )
 
 def hist_print(img, bins):
     counts,edges = np.histogram(img, bins=bins)
@@ -38,32 +45,561 @@ def mean_remove(img):
     return res
 
 
+# Per-contour statistics for a whole contour list, as NumPy arrays:
+#
+#   area      - polygon area (same as cv2.contourArea)
+#   cx, cy    - area centroid (point average for degenerate contours)
+#   bbox      - (N,4) int array of x, y, w, h (same as cv2.boundingRect)
+#   perimeter - closed contour length (same as cv2.arcLength(c, True)).  May be given
+#               as a function, called the first time the perimeter is needed.
+class ContourStats():
+
+    def __init__(self, area, cx, cy, bbox, perimeter):
+        self.area = area
+        self.cx = cx
+        self.cy = cy
+        self.bbox = bbox
+        self._perimeter = perimeter
+
+    @property
+    def perimeter(self):
+        if callable(self._perimeter):
+            self._perimeter = self._perimeter()
+        return self._perimeter
+
+    def __len__(self):
+        return len(self.area)
+
+    # Index of the largest-area contour, or -1 if no contour has positive area
+    def largest(self):
+        if len(self.area) == 0 or self.area.max() <= 0:
+            return -1
+        return int(np.argmax(self.area))
+
+    def centroid(self, index):
+        return (int(self.cx[index]), int(self.cy[index]))
+
+    # Area-weighted average centroid of all contours
+    def avg_centroid(self):
+        total_area = self.area.sum()
+        if total_area <= 0:
+            return (0, 0)
+        return (int(np.dot(self.cx, self.area) / total_area),
+                int(np.dot(self.cy, self.area) / total_area))
+
+# Applies one derived_image conversion step
+def _convert(img, step):
+    name, args = (step, ()) if isinstance(step, str) else (step[0], step[1:])
+    if name == 'gray':
+        return img if img.ndim < 3 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if name == 'hsv':
+        return cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    if name == 'plane':
+        return img[:,:,args[0]]
+    if name == 'blur':
+        return cv2.GaussianBlur(img, (args[0], args[0]), 0)
+    if name == 'crop':
+        x, y, w, h = args[0]
+        return img[y:y+h, x:x+w]
+    if name == 'downscale':
+        return downscale(img, *args)
+    raise ValueError("Unknown image conversion '" + str(step) + "'")
+
+'''
+    class DerivedImageCache
+
+    Description:
+      Images derived from video frames (gray, HSV, a colour plane, blurred,
+      downscaled, ...), computed at most once per frame and shared by every frame
+      processor, detector and handler of that frame.  Entries are keyed by frame key
+      (FrameWindow.frame_key: the ring id and frame sequence number) and conversion
+      steps.  Frames are cached per owner, the first element of the frame key (a
+      FrameRing or FrameBuffer id, never reused), so streams don't evict each other's
+      frames: an owner's frames are dropped once max_frames newer ones (or as many
+      as reserve()d for it) have been cached, and all of them with discard().
+      Threads asking for a conversion another thread is computing wait for its
+      result instead of computing it again.
+
+      Cached images are shared: treat them as read-only.
+'''
+class DerivedImageCache():
+
+    def __init__(self, max_frames=12):
+        self.max_frames = max_frames
+        self.n_hits = 0
+        self.n_misses = 0
+        # owner -> frame key -> { steps : image }, oldest frame first
+        self._frames = dict()
+        # owner -> max_frames, for owners with a reserve()d size
+        self._capacity = dict()
+        self._pending = dict()
+        # owners discard()ed while the lock was held, dropped by the lock's next holder
+        self._discarded = deque()
+        self._lock = Lock()
+
+    '''
+        reserve(self, owner, max_frames) / discard(self, owner)
+
+        Description:
+          reserve() sets how many frames of one owner (e.g. a FrameRing: its size) are
+          kept; discard() drops the owner's frames and reservation when it goes away.
+    '''
+    def reserve(self, owner, max_frames):
+        with self._lock:
+            self._drop_discarded()
+            self._capacity[owner] = max_frames
+
+    def discard(self, owner):
+        self._discarded.append(owner)
+        if self._lock.acquire(blocking=False):
+            try:
+                self._drop_discarded()
+            finally:
+                self._lock.release()
+
+    # Called with the lock held
+    def _drop_discarded(self):
+        while len(self._discarded) > 0:
+            owner = self._discarded.popleft()
+            self._capacity.pop(owner, None)
+            self._frames.pop(owner, None)
+
+    # Owner of a frame key: its first element, also for keys derived from another key
+    # (e.g. AnalysisFrames keys, (frame key, steps...)).  Other keys share owner None.
+    @staticmethod
+    def _owner(key):
+        owner = None
+        while isinstance(key, tuple) and len(key) > 0:
+            owner = key = key[0]
+        return owner
+
+    '''
+        get(self, frame, key, *steps)
+
+        Description:
+          Returns frame with each conversion step applied in turn.  A step is a name or
+          a (name, args...) tuple: 'gray', 'hsv', ('plane', index), ('blur', ksize),
+          ('crop', (x, y, w, h)), ('downscale', scale, pyramid_levels).  Intermediate
+          results are cached too.  With key=None nothing is cached.
+    '''
+    def get(self, frame, key, *steps):
+        image = frame
+        for i in range(0, len(steps)):
+            if key is None:
+                image = _convert(image, steps[i])
+            else:
+                image = self._get(image, key, steps[:i+1])
+        return image
+
+    def _get(self, parent, key, steps):
+        owner = DerivedImageCache._owner(key)
+        while True:
+            with self._lock:
+                images = self._frames.get(owner, dict()).get(key)
+                if images is not None and steps in images:
+                    self.n_hits += 1
+                    return images[steps]
+                event = self._pending.get((key, steps))
+                if event is None:
+                    event = self._pending[(key, steps)] = Event()
+                    break
+            event.wait()
+        try:
+            with profiled('convert'):
+                image = _convert(parent, steps[-1])
+            with self._lock:
+                self.n_misses += 1
+                frames = self._frames.get(owner)
+                if frames is None:
+                    frames = self._frames[owner] = OrderedDict()
+                images = frames.get(key)
+                if images is None:
+                    images = frames[key] = dict()
+                    max_frames = self._capacity.get(owner, self.max_frames)
+                    while len(frames) > max_frames:
+                        frames.popitem(last=False)
+                images[steps] = image
+                self._drop_discarded()
+        finally:
+            with self._lock:
+                del self._pending[(key, steps)]
+            event.set()
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._discarded.clear()
+            self._frames.clear()
+
+    def stats(self):
+        with self._lock:
+            self._drop_discarded()
+            return { 'frames' : sum([len(frames) for frames in self._frames.values()]),
+                     'hits' : self.n_hits,
+                     'misses' : self.n_misses }
+
+_derived_cache = DerivedImageCache()
+
+# frame with conversion steps applied, cached per frame key.  See DerivedImageCache.get.
+def derived_image(frame, key, *steps):
+    return _derived_cache.get(frame, key, *steps)
+
+def derived_image_cache():
+    return _derived_cache
+
+# One connected component: bounding box, pixel area and pixel centroid
+BLOB_DTYPE = np.dtype([('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32),
+                       ('area', np.float64), ('cx', np.float64), ('cy', np.float64)])
+
+'''
+    class BlobSet
+
+    Description:
+      Detection regions as connected components (see get_blobs): a structured array
+      of per-blob stats (BLOB_DTYPE) from cv2.connectedComponentsWithStats, with no
+      contour point lists.  A BlobSet can be used wherever a contour list is: len(),
+      contour_stats() and everything built on it work from the stats, and
+      blobs[i] / iteration / contours() trace a blob's contour on demand (cached),
+      from the label image kept with the set.  Use as_contours() for OpenCV calls
+      needing a real list, e.g. cv2.drawContours.
+
+      Blob areas are pixel counts, a little larger than the polygon areas of the
+      equivalent contours.  contour_stats().perimeter needs the contours, so the first
+      access traces every blob.
+'''
+class BlobSet():
+
+    def __init__(self, blobs, labels=None, label_ids=None, boxes=None,
+                 scale=(1., 1.), shift=(0., 0.)):
+        self.blobs = blobs
+        self._labels = labels
+        self._label_ids = np.arange(1, len(blobs)+1) if label_ids is None else label_ids
+        # Bounding boxes in label image coordinates
+        self._boxes = (np.stack((blobs['x'], blobs['y'], blobs['w'], blobs['h']), axis=1)
+                       if boxes is None else boxes)
+        # Label image to blob coordinates, as in map_contours
+        self._scale = np.array(scale, dtype=np.float64)
+        self._shift = np.array(shift, dtype=np.float64)
+        self._contours = [None] * len(blobs)
+        self._stats = None
+
+    def __len__(self):
+        return len(self.blobs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.subset(np.arange(len(self))[index])
+        contour = self._contours[index]
+        if contour is None:
+            contour = self._contours[index] = self._trace(index)
+        return contour
+
+    def __iter__(self):
+        for i in range(0, len(self)):
+            yield self[i]
+
+    def _trace(self, index):
+        x, y, w, h = self._boxes[index]
+        mask = (self._labels[y:y+h, x:x+w] == self._label_ids[index]).astype(np.uint8)
+        with profiled('traceBlob'):
+            contours = find_contours(mask)
+        contour = max(contours, key=len) + np.array([x, y], dtype=np.int32)
+        if np.any(self._scale != 1.) or np.any(self._shift != 0.):
+            contour = np.round(contour*self._scale + self._shift).astype(np.int32)
+        return contour
+
+    # All contours, as a list
+    def contours(self):
+        return [self[i] for i in range(0, len(self))]
+
+    def contour_stats(self):
+        if self._stats is None:
+            blobs = self.blobs
+            bbox = np.stack((blobs['x'], blobs['y'], blobs['w'], blobs['h']), axis=1)
+            self._stats = ContourStats(blobs['area'], blobs['cx'], blobs['cy'], bbox,
+                                       lambda: _contour_stats(self.contours()).perimeter)
+        return self._stats
+
+    # Blobs at the given indices
+    def subset(self, indices):
+        indices = np.asarray(indices, dtype=np.intp)
+        subset = BlobSet(self.blobs[indices], self._labels, self._label_ids[indices],
+                         self._boxes[indices], self._scale, self._shift)
+        subset._contours = [self._contours[i] for i in indices]
+        return subset
+
+    # Same blobs in full-frame coordinates, see map_contours
+    def mapped(self, factors, offset=(0, 0)):
+        scale = np.array([1./factors[0], 1./factors[1]])
+        shift = 0.5*scale - 0.5 + np.array(offset)
+        blobs = self.blobs.copy()
+        blobs['x'] = np.floor(self.blobs['x']*scale[0] + shift[0])
+        blobs['y'] = np.floor(self.blobs['y']*scale[1] + shift[1])
+        blobs['w'] = np.ceil(self.blobs['w']*scale[0])
+        blobs['h'] = np.ceil(self.blobs['h']*scale[1])
+        blobs['area'] = self.blobs['area']*scale[0]*scale[1]
+        blobs['cx'] = self.blobs['cx']*scale[0] + shift[0]
+        blobs['cy'] = self.blobs['cy']*scale[1] + shift[1]
+        return BlobSet(blobs, self._labels, self._label_ids, self._boxes,
+                       self._scale*scale, self._shift*scale + shift)
+
+    # Pickled (e.g. from a backend worker) without the label image: contours are
+    # traced first
+    def __getstate__(self):
+        state = dict(vars(self))
+        state['_contours'] = self.contours()
+        state['_labels'] = None
+        state['_stats'] = None
+        return state
+
+# Block-based labelling; much faster than the default algorithm on some builds
+_CCL_ALGORITHM = getattr(cv2, 'CCL_GRANA', getattr(cv2, 'CCL_BBDT', None))
+
+# Connected components of a binary mask as a BlobSet
+def blobs_from_mask(mask, connectivity=8):
+    with profiled('connectedComponents'):
+        if _CCL_ALGORITHM is not None:
+            n, labels, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(
+                mask, connectivity, cv2.CV_32S, _CCL_ALGORITHM)
+        else:
+            n, labels, stats, centroids = cv2.connectedComponentsWithStats(
+                mask, connectivity=connectivity, ltype=cv2.CV_32S)
+    blobs = np.empty(n-1, BLOB_DTYPE)
+    blobs['x'] = stats[1:, cv2.CC_STAT_LEFT]
+    blobs['y'] = stats[1:, cv2.CC_STAT_TOP]
+    blobs['w'] = stats[1:, cv2.CC_STAT_WIDTH]
+    blobs['h'] = stats[1:, cv2.CC_STAT_HEIGHT]
+    blobs['area'] = stats[1:, cv2.CC_STAT_AREA]
+    blobs['cx'] = centroids[1:, 0]
+    blobs['cy'] = centroids[1:, 1]
+    return BlobSet(blobs, labels, boxes=stats[1:, :4])
+
+# A real list of contours from a contour list or BlobSet
+def as_contours(contours):
+    if isinstance(contours, BlobSet):
+        return contours.contours()
+    return contours
+
+_stats_cache = OrderedDict()
+_stats_cache_lock = Lock()
+_STATS_CACHE_SIZE = 16
+
+# Compute ContourStats for all contours in one vectorized pass (shoelace formula over
+# the concatenated contour points).  Results are cached per contour list object, so
+# every detector and handler looking at the same frame result shares one computation.
+# Each cache entry holds the list itself, so its id can't be reused while it is cached,
+# and the contours it held: a list changed since (appended to, filtered in place) gets
+# its stats computed again.
+def contour_stats(contours):
+    if isinstance(contours, BlobSet):
+        return contours.contour_stats()
+    key = id(contours)
+    with _stats_cache_lock:
+        cached = _stats_cache.get(key)
+    if cached is not None and cached[0] is contours and _same_items(cached[1], contours):
+        return cached[2]
+    stats = _contour_stats(contours)
+    if contours is None:
+        return stats
+    with _stats_cache_lock:
+        _stats_cache[key] = (contours, tuple(contours), stats)
+        _stats_cache.move_to_end(key)
+        if len(_stats_cache) > _STATS_CACHE_SIZE:
+            _stats_cache.popitem(last=False)
+    return stats
+
+def _same_items(items, contours):
+    return (len(items) == len(contours) and
+            all([a is b for (a, b) in zip(items, contours)]))
+
+def _contour_stats(contours):
+    n = 0 if contours is None else len(contours)
+    if n == 0:
+        empty = np.zeros(0)
+        return ContourStats(empty, empty, empty, np.zeros((0,4), dtype=np.int32), empty)
+
+    lengths = np.array([len(contour) for contour in contours])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    pts = np.concatenate([contour.reshape(-1, 2) for contour in contours]).astype(np.float64)
+    x = pts[:,0]; y = pts[:,1]
+    # Index of the next point around each (closed) contour
+    nxt = np.arange(len(pts)) + 1
+    nxt[starts + lengths - 1] = starts
+    x1 = x[nxt]; y1 = y[nxt]
+
+    cross = x*y1 - x1*y
+    signed_area = 0.5 * np.add.reduceat(cross, starts)
+    area = np.abs(signed_area)
+    perimeter = np.add.reduceat(np.hypot(x1-x, y1-y), starts)
+
+    # Fall back to the point average where the polygon has no area
+    mean_x = np.add.reduceat(x, starts) / lengths
+    mean_y = np.add.reduceat(y, starts) / lengths
+    degenerate = np.abs(signed_area) < 1e-9
+    denom = np.where(degenerate, 1., 6.*signed_area)
+    cx = np.where(degenerate, mean_x, np.add.reduceat((x+x1)*cross, starts) / denom)
+    cy = np.where(degenerate, mean_y, np.add.reduceat((y+y1)*cross, starts) / denom)
+
+    xmin = np.minimum.reduceat(x, starts); xmax = np.maximum.reduceat(x, starts)
+    ymin = np.minimum.reduceat(y, starts); ymax = np.maximum.reduceat(y, starts)
+    bbox = np.stack((xmin, ymin, xmax-xmin+1, ymax-ymin+1), axis=1).astype(np.int32)
+    return ContourStats(area, cx, cy, bbox, perimeter)
+
 def avg_contour_centroid(contours):
-    wavg_centroid = np.double((0.,0.))
-    total_area = 0.;
-    for contour in contours:
-        area = cv2.contourArea(contour)
-        center = centroid(contour)
-        wavg_centroid += np.double(center)*area
-        total_area += area
-    wavg_centroid /= total_area
-    return (np.int(wavg_centroid[0]), np.int(wavg_centroid[1]))
+    return contour_stats(contours).avg_centroid()
+
+# Size (h, w) of an image of size (h, w) after downscale(img, scale, pyramid_levels)
+def downscaled_size(shape, scale=1.0, pyramid_levels=0):
+    h, w = shape[:2]
+    if scale != 1.0:
+        h = max(1, int(round(h*scale))); w = max(1, int(round(w*scale)))
+    for i in range(0, pyramid_levels):
+        h = (h+1)//2; w = (w+1)//2
+    return (h, w)
+
+# Resize by scale (area interpolation), then halve pyramid_levels times with pyrDown
+def downscale(img, scale=1.0, pyramid_levels=0):
+    if scale != 1.0:
+        h, w = downscaled_size(img.shape, scale)
+        img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+    for i in range(0, pyramid_levels):
+        img = cv2.pyrDown(img)
+    return img
+
+# Map contours found in a downscaled / cropped analysis image back to full-frame
+# coordinates.  factors is the (fx, fy) full-to-analysis scale, offset the (x, y) of
+# the crop in the full frame.
+def map_contours(contours, factors, offset=(0, 0)):
+    fx, fy = factors
+    if fx == 1.0 and fy == 1.0 and offset[0] == 0 and offset[1] == 0:
+        return contours
+    if isinstance(contours, BlobSet):
+        return contours.mapped(factors, offset)
+    scale = np.array([1./fx, 1./fy])
+    # Pixel centres: analysis u maps to (u+0.5)/f - 0.5 in the full frame
+    shift = 0.5*scale - 0.5 + np.array(offset)
+    return [np.round(contour*scale + shift).astype(np.int32) for contour in contours]
+
+# Structuring element for the dilation in get_contours
+_DILATE_KERNEL = np.ones((5,5), np.uint8)
 
 def get_contours(img, thresh=128, max=255, dilate=True, erode=True):
 
-    th, dst = cv2.threshold(img, thresh, max, cv2.THRESH_BINARY)
+    with profiled('threshold'):
+        th, dst = cv2.threshold(img, thresh, max, cv2.THRESH_BINARY)
 
-    if (erode): dst = cv2.erode(dst, None, iterations=1)
+    with profiled('morphology'):
+        if (erode): dst = cv2.erode(dst, None, iterations=1)
 
-    kernel = np.ones((5,5), np.uint8)
-    if (dilate): dst = cv2.dilate(dst, kernel=kernel, iterations=2)
+        if (dilate): dst = cv2.dilate(dst, kernel=_DILATE_KERNEL, iterations=2)
 
     #im2, contours, hierarchy = cv2.findContours(dst,cv2.RETR_TREE,
     #                                            cv2.CHAIN_APPROX_SIMPLE)
-    im2, contours, hierarchy = cv2.findContours(dst,cv2.RETR_EXTERNAL,
-                                                cv2.CHAIN_APPROX_SIMPLE)
+    with profiled('findContours'):
+        contours = find_contours(dst)
     return contours, dst
 
+# Same as get_contours, returning a BlobSet of connected components instead of contours
+def get_blobs(img, thresh=128, max=255, dilate=True, erode=True):
+
+    with profiled('threshold'):
+        th, dst = cv2.threshold(img, thresh, max, cv2.THRESH_BINARY)
+
+    with profiled('morphology'):
+        if (erode): dst = cv2.erode(dst, None, iterations=1)
+
+        if (dilate): dst = cv2.dilate(dst, kernel=_DILATE_KERNEL, iterations=2)
+
+    return blobs_from_mask(dst), dst
+
+# External contours of a binary image.  OpenCV 3 returns (image, contours, hierarchy),
+# OpenCV 2 and 4+ (contours, hierarchy).
+def find_contours(mask):
+    return cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2:][0]
+
+'''
+    class MotionKernel
+
+    Description:
+      Allocation-free version of frame_diff + get_contours for one frame processor.
+      Scratch buffers are allocated on the first frame (and again only if the frame
+      size changes) and every OpenCV call writes into them with dst=, so the steady
+      state does no per-frame image allocation apart from the gray conversion.
+      Frames with a key (e.g. the frame sequence number) are converted to grayscale
+      once through the shared derived image cache (see derived_image): in frame
+      differencing each frame is converted when it arrives and reused as the previous
+      frame next time, and by every other processor on the same frame.  Unkeyed frames
+      are converted into the kernel's own buffers.
+
+      Results are views of the scratch buffers, valid until the next call.  A kernel
+      is not thread safe; use one per thread.
+'''
+class MotionKernel():
+
+    def __init__(self):
+        self._buffers = dict()
+
+    # Scratch buffer by name, reallocated when the image shape or type changes
+    def _buffer(self, name, shape, dtype):
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = np.empty(shape, dtype)
+            self._buffers[name] = buf
+        return buf
+
+    '''
+        gray(self, frame, key=None, buffer='gray')
+
+        Description:
+          Grayscale version of a BGR (or already single-channel) frame.  With a frame
+          key, the shared cached conversion; otherwise converted into the named buffer.
+    '''
+    def gray(self, frame, key=None, buffer='gray'):
+        if key is not None:
+            return derived_image(frame, key, 'gray')
+        if frame.ndim < 3:
+            return frame
+        dst = self._buffer(buffer, frame.shape[:2], frame.dtype)
+        with profiled('gray'):
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=dst)
+        return dst
+
+    # Absolute grayscale difference of two frames
+    def diff(self, img1, img2, key1=None, key2=None):
+        gray1 = self.gray(img1, key1, 'gray1')
+        gray2 = self.gray(img2, key2, 'gray2')
+        dst = self._buffer('diff', gray1.shape, gray1.dtype)
+        with profiled('diff'):
+            cv2.absdiff(gray1, gray2, dst=dst)
+        return dst
+
+    # cv2.inRange into the kernel's buffers
+    def in_range(self, img, lower, upper):
+        dst = self._buffer('in_range', img.shape[:2], np.uint8)
+        cv2.inRange(img, lower, upper, dst=dst)
+        return dst
+
+    # Same as get_contours (or get_blobs, with blobs=True), into the kernel's buffers
+    def contours(self, img, thresh=128, max=255, dilate=True, erode=True, blobs=False):
+        mask = self._buffer('mask', img.shape, img.dtype)
+        work = self._buffer('work', img.shape, img.dtype)
+        with profiled('threshold'):
+            cv2.threshold(img, thresh, max, cv2.THRESH_BINARY, dst=mask)
+
+        with profiled('morphology'):
+            if (erode):
+                cv2.erode(mask, None, dst=work, iterations=1)
+                mask, work = work, mask
+            if (dilate):
+                cv2.dilate(mask, _DILATE_KERNEL, dst=work, iterations=2)
+                mask, work = work, mask
+
+        if blobs:
+            return blobs_from_mask(mask), mask
+        with profiled('findContours'):
+            contours = find_contours(mask)
+        return contours, mask
+
 def centroid(contour):
     M = cv2.moments(contour)
     if int(M['m00'])==0:
@@ -93,41 +629,79 @@ def draw_x(img, xy, length=5, color=(0xFF, 0x7F, 0x00),
     cv2.line(img, (x1,y1),(x2, y2), color=color, thickness=thickness)
     cv2.line(img, (x1,y2),(x2, y1), color=color, thickness=thickness)
 
-def find_laser(image_plane):
+# With a key identifying image_plane (see derived_image), the blurred plane is cached
+def find_laser(image_plane, key=None):
 
-    img_filtered = cv2.GaussianBlur(image_plane, (15,15), 0)
+    img_filtered = derived_image(image_plane, key, ('blur', 15))
     (min_val, max_val, min_region, max_region) = cv2.minMaxLoc(img_filtered)
     return max_val, max_region
 
 
 def largest_contour(contours):
-    max_area = 0
-    largest = None
-    for contour in contours:
-        area = cv2.contourArea(contour)
-        if area > max_area :
-            max_area = area
-            largest = contour
-    return largest, max_area
+    stats = contour_stats(contours)
+    index = stats.largest()
+    if index < 0:
+        return None, 0
+    return contours[index], stats.area[index]
 
 def contour_area(contours):
     result = ""
-    for contour in contours:
-        area = cv2.contourArea(contour)
+    for area in contour_stats(contours).area:
         result += ("A=" + str(area) + "\n")
-        return(result)
+    return(result)
 
 def frame_diff(img1, img2, thresh=25, max=255):
-    diff = cv2.absdiff(img1, img2)
-    diff_gray = cv2.cvtColor(diff, cv2.COLOR_RGB2GRAY)
+    with profiled('diff'):
+        diff = cv2.absdiff(img1, img2)
+        diff_gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
     return diff, diff_gray
 
+# Writes img to a timestamped file (millisecond resolution and a counter, see
+# unique_timestamp_name) and returns the file name.  With an ImageWriter, the image is queued
+# on it instead of being encoded and written on the calling thread.
 def imwrite_timestamp(img, prefix="",
-                      format="%Y-%m-%d_%I_%M_%S", ext="jpeg"):
-    filename = prefix + time.strftime(format) + "." + ext
+                      format="%Y-%m-%d_%H_%M_%S", ext="jpeg", writer=None):
+    if writer is not None:
+        return writer.write(img, prefix=(prefix or None))
+    filename = unique_timestamp_name(prefix, format, ext)
     cv2.imwrite(filename, img)
     return filename
 
+# Deletes the oldest files matching pattern in directory until their total size is at
+# most max_bytes, their number at most max_files, and the disk has at least
+# min_free_bytes free (each limit is optional).  The keep_newest most recent files are
+# never deleted, even if a limit can't be met without them, nor are the paths in keep
+# (e.g. files still being written).  Returns the deleted paths.
+def enforce_disk_quota(directory, max_bytes=None, max_files=None, min_free_bytes=None,
+                       pattern='*', keep_newest=0, keep=()):
+    entries = list()
+    for path in glob.glob(os.path.join(directory, pattern)):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if os.path.isfile(path):
+            entries.append((st.st_mtime, path, st.st_size))
+    entries.sort()
+    total = sum([size for (mtime, path, size) in entries])
+    deleted = list()
+    for (mtime, path, size) in entries[:max(0, len(entries) - keep_newest)]:
+        over = ((max_bytes is not None and total > max_bytes) or
+                (max_files is not None and len(entries) - len(deleted) > max_files) or
+                (min_free_bytes is not None and
+                 shutil.disk_usage(directory).free < min_free_bytes))
+        if not over:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        deleted.append(path)
+    return deleted
+
 # Stictch together an image showing frame1, frame2, and delta with
 # identified contours.  Images tuple / list should contain:
 #
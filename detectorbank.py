@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+
+#imports
+import copy
+import time
+import numpy as np
+
+import cv2utils.cv2utils as cvu
+from cv2utils.tracker import EventMetadata
+
+'''
+    class DetectorBank
+
+    Description:
+      Many EventDetector-style rules evaluated together on one processor output.  Rule
+      parameters and state are kept as one NumPy array per field (struct of arrays), and
+      each frame all rules are checked with a handful of array operations against the
+      frame's blob stats (contour_stats of a contour list or BlobSet), instead of one
+      Python pass over the contours per rule.
+
+      Each rule behaves like an EventDetector with the same parameters: it counts
+      sequential frames whose region area is in (min_contour_area_px,
+      max_contour_area_px), and fires once min_sequential_frames is reached and
+      time_between_triggers_s has passed since it last fired.  With match='largest'
+      (default, as EventDetector) the area is that of the largest region; with
+      match='any' a rule is met by any region in its range.  With tracks (Subscriber
+      with an ObjectTracker) the sequential count is the streak of the best tracked
+      object in range.  Rules may require or exclude zones like EventDetector, against
+      the zone occupancy of a Subscriber with zones: zone names are columns of boolean
+      rules x zones matrices.
+
+      A DetectorBank can replace the event detector of a Subscriber: detect() returns
+      the list of fired rule ids (empty, so false, if none), and event_metadata the
+      list of their EventMetadata, each with its rule_id.
+
+    Example:
+      bank = DetectorBank()
+      bank.add_rule('small', min_contour_area_px=200, max_contour_area_px=2000)
+      bank.add_rule('person', min_contour_area_px=5000, min_sequential_frames=3,
+                    time_between_triggers_s=10.)
+      subscriber = Subscriber(event_detector=bank, handler=handler)
+'''
+class DetectorBank():
+
+    def __init__(self, match='largest'):
+        if match not in ('largest', 'any'):
+            raise ValueError("Unknown match mode '" + str(match) + "'")
+        self.match = match
+        self.rule_ids = list()
+        # Rule parameters
+        self.min_area = np.zeros(0)
+        self.max_area = np.zeros(0)
+        self.min_sequential_frames = np.zeros(0, dtype=np.int64)
+        self.time_between_triggers_s = np.zeros(0)
+        # Rules x zones (zone_names) required / excluded, and the occupied area threshold
+        self.zone_names = list()
+        self.require_zones = np.zeros((0, 0), dtype=bool)
+        self.exclude_zones = np.zeros((0, 0), dtype=bool)
+        self.min_zone_area = np.zeros(0)
+        # Rule state
+        self.trigger_count = np.zeros(0, dtype=np.int64)
+        self.last_event_time = np.zeros(0)
+        self.event_metadata = list()
+        self.last_activity_time = time.time()
+
+    def __len__(self):
+        return len(self.rule_ids)
+
+    '''
+        add_rule(self, rule_id=None, min_contour_area_px=500, max_contour_area_px=50000,
+                 min_sequential_frames=1, time_between_triggers_s=1.0,
+                 require_zones=None, exclude_zones=None, min_zone_area_px=100)
+
+        Description:
+          Adds a rule and returns its id (default: the rule's index).  Parameters are
+          those of EventDetector.
+    '''
+    def add_rule(self, rule_id=None, min_contour_area_px=500, max_contour_area_px=50000,
+                 min_sequential_frames=1, time_between_triggers_s=1.0,
+                 require_zones=None, exclude_zones=None, min_zone_area_px=100):
+        if rule_id is None:
+            rule_id = len(self.rule_ids)
+        if rule_id in self.rule_ids:
+            raise ValueError("Duplicate rule id '" + str(rule_id) + "'")
+        require_zones = list() if require_zones is None else list(require_zones)
+        exclude_zones = list() if exclude_zones is None else list(exclude_zones)
+        for name in require_zones + exclude_zones:
+            self._zone_index(name)
+        self.require_zones = np.append(self.require_zones,
+                                       [[name in require_zones for name in self.zone_names]],
+                                       axis=0)
+        self.exclude_zones = np.append(self.exclude_zones,
+                                       [[name in exclude_zones for name in self.zone_names]],
+                                       axis=0)
+        self.min_zone_area = np.append(self.min_zone_area, min_zone_area_px)
+        self.rule_ids.append(rule_id)
+        self.min_area = np.append(self.min_area, min_contour_area_px)
+        self.max_area = np.append(self.max_area, max_contour_area_px)
+        self.min_sequential_frames = np.append(self.min_sequential_frames,
+                                               min_sequential_frames)
+        self.time_between_triggers_s = np.append(self.time_between_triggers_s,
+                                                 time_between_triggers_s)
+        self.trigger_count = np.append(self.trigger_count, 0)
+        # Like EventDetector, the debounce starts when the rule is created
+        self.last_event_time = np.append(self.last_event_time, time.time())
+        return rule_id
+
+    # Column of a zone in the rules x zones matrices, added for new zone names
+    def _zone_index(self, name):
+        if name not in self.zone_names:
+            self.zone_names.append(name)
+            column = np.zeros((len(self.require_zones), 1), dtype=bool)
+            self.require_zones = np.append(self.require_zones, column, axis=1)
+            self.exclude_zones = np.append(self.exclude_zones, column, axis=1)
+        return self.zone_names.index(name)
+
+    # Rules whose zone criteria the frame's zone occupancy meets
+    def _meets_zone_criteria(self, zones):
+        if len(self.zone_names) == 0:
+            return np.ones(len(self.rule_ids), dtype=bool)
+        if zones is None:
+            zones = dict()
+        area = np.array([zones.get(name, 0) for name in self.zone_names], dtype=np.float64)
+        occupied = area[None,:] >= self.min_zone_area[:,None]
+        return ~(self.require_zones & ~occupied).any(axis=1) & \
+               ~(self.exclude_zones & occupied).any(axis=1)
+
+    # Smallest region area any rule responds to (see Subscriber.note_activity)
+    @property
+    def min_contour_area_px(self):
+        return float(self.min_area.min()) if len(self.min_area) > 0 else 0.
+
+    # True if any rule is past its debounce time
+    def detection_ready(self):
+        now = time.time()
+        return bool(np.any(now - self.last_event_time >= self.time_between_triggers_s))
+
+    '''
+        detect(self, contours, tracks=None, zones=None)
+
+        Description:
+          Updates every rule with one frame's detection regions (and zone occupancy, a
+          dict of zone name : detected area) and returns the ids of the rules that
+          fired, in rule order.
+    '''
+    def detect(self, contours, tracks=None, zones=None):
+        self.event_metadata = list()
+        if contours is None or len(self.rule_ids) == 0:
+            return []
+        if tracks is not None:
+            areas = np.array([track.area for track in tracks], dtype=np.float64)
+            streaks = np.array([track.streak for track in tracks], dtype=np.int64)
+        else:
+            areas = cvu.contour_stats(contours).area
+            if self.match == 'largest' and len(areas) > 0:
+                areas = areas[np.argmax(areas)][None]
+        # Rules x regions: region in the rule's area range
+        in_range = ((areas[None,:] > self.min_area[:,None]) &
+                    (areas[None,:] < self.max_area[:,None]))
+        # A rule failing its zone criteria is not met, and its sequential count restarts
+        in_range &= self._meets_zone_criteria(zones)[:,None]
+        met = in_range.any(axis=1)
+        # Largest area in range per rule (metadata)
+        best_area = np.where(in_range, areas[None,:], 0.).max(axis=1, initial=0.)
+
+        now = time.time()
+        best = None
+        if tracks is not None and len(tracks) > 0:
+            # Longest streak in range, larger area first among equal streaks
+            score = np.where(in_range, streaks[None,:]*1e12 + areas[None,:], -1.)
+            best = np.argmax(score, axis=1)
+            count = np.where(met, streaks[best], 0)
+            best_area = np.where(met, areas[best], 0.)
+        elif tracks is not None:
+            count = np.zeros(len(met), dtype=np.int64)
+        else:
+            count = np.where(met, self.trigger_count + 1, 0)
+        if np.any(met):
+            self.last_activity_time = now
+        delta_t = now - self.last_event_time
+        fired = met & (delta_t >= self.time_between_triggers_s) & \
+                (count >= self.min_sequential_frames)
+        self.trigger_count = np.where(fired, 0, count)
+        self.last_event_time = np.where(fired, now, self.last_event_time)
+
+        indices = np.flatnonzero(fired)
+        for i in indices:
+            track = None if best is None else tracks[best[i]]
+            metadata = EventMetadata(max_contour_area=best_area[i],
+                                     n_seq_frames=int(count[i]),
+                                     time_between_triggers_s=delta_t[i],
+                                     n_contours=len(contours),
+                                     track=copy.copy(track),
+                                     zones=None if zones is None else dict(zones))
+            metadata.rule_id = self.rule_ids[i]
+            self.event_metadata.append(metadata)
+        return [self.rule_ids[i] for i in indices]
+
+    # Copies get their own rule state (e.g. one bank per TrackerGroup stream)
+    def __copy__(self):
+        bank = DetectorBank.__new__(DetectorBank)
+        bank.__dict__.update(self.__dict__)
+        bank.rule_ids = list(self.rule_ids)
+        bank.zone_names = list(self.zone_names)
+        for name in ('min_area', 'max_area', 'min_sequential_frames',
+                     'time_between_triggers_s', 'require_zones', 'exclude_zones',
+                     'min_zone_area', 'trigger_count', 'last_event_time'):
+            setattr(bank, name, getattr(self, name).copy())
+        bank.event_metadata = list()
+        return bank
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+
+#imports
+import time
+import logging
+from collections import deque
+from threading import Thread, Condition
+
+log = logging.getLogger(__name__)
+
+# Overflow policies for a full lane:
+#
+# DROP_OLDEST - discard the oldest queued item to make room for the new one
+# DROP_NEWEST - discard the new item, keep what is already queued
+# BLOCK       - make the producer wait until the lane has room
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+'''
+    class Lane
+
+    Description:
+      Bounded FIFO of pending work for a single consumer (typically one Subscriber).
+      Items in a lane are run strictly in order and never concurrently, so the
+      consumer can keep per-frame state without locking.  Lanes are executed by
+      the worker threads of the Dispatcher they are registered with.
+'''
+class Lane:
+
+    '''
+        Initialize Lane object.
+
+        Arguments:
+          target          : callable invoked with the submitted arguments
+          name            : str, lane name used in heartbeat / stats output
+          maxsize         : int, default=2.  Maximum number of queued (not yet running) items.
+          overflow_policy : one of DROP_OLDEST (default), DROP_NEWEST or BLOCK
+          group           : default=None.  Lanes of the same group (e.g. one video stream)
+                            share one fair-share slot on the dispatcher.
+          priority        : float, default=1.  Share weight of the lane's group: when workers
+                            are saturated a priority 2 group runs twice as many items as a
+                            priority 1 group.
+    '''
+    def __init__(self, target, name='lane', maxsize=2,
+                 overflow_policy=DROP_OLDEST, group=None, priority=1):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy '" + str(overflow_policy) +
+                             "', expected one of " + str(OVERFLOW_POLICIES))
+        if maxsize < 1:
+            raise ValueError("Lane maxsize must be at least 1.")
+        if priority <= 0:
+            raise ValueError("Lane priority must be positive.")
+        self.target = target
+        self.name = name
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+        self.group = group
+        self.priority = priority
+        self.n_submitted = 0
+        self.n_dropped = 0
+        self.n_done = 0
+        self._items = deque()
+        self._busy = False
+        self._scheduled = False
+
+    def depth(self):
+        return len(self._items)
+
+    def stats(self):
+        return { 'depth' : self.depth(),
+                 'maxsize' : self.maxsize,
+                 'submitted' : self.n_submitted,
+                 'dropped' : self.n_dropped,
+                 'done' : self.n_done }
+
+    def __str__(self):
+        return ("[" + self.name + "] q=" + str(self.depth()) + "/" + str(self.maxsize) +
+                " drop=" + str(self.n_dropped))
+
+'''
+    class Dispatcher
+
+    Description:
+      Long-lived pool of worker threads executing work queued on Lanes.  A lane with
+      pending items is put on a ready queue and picked up by the next idle worker, which
+      runs exactly one item before handing the lane back.  This keeps the number of
+      threads fixed no matter how fast frames arrive or how slow a consumer is.
+
+      Ready lanes are served round-robin by lane group, weighted by group priority
+      (start-time fair queuing on items run), so one busy stream cannot starve the
+      others sharing the pool.  Lanes without a group share a single slot and run in
+      FIFO order.
+
+      n_workers : int, default=None.  Size of the worker pool.  None starts one
+                  dedicated worker per registered lane.
+'''
+class Dispatcher:
+
+    def __init__(self, n_workers=None, name='dispatcher'):
+        self.n_workers = n_workers
+        self.name = name
+        self.lanes = list()
+        self._cond = Condition()
+        self._ready = deque()
+        # Fair-share virtual time per lane group
+        self._vtime = dict()
+        self._vclock = 0.
+        self._workers = list()
+        self._stopped = False
+        if n_workers is not None:
+            for i in range(0, n_workers):
+                self._start_worker()
+
+    def _start_worker(self):
+        worker = Thread(target=self._work, args=(),
+                        name=self.name + '-' + str(len(self._workers)),
+                        daemon=True)
+        self._workers.append(worker)
+        worker.start()
+
+    '''
+        add_lane(self, lane)
+
+        Description:
+          Registers a lane with the dispatcher.  With a per-lane pool (n_workers=None)
+          a dedicated worker thread is started for it.
+    '''
+    def add_lane(self, lane):
+        with self._cond:
+            self.lanes.append(lane)
+        if self.n_workers is None:
+            self._start_worker()
+        return lane
+
+    '''
+        submit(self, lane, *args)
+
+        Description:
+          Queues a call lane.target(*args).  Returns True if the item was queued, False
+          if it was dropped by the lane's DROP_NEWEST policy (or the dispatcher is stopped).
+    '''
+    def submit(self, lane, *args):
+        with self._cond:
+            if self._stopped:
+                return False
+            if len(lane._items) >= lane.maxsize:
+                if lane.overflow_policy == DROP_NEWEST:
+                    lane.n_dropped += 1
+                    return False
+                elif lane.overflow_policy == DROP_OLDEST:
+                    lane._items.popleft()
+                    lane.n_dropped += 1
+                else:
+                    while len(lane._items) >= lane.maxsize and not self._stopped:
+                        self._cond.wait()
+                    if self._stopped:
+                        return False
+            lane._items.append(args)
+            lane.n_submitted += 1
+            if not lane._busy and not lane._scheduled:
+                lane._scheduled = True
+                self._ready.append(lane)
+            self._cond.notify_all()
+        return True
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._ready and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                lane = self._next_lane()
+                lane._scheduled = False
+                lane._busy = True
+                args = lane._items.popleft()
+                # Wake producers blocked on a full lane
+                self._cond.notify_all()
+            try:
+                lane.target(*args)
+            except Exception:
+                log.exception("[" + lane.name + "] unhandled exception in worker")
+            finally:
+                with self._cond:
+                    lane._busy = False
+                    lane.n_done += 1
+                    if lane._items and not lane._scheduled:
+                        lane._scheduled = True
+                        self._ready.append(lane)
+                    self._cond.notify_all()
+                # Don't hold on to the item's arguments (e.g. pinned frames) while idle
+                args = None
+
+    # Ready lane of the group with the least weighted service so far
+    def _next_lane(self):
+        if len(self._ready) == 1:
+            lane = self._ready.popleft()
+        else:
+            lane = min(self._ready, key=lambda lane: self._vtime.get(lane.group, 0.))
+            self._ready.remove(lane)
+        # A group returning from idle starts at the current virtual clock, with no credit
+        start = max(self._vtime.get(lane.group, 0.), self._vclock)
+        self._vclock = start
+        self._vtime[lane.group] = start + 1./lane.priority
+        return lane
+
+    # True if no lane has queued or running work
+    def idle(self):
+        with self._cond:
+            return self._idle()
+
+    def _idle(self):
+        return all([len(lane._items) == 0 and not lane._busy for lane in self.lanes])
+
+    '''
+        wait_idle(self, timeout=None)
+
+        Description:
+          Blocks until every lane is empty and no item is running.  Returns False if the
+          timeout (seconds) expired first.
+    '''
+    def wait_idle(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._idle():
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+        return True
+
+    '''
+        stats(self)
+
+        Description:
+          Returns a dict of per-lane counters keyed by lane name.
+    '''
+    def stats(self):
+        with self._cond:
+            return { lane.name : lane.stats() for lane in self.lanes }
+
+    def stop(self, timeout=1.0):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        deadline = time.time() + timeout
+        for worker in self._workers:
+            worker.join(max(0., deadline-time.time()))
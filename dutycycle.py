@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+
+#imports
+import time
+import cv2
+import numpy as np
+
+ACTIVE = 'active'
+IDLE = 'idle'
+
+'''
+    class DutyCycle
+
+    Description:
+      Adaptive frame rate scheduler for a Tracker (Tracker(duty_cycle=DutyCycle())).
+      While every subscriber's event detector has been quiet for idle_after_s, the
+      tracker goes idle: frames are captured at probe_fps only and, instead of the
+      subscribers' frame processing, a cheap motion probe compares each frame with the
+      previous one at probe_width pixels wide.  When wake_frames probes in a row see
+      changed pixels over probe_min_fraction of the image, the tracker goes back to
+      full rate and resolution, starting with the frame that woke it.
+
+      Hysteresis comes from idle_after_s (quiet time before idling) and wake_frames /
+      probe_min_fraction (evidence needed to wake).  Scheduling is by wall clock, so it
+      is meant for live cameras.  One DutyCycle per Tracker.
+
+      idle_after_s       : float, seconds without detector activity before going idle
+      probe_fps          : float, probe rate while idle
+      probe_width        : int, probe image width in pixels (height keeps the aspect ratio)
+      probe_threshold    : int, per-pixel gray level change counted as motion
+      probe_min_fraction : float, fraction of changed probe pixels that counts as activity
+      wake_frames        : int, consecutive active probes needed to wake
+'''
+class DutyCycle():
+
+    def __init__(self, idle_after_s=30., probe_fps=2., probe_width=160,
+                 probe_threshold=25, probe_min_fraction=0.002, wake_frames=1):
+        self.idle_after_s = idle_after_s
+        self.probe_fps = probe_fps
+        self.probe_width = probe_width
+        self.probe_threshold = probe_threshold
+        self.probe_min_fraction = probe_min_fraction
+        self.wake_frames = wake_frames
+        self.mode = ACTIVE
+        self.n_probes = 0
+        self.n_wakeups = 0
+        self.n_sleeps = 0
+        self.next_probe_time = 0.
+        self._mode_start = time.time()
+        self._time_in_mode = { ACTIVE : 0., IDLE : 0. }
+        self._wake_count = 0
+        # Preallocated probe buffers
+        self._small = None
+        self._gray = None
+        self._prev = None
+        self._diff = None
+
+    @property
+    def idle(self):
+        return self.mode == IDLE
+
+    def _set_mode(self, mode, now):
+        self._time_in_mode[self.mode] += now - self._mode_start
+        self._mode_start = now
+        self.mode = mode
+
+    '''
+        update(self, subscribers, now=None)
+
+        Description:
+          Called for each frame processed in active mode; goes idle once no subscriber's
+          event detector has seen activity for idle_after_s.
+    '''
+    def update(self, subscribers, now=None):
+        if now is None:
+            now = time.time()
+        last_activity = max([self._mode_start] +
+                            [subscriber.last_activity_time for subscriber in subscribers])
+        if now - last_activity < self.idle_after_s:
+            return
+        self._set_mode(IDLE, now)
+        self.n_sleeps += 1
+        self._wake_count = 0
+        self._prev = None
+        self.next_probe_time = now
+
+    '''
+        probe(self, frame, now=None)
+
+        Description:
+          Called while idle for each probe frame.  Returns True (and goes active) if the
+          probe saw enough activity to wake the tracker.
+    '''
+    def probe(self, frame, now=None):
+        if now is None:
+            now = time.time()
+        self.n_probes += 1
+        self.next_probe_time = max(self.next_probe_time + 1./self.probe_fps, now)
+        if not self._motion(frame):
+            self._wake_count = 0
+            return False
+        self._wake_count += 1
+        if self._wake_count < self.wake_frames:
+            return False
+        self._set_mode(ACTIVE, now)
+        self.n_wakeups += 1
+        return True
+
+    # Fraction of probe pixels changed since the previous probe over probe_min_fraction
+    def _motion(self, frame):
+        height = max(1, int(frame.shape[0]*self.probe_width/frame.shape[1]))
+        if self._small is None or self._small.shape[0] != height:
+            self._small = np.empty((height, self.probe_width) + frame.shape[2:], frame.dtype)
+            self._gray = np.empty((height, self.probe_width), frame.dtype)
+            self._diff = np.empty((height, self.probe_width), frame.dtype)
+            self._prev = None
+        cv2.resize(frame, (self.probe_width, height), dst=self._small,
+                   interpolation=cv2.INTER_AREA)
+        if self._small.ndim == 3:
+            cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        else:
+            np.copyto(self._gray, self._small)
+        if self._prev is None:
+            self._prev = self._gray.copy()
+            return False
+        cv2.absdiff(self._gray, self._prev, dst=self._diff)
+        self._prev, self._gray = self._gray, self._prev
+        cv2.threshold(self._diff, self.probe_threshold, 255, cv2.THRESH_BINARY, dst=self._diff)
+        return cv2.countNonZero(self._diff) > self.probe_min_fraction*self._diff.size
+
+    # Seconds spent in each mode so far
+    def time_in_mode(self):
+        times = dict(self._time_in_mode)
+        times[self.mode] += time.time() - self._mode_start
+        return times
+
+    def stats(self):
+        times = self.time_in_mode()
+        total = max(sum(times.values()), 1e-9)
+        return { 'mode' : self.mode,
+                 'active_s' : times[ACTIVE],
+                 'idle_s' : times[IDLE],
+                 'idle_fraction' : times[IDLE]/total,
+                 'probes' : self.n_probes,
+                 'wakeups' : self.n_wakeups,
+                 'sleeps' : self.n_sleeps }
+
+    def __str__(self):
+        times = self.time_in_mode()
+        return (self.mode + " active=" + str(np.round(times[ACTIVE],1)) + "s idle=" +
+                str(np.round(times[IDLE],1)) + "s wakeups=" + str(self.n_wakeups))
@@ -4,7 +4,7 @@ from cv2utils.tracker import Tracker, Handler, EventDetector
 #from cv2utils.frameprocessor import MotionProcessor
 #from cv2utils.subscriber import Subscriber
 #import cv2utils.cv2utils as cvu
-import os
+from cv2utils.actuator import ProcessChannel
 import numpy as np
 import logging
 import random
@@ -13,7 +13,7 @@ class EspeakController(Handler):
 
     def __init__(self, flags='-v en+f4 -p 60 -s 170',
                  speech_items=['hello!', 'goodbye!'],
-                 sequential=False):
+                 sequential=False, channel=None):
         """
         Initialize EspeakController
 
@@ -22,18 +22,22 @@ class EspeakController(Handler):
             flags - espeak command line flags for voice control
             speech_items - list of speech items
             sequential - if True, will loop through items.  If false, will randomize.
+            channel - ActuatorChannel taking one speech item per command.  Default=None
+                      starts a persistent 'espeak <flags>' process, which speaks each
+                      line as it arrives on stdin.  (--stdin would make espeak wait
+                      for end of input before speaking.)
         """
 
         # Servo position indicators, in increments of 100us pulse widths
         self.flags = flags
         self._speech_items=speech_items
         self.sequential = sequential
+        self.channel = channel
         self._idx = 0;
 
     def handle(self, contours, frame_buf, frame_index):
 
         log = Tracker.get_logger()
-        imsize = frame_buf[frame_index].shape
         idx = 0
 
         if self.sequential is True:
@@ -50,8 +54,8 @@ class EspeakController(Handler):
     def _speak(self, idx=0):
         if len(self._speech_items) == 0:
             return
-        #os.system("espeak " + self.flags + " '" +
-        #          self._speech_items[idx] + "' --stdout | aplay &")
-        os.system("espeak " + self.flags + " '" +
-                  self._speech_items[idx] + "' &")
+        if self.channel is None:
+            self.channel = ProcessChannel(['espeak'] + self.flags.split(), name='espeak')
+        # An item still queued behind the channel is replaced by the newest one
+        self.channel.send(self._speech_items[idx], key='speech')
 
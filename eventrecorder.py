@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+
+#imports
+import os
+import time
+import logging
+from collections import deque
+from threading import Lock
+import cv2
+import numpy as np
+
+import cv2utils.cv2utils as cvu
+from cv2utils.tracker import Handler
+from cv2utils.dispatcher import Dispatcher, Lane, DROP_OLDEST, BLOCK
+
+log = logging.getLogger(__name__)
+
+# An event clip being recorded until end_time.  frames holds encoded frames not yet
+# handed to the writer (the pre-roll, at first); the file is only touched by the writer.
+class _Clip():
+
+    def __init__(self, event_time, end_time, frames, n_events=1):
+        self.event_time = event_time
+        self.end_time = end_time
+        self.frames = frames
+        self.n_events = n_events
+        self.n_frames = 0
+        self.write_s = 0.
+        self.path = None
+        self.output = None
+
+# Disk quota shared by the recorders of a TrackerGroup's streams: one budget over all
+# their clips, applied under one lock, never deleting a clip still being written.
+class _Quota():
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.lock = Lock()
+        self.open_paths = set()
+
+'''
+    class EventRecorder
+
+    Description:
+      Handler recording a video clip around each event: the pre_roll_s seconds before
+      it and the post_roll_s seconds after the last event of the clip (events during
+      the post-roll extend the clip).
+
+      Every processed frame (via the Subscriber's on_frame hook) is subsampled to fps,
+      JPEG-encoded on a background thread and kept in a pre-roll ring bounded by time
+      and by max_preroll_bytes.  While a clip is recording its frames are streamed to
+      the file by a second background thread as they are encoded, so memory use is
+      fixed however long the clip runs; clips longer than max_clip_s continue in a new
+      file.  After each clip the clip directory is trimmed to the disk quota, keeping
+      the newest clip.  Detection and handler threads never encode or write.
+
+      directory       : str, directory for clips (created if missing)
+      pre_roll_s      : float, seconds kept before an event
+      post_roll_s     : float, seconds recorded after the last event
+      fps             : float, recorded frame rate (frames are subsampled to it)
+      jpeg_quality    : int, 0-100
+      container       : 'mjpeg' writes the JPEG frames as is to a .mjpeg stream (no
+                        re-encoding; plays in ffplay / VLC); 'video' re-encodes them with
+                        cv2.VideoWriter using fourcc into an .avi file
+      max_preroll_bytes : int, memory bound on the pre-roll ring
+      max_clip_s      : float, default=300.  Clips are split into files of at most this
+                        many seconds after the event, so the disk quota can reclaim them.
+      max_disk_bytes, max_clips, min_free_bytes : disk quota, see
+                        cv2utils.enforce_disk_quota.  Oldest clips are deleted first;
+                        the clip just written is always kept.  The recorders made by
+                        for_stream() share one quota over all the streams' clips.
+'''
+class EventRecorder(Handler):
+
+    def __init__(self, directory='events', pre_roll_s=5., post_roll_s=5., fps=10.,
+                 jpeg_quality=80, container='mjpeg', fourcc='MJPG',
+                 max_preroll_bytes=64*2**20, max_disk_bytes=2**30, max_clips=None,
+                 min_free_bytes=256*2**20, prefix='event_', max_clip_s=300.):
+        if container not in ('mjpeg', 'video'):
+            raise ValueError("Unknown container '" + str(container) + "'")
+        self.directory = directory
+        self.pre_roll_s = pre_roll_s
+        self.post_roll_s = post_roll_s
+        self.fps = fps
+        self.jpeg_quality = jpeg_quality
+        self.container = container
+        self.fourcc = fourcc
+        self.max_preroll_bytes = max_preroll_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_clips = max_clips
+        self.min_free_bytes = min_free_bytes
+        self.prefix = prefix
+        self.max_clip_s = max_clip_s
+        self.n_clips = 0
+        self.n_evicted = 0
+        self._lock = Lock()
+        # (timestamp, jpeg bytes)
+        self._preroll = deque()
+        self._preroll_bytes = 0
+        self._clip = None
+        self._last_time = None
+        self._quota = _Quota(prefix + '*')
+        os.makedirs(directory, exist_ok=True)
+        self._dispatcher = Dispatcher(name='recorder')
+        # A backed-up encoder drops the oldest raw frames; a backed-up writer holds up the
+        # encoder, so encoded clip frames are never dropped
+        self._encode_lane = self._dispatcher.add_lane(
+            Lane(self._encode, name='recorder:encode', maxsize=4, overflow_policy=DROP_OLDEST))
+        self._write_lane = self._dispatcher.add_lane(
+            Lane(self._write, name='recorder:write', maxsize=4, overflow_policy=BLOCK))
+
+    # Every processed frame: subsample, copy out of the frame ring and queue for encoding
+    def on_frame(self, contours, frame_buf, frame_index):
+        timestamp = self._timestamp(frame_buf)
+        if self._last_time is not None and timestamp - self._last_time < 0.9/self.fps:
+            return
+        frame = frame_buf[frame_index]
+        if frame is None:
+            return
+        self._last_time = timestamp
+        self._dispatcher.submit(self._encode_lane, timestamp, np.array(frame))
+
+    def handle(self, contours, frame_buf, frame_index):
+        timestamp = self._timestamp(frame_buf)
+        with self._lock:
+            if self._clip is not None:
+                self._clip.end_time = max(self._clip.end_time, timestamp + self.post_roll_s)
+                self._clip.n_events += 1
+                return
+            start = timestamp - self.pre_roll_s
+            frames = [(t, data) for (t, data) in self._preroll if t >= start]
+            self._clip = _Clip(timestamp, timestamp + self.post_roll_s, frames)
+
+    def _timestamp(self, frame_buf):
+        timestamp = frame_buf.timestamp() if hasattr(frame_buf, 'timestamp') else None
+        return time.time() if timestamp is None else timestamp
+
+    def _encode(self, timestamp, frame):
+        ret, data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ret:
+            return
+        data = data.tobytes()
+        # (clip, frames, finished) for the writer
+        writes = list()
+        with self._lock:
+            self._preroll.append((timestamp, data))
+            self._preroll_bytes += len(data)
+            while len(self._preroll) > 0 and (
+                    self._preroll[0][0] < timestamp - self.pre_roll_s or
+                    self._preroll_bytes > self.max_preroll_bytes):
+                self._preroll_bytes -= len(self._preroll.popleft()[1])
+            clip = self._clip
+            if clip is not None:
+                if timestamp > clip.end_time:
+                    writes.append((clip, clip.frames, True))
+                    self._clip = None
+                elif timestamp - clip.event_time > self.max_clip_s:
+                    # Roll over: the recording continues in a new file
+                    writes.append((clip, clip.frames, True))
+                    self._clip = _Clip(timestamp, clip.end_time, list(), 0)
+                    writes.append((self._clip, [(timestamp, data)], False))
+                else:
+                    clip.frames.append((timestamp, data))
+                    writes.append((clip, clip.frames, False))
+                clip.frames = list()
+        for (clip, frames, finished) in writes:
+            self._dispatcher.submit(self._write_lane, clip, frames, finished)
+
+    # Writer thread: appends frames to the clip's file, opened on its first frames, and
+    # closes it (and applies the disk quota) when the clip is finished
+    def _write(self, clip, frames, finished):
+        start = time.time()
+        for (timestamp, data) in frames:
+            if self.container == 'mjpeg':
+                if clip.output is None:
+                    clip.path = self._open_path(clip, ".mjpeg")
+                    clip.output = open(clip.path, 'wb')
+                clip.output.write(data)
+            else:
+                frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if clip.output is None:
+                    clip.path = self._open_path(clip, ".avi")
+                    clip.output = cv2.VideoWriter(clip.path, cv2.VideoWriter_fourcc(*self.fourcc),
+                                                  self.fps, (frame.shape[1], frame.shape[0]))
+                clip.output.write(frame)
+            clip.n_frames += 1
+        clip.write_s += time.time() - start
+        if not finished or clip.output is None:
+            return
+        if self.container == 'mjpeg':
+            clip.output.close()
+        else:
+            clip.output.release()
+        clip.output = None
+        self.n_clips += 1
+        log.info("Wrote " + clip.path + " (" + str(clip.n_frames) + " frames, " +
+                 str(clip.n_events) + " events, " + str(np.round(clip.write_s,2)) + "s)")
+        # The clip just written is kept even if the disk is short of min_free_bytes
+        with self._quota.lock:
+            self._quota.open_paths.discard(clip.path)
+            evicted = cvu.enforce_disk_quota(self.directory, max_bytes=self.max_disk_bytes,
+                                             max_files=self.max_clips,
+                                             min_free_bytes=self.min_free_bytes,
+                                             pattern=self._quota.pattern,
+                                             keep=self._quota.open_paths | {clip.path})
+        self.n_evicted += len(evicted)
+        for path in evicted:
+            log.info("Disk quota: removed " + path)
+
+    # Path for a clip's file, protected from the quota until the clip is finished
+    def _open_path(self, clip, ext):
+        path = self._clip_path(clip, ext)
+        with self._quota.lock:
+            self._quota.open_paths.add(path)
+        return path
+
+    def _clip_path(self, clip, ext):
+        name = (self.prefix + time.strftime("%Y-%m-%d_%H_%M_%S", time.localtime(clip.event_time)) +
+                "_" + "%03d" % int(1000*(clip.event_time % 1)))
+        return os.path.join(self.directory, name + ext)
+
+    '''
+        flush(self, timeout=None)
+
+        Description:
+          Ends the clip being recorded (if any) and waits until all clips are written.
+    '''
+    def flush(self, timeout=None):
+        self._dispatcher.wait_idle(timeout)
+        with self._lock:
+            clip = self._clip
+            self._clip = None
+            if clip is not None:
+                frames = clip.frames
+                clip.frames = list()
+        if clip is not None:
+            self._dispatcher.submit(self._write_lane, clip, frames, True)
+        return self._dispatcher.wait_idle(timeout)
+
+    def close(self, timeout=5.):
+        self.flush(timeout)
+        self._dispatcher.stop()
+
+    # Recorder for one stream of a TrackerGroup: same settings, its own pre-roll, clip
+    # and writer, and clips named <prefix><stream_name>_..., under this recorder's quota
+    def for_stream(self, stream_name):
+        recorder = EventRecorder(directory=self.directory, pre_roll_s=self.pre_roll_s,
+                             post_roll_s=self.post_roll_s, fps=self.fps,
+                             jpeg_quality=self.jpeg_quality, container=self.container,
+                             fourcc=self.fourcc, max_preroll_bytes=self.max_preroll_bytes,
+                             max_disk_bytes=self.max_disk_bytes, max_clips=self.max_clips,
+                             min_free_bytes=self.min_free_bytes,
+                             prefix=self.prefix + stream_name + '_',
+                             max_clip_s=self.max_clip_s)
+        recorder._quota = self._quota
+        return recorder
+
+    def stats(self):
+        with self._lock:
+            return { 'clips' : self.n_clips,
+                     'evicted' : self.n_evicted,
+                     'preroll_frames' : len(self._preroll),
+                     'preroll_bytes' : self._preroll_bytes,
+                     'recording' : self._clip is not None,
+                     'encoder' : self._encode_lane.stats(),
+                     'writer' : self._write_lane.stats() }
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+
+from cv2utils.asynctracker import AsyncTracker
+from cv2utils.tracker import Tracker, EventDetector
+from cv2utils.frameprocessor import MotionProcessor
+from cv2utils.framesource import UsbSource
+from cv2utils.subscriber import Subscriber
+import asyncio
+import logging
+
+# Async handler: runs on the event loop, so it can await network / actuator I/O
+class NotifyHandler():
+
+    async def handle(self, contours, frame_buf, frame_index):
+        log = Tracker.get_logger()
+        log.info("Motion in " + str(len(contours)) + " regions")
+        await asyncio.sleep(0.1)
+
+async def main():
+    async with AsyncTracker(vflip=True, hflip=True) as tracker:
+        detector = EventDetector(time_between_triggers_s=2.0,
+                                 min_sequential_frames=2,
+                                 min_contour_area_px=500,
+                                 max_contour_area_px=50000)
+        tracker.add_subscriber(Subscriber(handler=NotifyHandler(),
+                                          frame_processor=MotionProcessor(),
+                                          event_detector=detector,
+                                          name="Notify"))
+        await tracker.start(UsbSource(0))
+        # Replaces the `while True: time.sleep(60)` main loop; other coroutines
+        # (network, actuator control) share this event loop
+        async for frame, events in tracker.stream():
+            for event in events:
+                print(event)
+
+log = Tracker.get_logger()
+log.level = logging.INFO
+asyncio.run(main())
@@ -0,0 +1,409 @@
+#!/usr/bin/python3
+
+#imports
+import copy
+import time
+import itertools
+import numpy as np
+from threading import Condition
+from multiprocessing import shared_memory
+
+import cv2utils.cv2utils as cvu
+
+# Ids of frame rings and buffers in derived image cache keys; unlike id(), never reused
+_cache_ids = itertools.count()
+
+'''
+    class FrameRing
+
+    Description:
+      Preallocated ring of video frames owned by the Tracker.  The capture thread reads
+      each new frame directly into the next slot (begin_write / commit), so steady-state
+      capture does no per-frame allocation and memory use is constant.  Every committed
+      frame gets a monotonically increasing sequence number; readers get read-only views
+      by sequence number, and a view request for a frame whose slot has since been
+      reused returns None.
+
+      Frames are shared between all subscribers, so handlers that draw on a frame must
+      ask for a private copy through writable() (copy-on-write) instead of drawing on
+      the shared view.
+
+      Readers pin the frames they are using (a FrameWindow pins its frames until it is
+      released or garbage collected), and begin_write() waits for a pinned slot to be
+      unpinned instead of overwriting it, so a frame never changes under a reader.  The
+      ring size then only decides how far capture can run ahead of the slowest reader
+      before it has to wait.
+
+      A ring allocated with shared=True lives in multiprocessing shared memory, frame
+      sequence numbers included, so worker processes can read frames without copying
+      them.  Pickling a shared ring (e.g. to a spawned worker) attaches to the same
+      memory block instead of copying the frames.
+'''
+class FrameRing:
+
+    '''
+        Initialize FrameRing object.
+
+        Arguments:
+          size : int, number of frame slots.  Must cover the deepest frame buffer plus
+                 every frame that can be queued or in flight between capture and handlers.
+    '''
+    def __init__(self, size):
+        if size < 2:
+            raise ValueError("Frame ring requires at least 2 slots.")
+        self.size = size
+        self.seq = -1
+        self.id = next(_cache_ids)
+        self._frames = None
+        self._shm = None
+        self._owner = True
+        self._slot_seq = np.full(size, -1, dtype=np.int64)
+        self._timestamps = np.zeros(size, dtype=np.float64)
+        self._annotated = dict()
+        # Readers per slot; in this process only (the parent pins for worker processes)
+        self._pins = np.zeros(size, dtype=np.int64)
+        self._lock = Condition()
+        self.n_write_waits = 0
+
+    '''
+        allocate(self, shape, dtype=np.uint8, shared=False)
+
+        Description:
+          Preallocates the frame slots for frames of the given shape and dtype.  With
+          shared=True the ring is placed in a multiprocessing shared memory block.
+    '''
+    def allocate(self, shape, dtype=np.uint8, shared=False):
+        # Derived images of every frame in the ring, full frame and analysis crop
+        cvu.derived_image_cache().reserve(self.id, 2*self.size)
+        if not shared:
+            self._frames = np.zeros((self.size,) + tuple(shape), dtype=dtype)
+            return
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self._shm = shared_memory.SharedMemory(create=True,
+                                               size=self.size*(16 + frame_bytes))
+        self._bind(tuple(shape), np.dtype(dtype))
+        self._slot_seq[:] = -1
+
+    # Lay out slot sequence numbers, timestamps and frames in the shared block
+    def _bind(self, shape, dtype):
+        buf = self._shm.buf
+        self._slot_seq = np.ndarray((self.size,), dtype=np.int64, buffer=buf)
+        self._timestamps = np.ndarray((self.size,), dtype=np.float64, buffer=buf,
+                                      offset=8*self.size)
+        self._frames = np.ndarray((self.size,) + shape, dtype=dtype, buffer=buf,
+                                  offset=16*self.size)
+
+    @property
+    def shared(self):
+        return self._shm is not None
+
+    def __getstate__(self):
+        if not self.shared:
+            raise TypeError("Only a shared-memory FrameRing can be passed to another process.")
+        return { 'name' : self._shm.name, 'size' : self.size,
+                 'shape' : self._frames.shape[1:], 'dtype' : self._frames.dtype.str }
+
+    def __setstate__(self, state):
+        self.__init__(state['size'])
+        self._owner = False
+        try:
+            self._shm = shared_memory.SharedMemory(name=state['name'], track=False)
+        except TypeError:
+            # Python < 3.13 registers attached blocks with the resource tracker, which
+            # would unlink the parent's block when this process exits.
+            from multiprocessing import resource_tracker
+            self._shm = shared_memory.SharedMemory(name=state['name'])
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._bind(tuple(state['shape']), np.dtype(state['dtype']))
+
+    '''
+        close(self)
+
+        Description:
+          Drops the ring's cached derived images and releases a shared memory ring (and
+          unlinks it, in the process that created it).
+    '''
+    def close(self):
+        cvu.derived_image_cache().discard(self.id)
+        if self._shm is None:
+            return
+        self._frames = None
+        self._slot_seq = np.full(self.size, -1, dtype=np.int64)
+        self._timestamps = np.zeros(self.size, dtype=np.float64)
+        try:
+            self._shm.close()
+        except BufferError:
+            # A handler still holds a frame view; the mapping goes away with it
+            pass
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+    def allocated(self):
+        return self._frames is not None
+
+    @property
+    def shape(self):
+        return self._frames.shape[1:]
+
+    '''
+        pin(self, seq) / unpin(self, seq)
+
+        Description:
+          pin() keeps frame seq from being overwritten until the matching unpin(), and
+          returns False (pinning nothing) if the frame is no longer in the ring.
+    '''
+    def pin(self, seq):
+        with self._lock:
+            if not self.valid(seq):
+                return False
+            self._pins[seq % self.size] += 1
+            return True
+
+    def unpin(self, seq):
+        with self._lock:
+            self._pins[seq % self.size] -= 1
+            self._lock.notify_all()
+
+    '''
+        begin_write(self, timeout=None)
+
+        Description:
+          Returns the buffer the next frame should be written into.  The slot is marked
+          invalid until commit() so readers never get a half-written frame.  Waits while
+          a reader has the slot's frame pinned; returns None if the timeout (seconds)
+          expired first.
+    '''
+    def begin_write(self, timeout=None):
+        slot = (self.seq + 1) % self.size
+        with self._lock:
+            if self._pins[slot] > 0:
+                self.n_write_waits += 1
+                if not self._lock.wait_for(lambda: self._pins[slot] <= 0, timeout):
+                    return None
+            old_seq = self._slot_seq[slot]
+            self._slot_seq[slot] = -1
+            self._annotated.pop(old_seq, None)
+        return self._frames[slot]
+
+    '''
+        commit(self, timestamp=None)
+
+        Description:
+          Publishes the frame written since begin_write() and returns its sequence number.
+    '''
+    def commit(self, timestamp=None):
+        seq = self.seq + 1
+        slot = seq % self.size
+        with self._lock:
+            self._slot_seq[slot] = seq
+            self._timestamps[slot] = time.time() if timestamp is None else timestamp
+            self.seq = seq
+        return seq
+
+    def valid(self, seq):
+        return seq >= 0 and self._slot_seq[seq % self.size] == seq
+
+    '''
+        get(self, seq)
+
+        Description:
+          Returns a read-only view of frame seq, or None if the frame is not (or no
+          longer) in the ring.
+    '''
+    def get(self, seq):
+        if not self.valid(seq):
+            return None
+        view = self._frames[seq % self.size].view()
+        view.flags.writeable = False
+        return view
+
+    def timestamp(self, seq):
+        if not self.valid(seq):
+            return None
+        return self._timestamps[seq % self.size]
+
+    '''
+        writable(self, seq)
+
+        Description:
+          Copy-on-write access to frame seq.  The first call copies the frame; later calls
+          for the same seq return the same copy, so several annotating handlers draw on
+          one image.  The copy is released when the ring slot is reused.
+    '''
+    def writable(self, seq):
+        with self._lock:
+            if seq in self._annotated:
+                return self._annotated[seq]
+            if not self.valid(seq):
+                return None
+            image = self._frames[seq % self.size].copy()
+            self._annotated[seq] = image
+            return image
+
+    '''
+        latest_annotated(self)
+
+        Description:
+          Returns the newest frame, preferring its annotated copy, for display purposes.
+          Falls back to the newest annotated copy of an earlier frame while handlers for
+          the current one are still running.
+    '''
+    def latest_annotated(self):
+        with self._lock:
+            if len(self._annotated) > 0:
+                return self._annotated[max(self._annotated)]
+        return self.get(self.seq)
+
+    def window(self, seq, length):
+        return FrameWindow(self, seq, length)
+
+    # Slots currently pinned by readers
+    def n_pinned(self):
+        return int(np.count_nonzero(self._pins))
+
+'''
+    class FrameWindow
+
+    Description:
+      Read-only, list-like view of the last `length` frames of a FrameRing ending at
+      sequence number seq.  It keeps the indexing convention of a subscriber frame
+      buffer: frame_buf[frame_index] is the current frame and
+      frame_buf[(frame_index-k) % len(frame_buf)] is the frame k steps earlier.
+
+      The window pins its frames in the ring until release() (or until it is garbage
+      collected), so they cannot be overwritten while it is in use.  Frames that had
+      already left the ring when the window was created read as None.  Keep a
+      snapshot() rather than the window itself to hold on to frames for long.
+'''
+class FrameWindow:
+
+    # Tracks seen in the current frame, set by a Subscriber with an ObjectTracker
+    tracks = None
+    # Detected area per zone in the current frame, set by a Subscriber with zones
+    zones = None
+
+    def __init__(self, ring, seq, length, pin=True):
+        self._ring = ring
+        self.seq = seq
+        self._length = length
+        self.frame_index = seq % length
+        self._pinned = list()
+        if pin:
+            self._pinned = [s for s in range(seq-length+1, seq+1) if ring.pin(s)]
+
+    # Unpins the window's frames; frames read from it afterwards may be overwritten
+    def release(self):
+        pinned, self._pinned = self._pinned, list()
+        for s in pinned:
+            self._ring.unpin(s)
+
+    def __del__(self):
+        self.release()
+
+    def __len__(self):
+        return self._length
+
+    def _seq_at(self, index):
+        return self.seq - ((self.frame_index - index) % self._length)
+
+    def __getitem__(self, index):
+        return self._ring.get(self._seq_at(index % self._length))
+
+    def __iter__(self):
+        for i in range(0, self._length):
+            yield self[i]
+
+    def timestamp(self, index=None):
+        if index is None:
+            index = self.frame_index
+        return self._ring.timestamp(self._seq_at(index % self._length))
+
+    # Identifies the frame at index across windows, for caches of derived images
+    def frame_key(self, index):
+        return (self._ring.id, self._seq_at(index % self._length))
+
+    def writable(self, index):
+        return self._ring.writable(self._seq_at(index % self._length))
+
+    # Private copy of the window that stays valid after the frames leave the ring
+    def snapshot(self):
+        return FrameSnapshot(self)
+
+'''
+    class FrameSnapshot
+
+    Description:
+      Copy of a FrameWindow's frames and timestamps, for consumers that may run after the
+      ring has moved on (asynchronous handlers).  Frames are read-only like the window's;
+      writable() still draws on the ring's shared annotated copy while the frame is in
+      the ring, so annotations reach the display, and on a private copy afterwards.
+'''
+class FrameSnapshot(FrameWindow):
+
+    def __init__(self, window):
+        FrameWindow.__init__(self, window._ring, window.seq, len(window), pin=False)
+        # Tracks keep changing on later frames
+        if window.tracks is not None:
+            self.tracks = [copy.copy(track) for track in window.tracks]
+        if window.zones is not None:
+            self.zones = dict(window.zones)
+        self._frames = list()
+        self._timestamps = list()
+        for i in range(0, len(window)):
+            frame = window[i]
+            if frame is not None:
+                frame = frame.copy()
+                frame.flags.writeable = False
+            self._frames.append(frame)
+            self._timestamps.append(window.timestamp(i))
+        self._writable = dict()
+
+    def __getitem__(self, index):
+        return self._frames[index % self._length]
+
+    def timestamp(self, index=None):
+        if index is None:
+            index = self.frame_index
+        return self._timestamps[index % self._length]
+
+    def writable(self, index):
+        index = index % self._length
+        image = self._ring.writable(self._seq_at(index))
+        if image is None:
+            if index not in self._writable and self._frames[index] is not None:
+                self._writable[index] = self._frames[index].copy()
+            image = self._writable.get(index)
+        return image
+
+# Frame buffer of a standalone Subscriber: a plain list that numbers frames as they are
+# stored, so derived images (e.g. MotionKernel gray conversions) can be cached per frame
+# like with a FrameWindow.
+class FrameBuffer(list):
+
+    tracks = None
+    zones = None
+
+    def __init__(self, size):
+        list.__init__(self, [None] * size)
+        self._keys = [None] * size
+        self._count = 0
+        self._id = next(_cache_ids)
+
+    def __setitem__(self, index, frame):
+        list.__setitem__(self, index, frame)
+        self._count += 1
+        self._keys[index] = (self._id, self._count)
+
+    def __del__(self):
+        cvu.derived_image_cache().discard(self._id)
+
+    def frame_key(self, index):
+        return self._keys[index % len(self)]
+
+# Returns an image from frame_buf[index] that a handler may draw on.  Frame windows hand
+# out a copy-on-write copy; plain lists (standalone Subscriber) return the frame itself.
+def writable_frame(frame_buf, index):
+    if isinstance(frame_buf, FrameWindow):
+        return frame_buf.writable(index)
+    return frame_buf[index % len(frame_buf)]
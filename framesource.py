@@ -0,0 +1,359 @@
+#!/usr/bin/python3
+
+#imports
+import os
+import glob
+import time
+import queue
+import logging
+import cv2
+import numpy as np
+from threading import Thread
+
+log = logging.getLogger(__name__)
+
+def _fourcc_str(code):
+    code = int(code)
+    return "".join([chr((code >> (8*i)) & 0xFF) for i in range(0, 4)])
+
+'''
+    class FrameSource
+
+    Description:
+      Base class for Tracker frame sources.  A source is opened once, then read() is
+      called repeatedly with the same signature as cv2.VideoCapture.read:
+
+        read(image=None) -> (ret, frame)
+
+      If image is given (a preallocated buffer of the right shape) the frame should be
+      written into it.  ret is False when no frame could be read; for sources that are
+      not live this means the end of the stream.
+
+      Arguments common to all sources:
+        fps      : float, default=None.  Pace frames at this rate.  Live sources run at
+                   their own rate and use fps as a capture rate request instead.
+        prefetch : int, default=0.  Number of frames to decode ahead on a background
+                   thread, for sources where decoding is the bottleneck (files,
+                   directories).  0 reads on the caller's thread.
+        loop     : Boolean, default=False.  Restart non-live sources at the end.
+'''
+class FrameSource():
+
+    # Live sources (cameras, network streams) produce frames in real time and never end
+    live = True
+
+    def __init__(self, name='source', fps=None, prefetch=0, loop=False):
+        self.name = name
+        self.fps = fps
+        self.prefetch = prefetch
+        self.loop = loop
+        self._next_time = None
+        self._queue = None
+        self._prefetch_thread = None
+        self._closed = False
+        self._end_of_stream = False
+        self.opened = False
+
+    '''
+        open(self)
+
+        Description:
+          Opens the underlying device / file / stream.  Returns self so sources can be
+          opened inline: source = UsbSource(0).open()
+    '''
+    def open(self):
+        self._closed = False
+        self._end_of_stream = False
+        self._open()
+        self.opened = True
+        log.info("Opened frame source [" + self.name + "]")
+        if self.prefetch > 0:
+            self._queue = queue.Queue(maxsize=self.prefetch)
+            self._prefetch_thread = Thread(target=self._prefetch, args=(), daemon=True)
+            self._prefetch_thread.start()
+        return self
+
+    def read(self, image=None):
+        self._pace()
+        if self._queue is None:
+            return self._read_or_loop(image)
+        # The prefetch thread has exited after queueing the end of the stream
+        if self._end_of_stream:
+            return False, None
+        ret, frame = self._queue.get()
+        if not ret and not self.live:
+            self._end_of_stream = True
+        if ret and image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            frame = image
+        return ret, frame
+
+    def release(self):
+        self._closed = True
+        if self._prefetch_thread is not None:
+            # Unblock the prefetch thread if it is waiting on a full queue
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._prefetch_thread.join(1.0)
+            self._prefetch_thread = None
+        self._release()
+        self.opened = False
+
+    def _read_or_loop(self, image):
+        ret, frame = self._read(image)
+        if not ret and self.loop and not self.live:
+            self._rewind()
+            ret, frame = self._read(image)
+        return ret, frame
+
+    def _prefetch(self):
+        while not self._closed:
+            ret, frame = self._read_or_loop(None)
+            self._queue.put((ret, frame))
+            if not ret and not self.live:
+                return
+
+    def _pace(self):
+        if self.fps is None or self.live:
+            return
+        now = time.time()
+        if self._next_time is None:
+            self._next_time = now
+        elif now < self._next_time:
+            time.sleep(self._next_time-now)
+        self._next_time += 1./self.fps
+
+    #@abstractmethod
+    def _open(self):
+        pass
+
+    #@abstractmethod
+    def _read(self, image):
+        raise NotImplementedError("Abstract class does not implement this method.")
+
+    def _rewind(self):
+        pass
+
+    def _release(self):
+        pass
+
+'''
+    class CaptureSource
+
+    Description:
+      Frame source backed by cv2.VideoCapture (devices, files and network streams).
+
+      buffer_size   : int, default=None.  Driver-side frame buffer (CAP_PROP_BUFFERSIZE).
+                      1 keeps a live camera from queueing stale frames.
+      pixel_formats : list of FOURCC strings in order of preference, e.g. ['MJPG', 'YUYV'].
+                      The first format the device accepts is used; the negotiated format
+                      is available as self.pixel_format.
+      resolution    : (width, height) to request, default=None keeps the device default.
+'''
+class CaptureSource(FrameSource):
+
+    def __init__(self, target, api_preference=cv2.CAP_ANY, buffer_size=None,
+                 pixel_formats=None, resolution=None, name=None, **kwargs):
+        FrameSource.__init__(self, name=(name or str(target)), **kwargs)
+        self.target = target
+        self.api_preference = api_preference
+        self.buffer_size = buffer_size
+        self.pixel_formats = pixel_formats
+        self.resolution = resolution
+        self.pixel_format = None
+        self._cap = None
+
+    def _open(self):
+        self._cap = cv2.VideoCapture(self.target, self.api_preference)
+        if not self._cap.isOpened():
+            raise IOError("Could not open frame source [" + self.name + "]")
+        self._configure()
+
+    def _configure(self):
+        if self.buffer_size is not None:
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+        if self.pixel_formats:
+            pixel_format = self._negotiate_pixel_format()
+            if pixel_format is not None:
+                log.info("[" + self.name + "] negotiated pixel format " + pixel_format)
+        if self.resolution is not None:
+            self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.resolution[0])
+            self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.resolution[1])
+        if self.live and self.fps is not None:
+            self._cap.set(cv2.CAP_PROP_FPS, self.fps)
+        self.pixel_format = _fourcc_str(self._cap.get(cv2.CAP_PROP_FOURCC))
+        log.info("[" + self.name + "] format=" + self.pixel_format +
+                 " size=" + str(int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))) + "x" +
+                 str(int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))) +
+                 " fps=" + str(self._cap.get(cv2.CAP_PROP_FPS)))
+
+    # Try each preferred FOURCC until the device reports it as active
+    def _negotiate_pixel_format(self):
+        for pixel_format in self.pixel_formats:
+            code = cv2.VideoWriter_fourcc(*pixel_format)
+            self._cap.set(cv2.CAP_PROP_FOURCC, code)
+            if int(self._cap.get(cv2.CAP_PROP_FOURCC)) == code:
+                return pixel_format
+        log.warning("[" + self.name + "] none of " + str(self.pixel_formats) +
+                    " accepted, using device default")
+        return None
+
+    def _read(self, image):
+        if image is None:
+            return self._cap.read()
+        return self._cap.read(image=image)
+
+    def _rewind(self):
+        self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def _release(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+# USB / V4L2 camera by device number (0 is /dev/video0)
+class UsbSource(CaptureSource):
+
+    def __init__(self, usb_dev=0, buffer_size=1, pixel_formats=('MJPG', 'YUYV'),
+                 **kwargs):
+        CaptureSource.__init__(self, usb_dev, buffer_size=buffer_size,
+                               pixel_formats=pixel_formats,
+                               name='video' + str(usb_dev), **kwargs)
+
+# Recorded video file.  Runs as fast as frames can be processed unless fps is given
+# (realtime=True paces at the file's own frame rate).
+class VideoFileSource(CaptureSource):
+
+    live = False
+
+    def __init__(self, path, realtime=False, **kwargs):
+        CaptureSource.__init__(self, path, name=os.path.basename(str(path)), **kwargs)
+        self.realtime = realtime
+
+    def _open(self):
+        CaptureSource._open(self)
+        if self.realtime and self.fps is None:
+            self.fps = self._cap.get(cv2.CAP_PROP_FPS) or None
+
+# Network stream (RTSP, HTTP MJPEG, ...).  Failed reads reconnect after
+# reconnect_delay_s, so a dropped stream doesn't end tracking.
+class StreamSource(CaptureSource):
+
+    def __init__(self, url, buffer_size=1, reconnect_delay_s=1.0, **kwargs):
+        CaptureSource.__init__(self, url, api_preference=cv2.CAP_FFMPEG,
+                               buffer_size=buffer_size, **kwargs)
+        self.reconnect_delay_s = reconnect_delay_s
+
+    def _read(self, image):
+        ret, frame = CaptureSource._read(self, image)
+        if not ret and not self._closed:
+            log.warning("[" + self.name + "] stream read failed, reconnecting")
+            time.sleep(self.reconnect_delay_s)
+            CaptureSource._release(self)
+            self._cap = cv2.VideoCapture(self.target, self.api_preference)
+            if self._cap.isOpened():
+                self._configure()
+        return ret, frame
+
+# Sorted sequence of image files in a directory
+class ImageDirectorySource(FrameSource):
+
+    live = False
+
+    def __init__(self, directory, pattern='*.jpg', **kwargs):
+        FrameSource.__init__(self, name=str(directory), **kwargs)
+        self.directory = directory
+        self.pattern = pattern
+        self._files = list()
+        self._index = 0
+
+    def _open(self):
+        self._files = sorted(glob.glob(os.path.join(self.directory, self.pattern)))
+        if len(self._files) == 0:
+            raise IOError("No images matching " + self.pattern + " in " + str(self.directory))
+        self._index = 0
+
+    def _read(self, image):
+        if self._index >= len(self._files):
+            return False, None
+        frame = cv2.imread(self._files[self._index], cv2.IMREAD_COLOR)
+        self._index += 1
+        if frame is None:
+            return False, None
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            frame = image
+        return True, frame
+
+    def _rewind(self):
+        self._index = 0
+
+# Frames from memory: a list / array of frames, or any iterable or generator of frames
+class MemorySource(FrameSource):
+
+    live = False
+
+    def __init__(self, frames, name='memory', **kwargs):
+        FrameSource.__init__(self, name=name, **kwargs)
+        self.frames = frames
+        self._iter = None
+
+    def _open(self):
+        self._iter = iter(self.frames)
+
+    def _read(self, image):
+        try:
+            frame = next(self._iter)
+        except StopIteration:
+            return False, None
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            frame = image
+        return True, frame
+
+    # Generators can't be restarted; only sequences loop
+    def _rewind(self):
+        self._iter = iter(self.frames)
+
+# Raspberry Pi camera module.  picamera is imported on open, so this module (and the
+# Tracker) still load on platforms without it.
+class PiCameraSource(FrameSource):
+
+    def __init__(self, resolution=(640, 480), framerate=32, hflip=False, vflip=False,
+                 **kwargs):
+        FrameSource.__init__(self, name='picamera', **kwargs)
+        self.resolution = resolution
+        self.framerate = framerate
+        self.hflip = hflip
+        self.vflip = vflip
+        self._camera = None
+
+    def _open(self):
+        from picamera import PiCamera
+        from picamera.array import PiRGBArray
+        self._camera = PiCamera()
+        self._camera.resolution = self.resolution
+        self._camera.framerate = self.framerate
+        self._camera.hflip = self.hflip
+        self._camera.vflip = self.vflip
+        self._raw = PiRGBArray(self._camera, size=self.resolution)
+        self._frames = self._camera.capture_continuous(self._raw, format="bgr",
+                                                       use_video_port=True)
+
+    def _read(self, image):
+        next(self._frames)
+        frame = self._raw.array
+        self._raw.truncate(0)
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            frame = image
+        else:
+            frame = frame.copy()
+        return True, frame
+
+    def _release(self):
+        if self._camera is not None:
+            self._camera.close()
+            self._camera = None
@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+
+#imports
+import os
+import glob
+import time
+import logging
+from collections import deque
+from threading import Lock
+import cv2
+import numpy as np
+
+from cv2utils.dispatcher import Dispatcher, Lane, BLOCK
+from cv2utils.profiler import Profiler
+
+log = logging.getLogger(__name__)
+
+# cv2.imwrite quality flag for each extension
+QUALITY_FLAGS = { 'jpg' : cv2.IMWRITE_JPEG_QUALITY,
+                  'jpeg' : cv2.IMWRITE_JPEG_QUALITY,
+                  'png' : cv2.IMWRITE_PNG_COMPRESSION,
+                  'webp' : cv2.IMWRITE_WEBP_QUALITY }
+
+_name_lock = Lock()
+_last_name = [None, 0]
+
+'''
+    unique_timestamp_name(prefix, format, ext, timestamp=None)
+
+    Description:
+      Returns prefix + <timestamp with millisecond resolution> + "_<nnn>." + ext, where
+      nnn is a zero-padded counter of the names already handed out for that millisecond,
+      so names generated in a burst never collide and sort in the order they were made.
+'''
+def unique_timestamp_name(prefix, format="%Y-%m-%d_%H_%M_%S", ext="jpeg", timestamp=None):
+    if timestamp is None:
+        timestamp = time.time()
+    base = (prefix + time.strftime(format, time.localtime(timestamp)) +
+            "_" + "%03d" % int(1000*(timestamp % 1)))
+    with _name_lock:
+        if base == _last_name[0]:
+            _last_name[1] += 1
+        else:
+            _last_name[0] = base
+            _last_name[1] = 0
+        n = _last_name[1]
+    return base + "_" + "%03d" % n + "." + ext
+
+'''
+    class ImageWriter
+
+    Description:
+      Background image saving service.  write() reserves a unique, monotonically named
+      file and returns its name immediately; the image is encoded on a pool of
+      n_workers encode threads and written by a single writer thread, which fsyncs
+      written files in batches (up to fsync_batch files at a time, sooner when the
+      writer runs out of work).  After each write the oldest files of this writer's
+      prefix in directory are rotated out to keep within max_bytes / max_files.
+
+      directory       : str, output directory (created if missing)
+      prefix          : str, file name prefix, default='image_'
+      ext             : 'jpeg' / 'jpg', 'png' or 'webp'
+      quality         : int, JPEG / WebP quality (0-100) or PNG compression (0-9).
+                        Default=None uses the OpenCV default.
+      n_workers       : int, encode threads
+      queue_size      : int, images that may wait for encoding per worker
+      overflow_policy : 'block' (default) makes write() wait for a free slot,
+                        'drop_oldest' / 'drop_newest' give up images instead
+      fsync           : Boolean, default=True.  fsync files (and the directory) so
+                        written images survive a power cut.
+      fsync_batch     : int, maximum files per fsync batch
+      max_bytes, max_files : rolling quota, default=None (unlimited)
+'''
+class ImageWriter():
+
+    def __init__(self, directory='.', prefix='image_', ext='jpeg', quality=None,
+                 n_workers=2, queue_size=8, overflow_policy=BLOCK,
+                 fsync=True, fsync_batch=16, max_bytes=None, max_files=None,
+                 name='imagewriter'):
+        if ext not in QUALITY_FLAGS:
+            raise ValueError("Unsupported image type '" + str(ext) + "', expected one of " +
+                             str(tuple(QUALITY_FLAGS.keys())))
+        self.directory = directory
+        self.prefix = prefix
+        self.ext = ext
+        self.quality = quality
+        self.fsync = fsync
+        self.fsync_batch = fsync_batch
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.name = name
+        self.n_written = 0
+        self.n_failed = 0
+        self.n_rotated = 0
+        self.n_fsyncs = 0
+        self.bytes_written = 0
+        self.profiler = Profiler(name)
+        os.makedirs(directory, exist_ok=True)
+        # Files under quota, oldest first: (path, size).  Existing files count too.
+        existing = [path for path in glob.glob(os.path.join(directory, prefix + '*'))
+                    if os.path.isfile(path)]
+        existing.sort(key=os.path.getmtime)
+        self._files = deque([(path, os.path.getsize(path)) for path in existing])
+        self._total_bytes = sum([size for (path, size) in self._files])
+        # Open files written but not yet fsynced
+        self._unsynced = list()
+        self._next_worker = 0
+        self._lock = Lock()
+        self._dispatcher = Dispatcher(n_workers=n_workers+1, name=name)
+        self._encode_lanes = [
+            self._dispatcher.add_lane(Lane(self._encode, name=name + ':encode' + str(i),
+                                           maxsize=queue_size,
+                                           overflow_policy=overflow_policy))
+            for i in range(0, n_workers)]
+        # Encoded images are never dropped; the encode lanes apply backpressure instead
+        self._write_lane = self._dispatcher.add_lane(
+            Lane(self._write, name=name + ':write', maxsize=2*n_workers*queue_size,
+                 overflow_policy=BLOCK))
+
+    '''
+        write(self, img, prefix=None)
+
+        Description:
+          Queues img for saving and returns the file name it will be written to, or
+          None if the image was dropped by the overflow policy.  The image is copied,
+          so the caller may reuse its buffer.
+    '''
+    def write(self, img, prefix=None):
+        queued = time.time()
+        filename = os.path.join(self.directory,
+                                unique_timestamp_name(self.prefix if prefix is None else prefix,
+                                                      ext=self.ext, timestamp=queued))
+        with self._lock:
+            lane = self._encode_lanes[self._next_worker]
+            self._next_worker = (self._next_worker + 1) % len(self._encode_lanes)
+        if not self._dispatcher.submit(lane, filename, np.array(img), queued):
+            return None
+        return filename
+
+    def _encode(self, filename, img, queued):
+        self.profiler.record('queue', time.time() - queued)
+        params = [] if self.quality is None else [QUALITY_FLAGS[self.ext], int(self.quality)]
+        with self.profiler.stage('encode'):
+            ret, data = cv2.imencode('.' + self.ext, img, params)
+        if not ret:
+            self.n_failed += 1
+            log.error("[" + self.name + "] failed to encode " + filename)
+            return
+        self._dispatcher.submit(self._write_lane, filename, data.tobytes(), queued)
+
+    def _write(self, filename, data, queued):
+        f = None
+        try:
+            with self.profiler.stage('write'):
+                f = open(filename, 'wb')
+                f.write(data)
+                f.flush()
+        except OSError:
+            if f is not None:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+            self.n_failed += 1
+            log.exception("[" + self.name + "] failed to write " + filename)
+            return
+        self._unsynced.append(f)
+        self.n_written += 1
+        self.bytes_written += len(data)
+        self.profiler.record('latency', time.time() - queued)
+        # Batch fsyncs while more files are waiting, up to fsync_batch
+        if len(self._unsynced) >= self.fsync_batch or self._write_lane.depth() == 0:
+            self._sync()
+        self._files.append((filename, len(data)))
+        self._total_bytes += len(data)
+        self._rotate()
+
+    def _sync(self):
+        if len(self._unsynced) == 0:
+            return
+        with self.profiler.stage('fsync'):
+            for f in self._unsynced:
+                try:
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                finally:
+                    f.close()
+            if self.fsync and hasattr(os, 'O_DIRECTORY'):
+                fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        self._unsynced = list()
+        self.n_fsyncs += 1
+
+    def _rotate(self):
+        while len(self._files) > 1 and (
+                (self.max_bytes is not None and self._total_bytes > self.max_bytes) or
+                (self.max_files is not None and len(self._files) > self.max_files)):
+            path, size = self._files.popleft()
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+                self.n_rotated += 1
+            except OSError:
+                pass
+
+    # Images waiting to be encoded or written
+    def backlog(self):
+        return sum([lane.depth() for lane in self._encode_lanes]) + self._write_lane.depth()
+
+    '''
+        flush(self, timeout=None)
+
+        Description:
+          Blocks until every queued image is written and synced.  Returns False if the
+          timeout (seconds) expired first.
+    '''
+    def flush(self, timeout=None):
+        return self._dispatcher.wait_idle(timeout)
+
+    def close(self, timeout=5.):
+        self.flush(timeout)
+        self._dispatcher.stop()
+        self._sync()
+
+    def stats(self):
+        return { 'written' : self.n_written,
+                 'failed' : self.n_failed,
+                 'rotated' : self.n_rotated,
+                 'fsyncs' : self.n_fsyncs,
+                 'bytes' : self.bytes_written,
+                 'disk_bytes' : self._total_bytes,
+                 'backlog' : self.backlog(),
+                 'lanes' : self._dispatcher.stats(),
+                 'profile' : self.profiler.summary() }
+
+    def __str__(self):
+        return (self.name + ": " + str(self.n_written) + " written, " +
+                str(self.backlog()) + " queued, " + str(self.n_rotated) + " rotated\n" +
+                str(self.profiler))
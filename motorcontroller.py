@@ -4,9 +4,72 @@ from cv2utils.tracker import Tracker, Handler, EventDetector
 from cv2utils.frameprocessor import MotionProcessor
 from cv2utils.subscriber import Subscriber
 import cv2utils.cv2utils as cvu
-import os
+from cv2utils.actuator import ShellChannel
+import time
 import numpy as np
 import logging
+from collections import deque
+from threading import Thread, Lock
+
+# Servo travel limits, in 100us pulse width units
+MIN_POSITION = 8
+MAX_POSITION = 22
+
+'''
+    class ConstantVelocityFilter
+
+    Description:
+      Kalman filter for positions moving at roughly constant velocity, one independent
+      [position, velocity] state per axis.  Measurements carry their own timestamps,
+      so irregular frame intervals are handled.
+
+      process_noise     : acceleration noise intensity, (units/s^2)^2 * s
+      measurement_noise : measurement variance, units^2
+'''
+class ConstantVelocityFilter():
+
+    def __init__(self, process_noise=20., measurement_noise=0.1, n_dims=2):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.n_dims = n_dims
+        self.reset()
+
+    def reset(self):
+        self.t = None
+        self.x = np.zeros((self.n_dims, 2))
+        self.P = np.zeros((self.n_dims, 2, 2))
+
+    def _propagate(self, dt):
+        F = np.array([[1., dt], [0., 1.]])
+        q = self.process_noise
+        Q = q * np.array([[dt**3/3., dt**2/2.], [dt**2/2., dt]])
+        self.x = self.x @ F.T
+        self.P = F @ self.P @ F.T + Q
+
+    def update(self, t, z):
+        z = np.asarray(z, dtype=np.float64)
+        if self.t is None:
+            self.t = t
+            self.x[:, 0] = z
+            self.x[:, 1] = 0.
+            self.P[:] = np.diag((self.measurement_noise, 100.))
+            return
+        # Late (out of order) measurements are applied at the current time
+        if t > self.t:
+            self._propagate(t - self.t)
+            self.t = t
+        S = self.P[:, 0, 0] + self.measurement_noise
+        K = self.P[:, :, 0] / S[:, None]
+        self.x += K * (z - self.x[:, 0])[:, None]
+        self.P -= K[:, :, None] * self.P[:, 0, :][:, None, :]
+
+    # Predicted position at time t, without changing the filter state
+    def predict(self, t):
+        return self.x[:, 0] + (t - self.t) * self.x[:, 1]
+
+    @property
+    def velocity(self):
+        return self.x[:, 1]
 
 class MotorController(Handler):
 
@@ -14,7 +77,16 @@ class MotorController(Handler):
                  steering_gain=10.0,
                  bias_x=0, bias_y=0,
                  target_global_centroid=False,
-                 max_pulses = 3):
+                 max_pulses = 3,
+                 channel=None,
+                 closed_loop=False,
+                 command_rate_hz=10.,
+                 latency_s=0.1,
+                 deadband=0.25,
+                 lost_after_s=1.0,
+                 min_target_area_px=200,
+                 process_noise=20.,
+                 measurement_noise=0.1):
         """
         Initialize MotorController
 
@@ -31,6 +103,28 @@ class MotorController(Handler):
                                  target the area-weighted average of all
                                  detection regions.
         max_pulses - int default 3, limit the number of pulses in any control signal
+        channel - ActuatorChannel for servo commands.  Default=None starts a
+                  persistent shell running gpio_pwm (use a RecordingChannel for
+                  testing without servos).  Copies (e.g. one per TrackerGroup
+                  stream) share a channel given here, and start their own default
+                  channel otherwise.
+
+        Closed-loop mode (closed_loop=True): instead of a one-shot correction per
+        event, every processed frame updates a constant-velocity Kalman estimate of
+        the target's servo position, and a command thread steers to the estimate
+        predicted latency_s ahead at a fixed rate.  steering_gain is then the servo
+        travel from the image centre to its edge.  The event detector's
+        time_between_triggers_s does not throttle control.
+
+        command_rate_hz - rate at which servo commands are considered
+        latency_s - capture-to-actuation latency: how long a command takes to move
+                    the camera.  Measurements are related to the servo position
+                    that was in effect when the frame was captured, and commands
+                    lead the target by this much.
+        deadband - skip commands moving a servo less than this (servo units)
+        lost_after_s - stop steering when no target was seen for this long
+        min_target_area_px - ignore frames whose target contour is smaller
+        process_noise, measurement_noise - ConstantVelocityFilter tuning
         """
 
         # Servo position indicators, in increments of 100us pulse widths
@@ -43,29 +137,50 @@ class MotorController(Handler):
         self.steering_gain = steering_gain
         self.target_global_centroid = target_global_centroid
         self.max_pulses = max_pulses
+        self.channel = channel
+        self._own_channel = channel is None
+        self.closed_loop = closed_loop
+        self.command_rate_hz = command_rate_hz
+        self.latency_s = latency_s
+        self.deadband = deadband
+        self.lost_after_s = lost_after_s
+        self.min_target_area_px = min_target_area_px
+        self.filter = ConstantVelocityFilter(process_noise, measurement_noise)
+        self.n_commands = 0
+        self._last_measurement = None
+        # (time, xpos, ypos) of recent commands
+        self._history = deque([(0., self.xpos, self.ypos)], maxlen=64)
+        self._lock = Lock()
+        self._command_thread = None
+        self._stopped = False
 
-    def handle(self, contours, frame_buf, frame_index):
-
-        log = Tracker.get_logger()
-        imsize = frame_buf[frame_index].shape
+    # Target offset from the steering centre, normalized to [-1, 1] of the half frame
+    def _target_offset(self, contours, imsize):
         hres=imsize[1]/2.
         vres=imsize[0]/2.
-
         tgtx = hres+self.bias_x
         tgty = vres+self.bias_y
         centroid = (0,0)
-
         # Designate target region
+        stats = cvu.contour_stats(contours)
         if (self.target_global_centroid):
-            centroid = cvu.avg_contour_centroid(contours)
-        else:
-            # Find area of largest motion contour
-            contour, area = cvu.largest_contour(contours)
-            centroid = cvu.centroid(contour)
+            centroid = stats.avg_centroid()
+        elif stats.largest() >= 0:
+            # Centroid of largest motion contour
+            centroid = stats.centroid(stats.largest())
+        return (centroid[0]-tgtx)/hres, (centroid[1]-tgty)/vres, centroid
+
+    def handle(self, contours, frame_buf, frame_index):
 
+        if self.closed_loop:
+            return
+        log = Tracker.get_logger()
+        frame = frame_buf[frame_index]
+        if frame is None:
+            return
+        imsize = frame.shape
         # Normalize the largest motion centroid in the [-1,1] space
-        hpos = (centroid[0]-tgtx)/hres
-        vpos = (centroid[1]-tgty)/vres
+        hpos, vpos, centroid = self._target_offset(contours, imsize)
         # Convert to number of PWM pulses
         hdelta = self.steering_gain*(hpos*np.abs(hpos))
         vdelta = self.steering_gain*(vpos*np.abs(vpos))
@@ -79,10 +194,10 @@ class MotorController(Handler):
 
         self.xpos -= hdelta;
         self.ypos += vdelta
-        if (self.xpos > 22): self.xpos = 22
-        if (self.xpos < 8): self.xpos = 8
-        if (self.ypos > 22): self.ypos = 22
-        if (self.ypos < 8): self.ypos = 8
+        if (self.xpos > MAX_POSITION): self.xpos = MAX_POSITION
+        if (self.xpos < MIN_POSITION): self.xpos = MIN_POSITION
+        if (self.ypos > MAX_POSITION): self.ypos = MAX_POSITION
+        if (self.ypos < MIN_POSITION): self.ypos = MIN_POSITION
 
         # These are hard-coded motor positions for L/R and U/D
         # 15 corresponds to 1500us position (neutral) on standard servo
@@ -95,11 +210,121 @@ class MotorController(Handler):
         log.debug("htgt= " + str(np.round(self.xpos,2)) +
                 ", vtgt= " + str(np.round(self.ypos,2)) )
 
-        # Call command-line for PWM pulse train generator as detached processes
-        # to steer incrementally toward detected motion.
+        # Queue PWM pulse trains on the actuator channel to steer incrementally
+        # toward detected motion.
         self.servo_steer(self.h_pin, h_pulses, self.xpos)
         self.servo_steer(self.v_pin, v_pulses, self.ypos)
 
+    # Latest command per pin wins if the servos are still busy with an earlier one
     def servo_steer(self, pin, pulses, position):
-        os.system("gpio_pwm " + str(pin) + " 10000 " + str(pulses) + " " +
-                  str(position) + " &")
+        if self.channel is None:
+            self.channel = ShellChannel(name='gpio_pwm')
+        self.channel.send("gpio_pwm " + str(pin) + " 10000 " + str(pulses) + " " +
+                          str(position), key=pin)
+
+    # The Subscriber calls on_frame only in closed-loop mode; open-loop control leaves
+    # frame processing to the event detector's schedule
+    @property
+    def wants_frames(self):
+        return self.closed_loop
+
+    '''
+        on_frame(self, contours, frame_buf, frame_index)
+
+        Description:
+          Closed-loop mode: called by the Subscriber for every processed frame.  Converts
+          the target's image offset into servo coordinates using the servo position in
+          effect at capture time and updates the target filter.
+    '''
+    def on_frame(self, contours, frame_buf, frame_index):
+        if not self.closed_loop or contours is None or len(contours) == 0:
+            return
+        frame = frame_buf[frame_index]
+        if frame is None:
+            return
+        stats = cvu.contour_stats(contours)
+        if stats.area[stats.largest()] < self.min_target_area_px:
+            return
+        captured = frame_buf.timestamp() if hasattr(frame_buf, 'timestamp') else None
+        if captured is None:
+            captured = time.time()
+        hpos, vpos, centroid = self._target_offset(contours, frame.shape)
+        with self._lock:
+            xpos, ypos = self._position_at(captured)
+            # Same directions as the open-loop correction (xpos -= ..., ypos += ...)
+            self.filter.update(captured, (xpos - self.steering_gain*hpos,
+                                          ypos + self.steering_gain*vpos))
+            self._last_measurement = captured
+        if self._command_thread is None:
+            self._command_thread = Thread(target=self._command_loop, args=(),
+                                          name='motor-control', daemon=True)
+            self._command_thread.start()
+
+    # Commanded position that had taken effect by time t
+    def _position_at(self, t):
+        for (command_time, xpos, ypos) in reversed(self._history):
+            if command_time + self.latency_s <= t:
+                return xpos, ypos
+        if len(self._history) > 0:
+            return self._history[0][1], self._history[0][2]
+        return self.xpos, self.ypos
+
+    def _command_loop(self):
+        period = 1./self.command_rate_hz
+        next_time = time.time()
+        while not self._stopped:
+            next_time += period
+            time.sleep(max(0., next_time - time.time()))
+            now = time.time()
+            with self._lock:
+                if (self._last_measurement is None or
+                    now - self._last_measurement > self.lost_after_s):
+                    continue
+                target = np.clip(self.filter.predict(now + self.latency_s),
+                                 MIN_POSITION, MAX_POSITION)
+            self._steer_to(now, target[0], target[1])
+
+    def _steer_to(self, now, xpos, ypos):
+        move_x = np.abs(xpos - self.xpos) >= self.deadband
+        move_y = np.abs(ypos - self.ypos) >= self.deadband
+        if not (move_x or move_y):
+            return
+        if move_x:
+            self.servo_steer(self.h_pin, self._pulses(xpos - self.xpos), np.round(xpos, 2))
+        if move_y:
+            self.servo_steer(self.v_pin, self._pulses(ypos - self.ypos), np.round(ypos, 2))
+        with self._lock:
+            if move_x:
+                self.xpos = xpos
+            if move_y:
+                self.ypos = ypos
+            self._history.append((now, self.xpos, self.ypos))
+        self.n_commands += 1
+
+    def _pulses(self, delta):
+        return min(int(np.ceil(np.abs(delta)))+1, self.max_pulses)
+
+    # Copies (e.g. one per TrackerGroup stream) get their own servo positions, target
+    # filter and command thread
+    def __copy__(self):
+        controller = MotorController.__new__(MotorController)
+        controller.__dict__.update(self.__dict__)
+        if self._own_channel:
+            controller.channel = None
+        controller.filter = ConstantVelocityFilter(self.filter.process_noise,
+                                                   self.filter.measurement_noise,
+                                                   self.filter.n_dims)
+        controller.n_commands = 0
+        controller._last_measurement = None
+        controller._history = deque(self._history, maxlen=self._history.maxlen)
+        controller._lock = Lock()
+        controller._command_thread = None
+        controller._stopped = False
+        return controller
+
+    # Stops the closed-loop command thread
+    def close(self):
+        self._stopped = True
+        if self._command_thread is not None:
+            self._command_thread.join(1.0)
+            self._command_thread = None
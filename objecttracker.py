@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+
+#imports
+import time
+import numpy as np
+
+import cv2utils.cv2utils as cvu
+
+'''
+    class Track
+
+    Description:
+      One object followed across frames by an ObjectTracker.
+
+      id          : int, unique for the lifetime of the ObjectTracker
+      cx, cy      : centroid (pixels) at the last frame the object was seen
+      bbox        : (x, y, w, h) at the last frame the object was seen
+      area        : contour area (pixels)
+      vx, vy      : smoothed velocity, pixels per second
+      age         : frames since the track was created
+      hits        : frames the object was seen in
+      streak      : consecutive frames the object was seen in, up to the current one
+      misses      : consecutive frames the object was not seen in
+      contour_index : index of the track's contour in the current frame, or -1
+'''
+class Track():
+
+    __slots__ = ('id', 'cx', 'cy', 'bbox', 'area', 'vx', 'vy', 'age', 'hits',
+                 'streak', 'misses', 'first_seen', 'last_seen', 'contour_index')
+
+    def __init__(self, track_id, cx, cy, bbox, area, timestamp, contour_index):
+        self.id = track_id
+        self.cx = cx
+        self.cy = cy
+        self.bbox = bbox
+        self.area = area
+        self.vx = 0.
+        self.vy = 0.
+        self.age = 1
+        self.hits = 1
+        self.streak = 1
+        self.misses = 0
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.contour_index = contour_index
+
+    @property
+    def centroid(self):
+        return (int(self.cx), int(self.cy))
+
+    @property
+    def velocity(self):
+        return (self.vx, self.vy)
+
+    def __str__(self):
+        return ("Track " + str(self.id) + " at " + str(self.centroid) +
+                " v=(" + str(np.round(self.vx,1)) + ", " + str(np.round(self.vy,1)) + ")px/s" +
+                " age=" + str(self.age) + " streak=" + str(self.streak))
+
+'''
+    class ObjectTracker
+
+    Description:
+      Associates contours across frames and keeps a Track with a persistent id for each
+      object.  Each update predicts every track's centroid and box from its velocity,
+      gathers candidate (track, contour) pairs within max_distance_px with a sort and
+      sweep over x (roughly linear in the number of blobs rather than tracks x blobs),
+      scores them by distance and box overlap in one vectorized pass, and matches them
+      greedily, best pairs first.  Unmatched contours start new tracks; tracks missing
+      for more than max_misses frames are dropped.
+
+      max_distance_px    : gate on the distance between predicted and measured centroid
+      min_iou            : gate on the overlap of predicted and measured boxes (0 disables)
+      max_misses         : frames a track survives without a match
+      velocity_smoothing : weight of the previous velocity in each update, in [0, 1)
+      min_area_px        : contours smaller than this don't start new tracks
+'''
+class ObjectTracker():
+
+    def __init__(self, max_distance_px=80., min_iou=0., max_misses=5,
+                 velocity_smoothing=0.5, min_area_px=0):
+        self.max_distance_px = max_distance_px
+        self.min_iou = min_iou
+        self.max_misses = max_misses
+        self.velocity_smoothing = velocity_smoothing
+        self.min_area_px = min_area_px
+        self.reset()
+
+    def reset(self):
+        self.tracks = list()
+        self._next_id = 1
+
+    '''
+        update(self, contours, timestamp=None)
+
+        Description:
+          Advances the tracker by one frame.  Returns the tracks seen in this frame, in
+          contour order (Track.contour_index).  All live tracks, including those
+          currently missing, are in self.tracks.
+    '''
+    def update(self, contours, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if contours is None:
+            contours = []
+        stats = cvu.contour_stats(contours)
+        n_tracks = len(self.tracks)
+        n_contours = len(stats)
+        track_match = np.full(n_tracks, -1)
+        contour_match = np.full(n_contours, -1)
+        if n_tracks > 0 and n_contours > 0:
+            self._associate(stats, timestamp, track_match, contour_match)
+
+        for (i, track) in enumerate(self.tracks):
+            track.age += 1
+            j = track_match[i]
+            if j < 0:
+                track.misses += 1
+                track.streak = 0
+                track.contour_index = -1
+                continue
+            dt = timestamp - track.last_seen
+            if dt > 0:
+                a = self.velocity_smoothing
+                track.vx = a*track.vx + (1-a)*(stats.cx[j]-track.cx)/dt
+                track.vy = a*track.vy + (1-a)*(stats.cy[j]-track.cy)/dt
+            track.cx = stats.cx[j]
+            track.cy = stats.cy[j]
+            track.bbox = tuple(stats.bbox[j])
+            track.area = stats.area[j]
+            track.hits += 1
+            track.streak += 1
+            track.misses = 0
+            track.last_seen = timestamp
+            track.contour_index = int(j)
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+        for j in np.flatnonzero(contour_match < 0):
+            if stats.area[j] < self.min_area_px:
+                continue
+            self.tracks.append(Track(self._next_id, stats.cx[j], stats.cy[j],
+                                     tuple(stats.bbox[j]), stats.area[j], timestamp, int(j)))
+            self._next_id += 1
+
+        seen = [track for track in self.tracks if track.contour_index >= 0]
+        seen.sort(key=lambda track: track.contour_index)
+        return seen
+
+    def _associate(self, stats, timestamp, track_match, contour_match):
+        state = np.array([(track.cx, track.cy, track.vx, track.vy,
+                           timestamp - track.last_seen) for track in self.tracks])
+        # Predicted centroid shift since each track was last seen
+        shift_x = state[:,4]*state[:,2]
+        shift_y = state[:,4]*state[:,3]
+        px = state[:,0] + shift_x
+        py = state[:,1] + shift_y
+
+        # Candidate pairs: tracks whose predicted x is within max_distance_px of the contour
+        order = np.argsort(px)
+        sorted_px = px[order]
+        lo = np.searchsorted(sorted_px, stats.cx - self.max_distance_px, side='left')
+        hi = np.searchsorted(sorted_px, stats.cx + self.max_distance_px, side='right')
+        counts = hi - lo
+        n_pairs = int(counts.sum())
+        if n_pairs == 0:
+            return
+        contour_idx = np.repeat(np.arange(len(stats)), counts)
+        offsets = np.arange(n_pairs) - np.repeat(np.cumsum(counts) - counts, counts)
+        track_idx = order[np.repeat(lo, counts) + offsets]
+
+        distance = np.hypot(px[track_idx] - stats.cx[contour_idx],
+                            py[track_idx] - stats.cy[contour_idx])
+        iou = self._iou(track_idx, contour_idx, shift_x, shift_y, stats)
+        gate = (distance <= self.max_distance_px) & (iou >= self.min_iou)
+        cost = distance/self.max_distance_px - iou
+
+        for k in np.flatnonzero(gate)[np.argsort(cost[gate], kind='stable')]:
+            i = track_idx[k]; j = contour_idx[k]
+            if track_match[i] < 0 and contour_match[j] < 0:
+                track_match[i] = j
+                contour_match[j] = i
+
+    # Overlap of each candidate's predicted track box with its contour box
+    def _iou(self, track_idx, contour_idx, shift_x, shift_y, stats):
+        boxes = np.array([track.bbox for track in self.tracks], dtype=np.float64)
+        tb = boxes[track_idx]
+        tx = tb[:,0] + shift_x[track_idx]; ty = tb[:,1] + shift_y[track_idx]
+        cb = stats.bbox[contour_idx].astype(np.float64)
+        w = np.minimum(tx+tb[:,2], cb[:,0]+cb[:,2]) - np.maximum(tx, cb[:,0])
+        h = np.minimum(ty+tb[:,3], cb[:,1]+cb[:,3]) - np.maximum(ty, cb[:,1])
+        intersection = np.clip(w, 0, None) * np.clip(h, 0, None)
+        union = tb[:,2]*tb[:,3] + cb[:,2]*cb[:,3] - intersection
+        return intersection / np.maximum(union, 1.)
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+
+#imports
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from cv2utils.profiler import Profiler
+
+log = logging.getLogger(__name__)
+
+# Frame ring attached in each worker process
+_worker_ring = None
+
+def _attach_ring(ring):
+    global _worker_ring
+    _worker_ring = ring
+
+# Runs a frame processor in a worker process against the shared frame ring.  Only the
+# contours and timing metadata are sent back; the detection image stays in the worker.
+def _process_in_worker(frame_processor, seq, frame_buf_size):
+    start = time.time()
+    profiler = Profiler()
+    frame_buf = _worker_ring.window(seq, frame_buf_size)
+    with profiler.activate():
+        contours, detectFrame = frame_processor.process(frame_buf=frame_buf,
+                                                        frame_index=frame_buf.frame_index)
+    return contours, ProcessMetadata(seq, os.getpid(), time.time()-start, profiler)
+
+class ProcessMetadata():
+
+    def __init__(self, seq, pid, process_time_s, profiler=None):
+        self.seq = seq
+        self.pid = pid
+        self.process_time_s = process_time_s
+        # Per-stage timings recorded in the worker (diff, threshold, ...)
+        self.profiler = profiler
+
+'''
+    class ProcessBackend
+
+    Description:
+      Opt-in process pool for running frame processors outside the GIL.  Frames stay in
+      the Tracker's shared-memory frame ring; workers get only the processor, the frame
+      sequence number and the frame buffer size, and return contours plus metadata.
+      The processing stage keeps the frames pinned in the ring until a worker's result
+      has been delivered, so capture never overwrites a frame a worker is reading.
+      Subscriber and EventDetector state never leaves the parent process, so handler
+      semantics are unchanged.  Processors with stateless=False keep running in the
+      parent, since each call could land on a different worker.
+
+      n_processes  : int, number of worker processes.  Default=None uses os.cpu_count().
+      max_in_flight : int, frames per processing stage that may be in the pool at once.
+                      Default=None uses n_processes.  Results are always delivered to
+                      subscribers in frame order.
+'''
+class ProcessBackend:
+
+    def __init__(self, n_processes=None, max_in_flight=None):
+        self.n_processes = n_processes or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.n_processes
+        self._pool = None
+
+    '''
+        start(self, ring)
+
+        Description:
+          Starts the worker processes and attaches them to the shared frame ring.
+    '''
+    def start(self, ring):
+        if not ring.shared:
+            raise ValueError("ProcessBackend requires a shared-memory frame ring.")
+        self._pool = ProcessPoolExecutor(max_workers=self.n_processes,
+                                         initializer=_attach_ring, initargs=(ring,))
+        log.info("Started " + str(self.n_processes) + " frame processing workers")
+
+    def submit(self, frame_processor, seq, frame_buf_size):
+        return self._pool.submit(_process_in_worker, frame_processor, seq, frame_buf_size)
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+#imports
+import math
+import time
+import numpy as np
+from threading import Lock, local
+from contextlib import nullcontext
+
+# Profiler active on the current thread, if any (see Profiler.activate)
+_local = local()
+_null_timer = nullcontext()
+
+'''
+    profiled(name)
+
+    Description:
+      Context manager timing a block into the profiler active on the current thread, or
+      doing nothing if there is none.  Lets low-level helpers (e.g. cv2utils.get_contours)
+      report per-stage timings without changing their signatures.
+'''
+def profiled(name):
+    profiler = getattr(_local, 'profiler', None)
+    if profiler is None:
+        return _null_timer
+    return profiler.stage(name)
+
+def active_profiler():
+    return getattr(_local, 'profiler', None)
+
+'''
+    class Histogram
+
+    Description:
+      Fixed-memory latency histogram with log-spaced buckets (20 per decade, 1us to
+      100s), giving percentiles to within about 12% regardless of sample count.
+'''
+class Histogram():
+
+    DECADES = (-6, 2)
+    BUCKETS_PER_DECADE = 20
+    N_BUCKETS = (DECADES[1]-DECADES[0]) * BUCKETS_PER_DECADE + 2
+    # Upper edge of each bucket, in seconds
+    EDGES = np.concatenate(([10.**DECADES[0]],
+                            np.logspace(DECADES[0], DECADES[1], N_BUCKETS-2+1)[1:],
+                            [np.inf]))
+
+    def __init__(self):
+        self._lock = Lock()
+        self.counts = np.zeros(Histogram.N_BUCKETS, dtype=np.int64)
+        self.n = 0
+        self.total_s = 0.
+        self.max_s = 0.
+
+    def _bucket(self, seconds):
+        if seconds <= 10.**Histogram.DECADES[0]:
+            return 0
+        index = int(math.ceil((math.log10(seconds)-Histogram.DECADES[0]) *
+                              Histogram.BUCKETS_PER_DECADE))
+        return min(index, Histogram.N_BUCKETS-1)
+
+    def record(self, seconds):
+        bucket = self._bucket(seconds)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.n += 1
+            self.total_s += seconds
+            if seconds > self.max_s:
+                self.max_s = seconds
+
+    def merge(self, other):
+        with self._lock:
+            self.counts += other.counts
+            self.n += other.n
+            self.total_s += other.total_s
+            self.max_s = max(self.max_s, other.max_s)
+
+    # Upper bucket edge below which q percent of samples fall, in seconds
+    def percentile(self, q):
+        with self._lock:
+            if self.n == 0:
+                return 0.
+            index = int(np.searchsorted(np.cumsum(self.counts), q/100.*self.n))
+            return min(Histogram.EDGES[index], self.max_s)
+
+    def mean_s(self):
+        return self.total_s / self.n if self.n > 0 else 0.
+
+    def summary(self):
+        return { 'count' : self.n,
+                 'mean_ms' : 1000*self.mean_s(),
+                 'p50_ms' : 1000*self.percentile(50),
+                 'p95_ms' : 1000*self.percentile(95),
+                 'p99_ms' : 1000*self.percentile(99),
+                 'max_ms' : 1000*self.max_s }
+
+    def __str__(self):
+        return (str(np.round(1000*self.percentile(50),1)) + "/" +
+                str(np.round(1000*self.percentile(95),1)) + "/" +
+                str(np.round(1000*self.percentile(99),1)) + "ms")
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+class _Timer():
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._histogram.record(time.perf_counter()-self._start)
+
+'''
+    class Profiler
+
+    Description:
+      Named set of Histograms for one pipeline component (the tracker, a processing
+      stage or a subscriber).  Time a block with `with profiler.stage('name'):`, record
+      a measured duration with record(), and make the profiler the target of profiled()
+      calls on the current thread with `with profiler.activate():`.
+'''
+class Profiler():
+
+    def __init__(self, name='profiler'):
+        self.name = name
+        self.histograms = dict()
+        self._lock = Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def stage(self, name):
+        return _Timer(self.histogram(name))
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    def activate(self):
+        return _Activation(self)
+
+    def merge(self, other):
+        for (name, histogram) in list(other.histograms.items()):
+            self.histogram(name).merge(histogram)
+
+    def summary(self):
+        return { name : histogram.summary()
+                 for (name, histogram) in list(self.histograms.items()) }
+
+    # p50/p95/p99 of every stage, for the heartbeat log
+    def __str__(self):
+        return " ".join([name + "=" + str(histogram)
+                         for (name, histogram) in list(self.histograms.items())])
+
+    def __getstate__(self):
+        return { 'name' : self.name, 'histograms' : dict(self.histograms) }
+
+    def __setstate__(self, state):
+        self.name = state['name']
+        self.histograms = state['histograms']
+        self._lock = Lock()
+
+class _Activation():
+
+    def __init__(self, profiler):
+        self._profiler = profiler
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'profiler', None)
+        _local.profiler = self._profiler
+        return self._profiler
+
+    def __exit__(self, *args):
+        _local.profiler = self._previous
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+#imports
+import time
+import logging
+from collections import deque
+from threading import Condition
+
+from cv2utils.dispatcher import Lane, BLOCK, DROP_OLDEST
+from cv2utils.profiler import Profiler
+
+log = logging.getLogger(__name__)
+
+'''
+    class ProcessingStage
+
+    Description:
+      Runs one FrameProcessor once per frame on behalf of every Subscriber that uses it
+      (or an equivalently configured processor), then fans the (contours, detectFrame)
+      result out to each subscriber's event detection.  The Tracker creates one stage
+      per distinct processor, so frame analysis cost scales with the number of distinct
+      processors rather than the number of subscribers.
+
+      With a process backend, stateless processors run in worker processes and several
+      frames may be in flight at once; results are still handed to subscribers in frame
+      order.
+'''
+class ProcessingStage:
+
+    '''
+        Initialize ProcessingStage object.
+
+        Arguments:
+          frame_processor : frame processor object shared by all subscribers of this stage
+          name            : str, stage name used in heartbeat output
+          backend         : optional ProcessBackend to run the processor in worker processes
+    '''
+    def __init__(self, frame_processor, name='stage', backend=None):
+        self._frame_processor = frame_processor
+        self._backend = backend if frame_processor.stateless else None
+        # (seq, future, ready subscribers, pinned frame window) of frames in the pool
+        self._pending = deque()
+        self._pending_cond = Condition()
+        self._frame_buf_size = 0
+        self.key = frame_processor.config_key()
+        self.name = name
+        self.subscribers = list()
+        # Process every frame so subscribers cooling down still note activity (set by
+        # a Tracker with a DutyCycle)
+        self.track_activity = False
+        self.lane = Lane(self.update, name=name, maxsize=1,
+                         overflow_policy=DROP_OLDEST)
+        # 'process' plus the processor's internal stages (diff, threshold, ...)
+        self.profiler = Profiler(name)
+
+    '''
+        add_subscriber(self, subscriber, lane)
+
+        Description:
+          Attaches a subscriber and the dispatcher lane its detection results are queued on.
+          The processor sees as many past frames as the largest frame_buf_size of its
+          subscribers, and the stage queue adopts the largest queue size (and 'block' if
+          any subscriber blocks).
+    '''
+    def add_subscriber(self, subscriber, lane):
+        self.subscribers.append((subscriber, lane))
+        self._frame_buf_size = max(self._frame_buf_size, subscriber._frame_buf_size)
+        self.lane.maxsize = max(self.lane.maxsize, subscriber.queue_size)
+        if subscriber.overflow_policy == BLOCK:
+            self.lane.overflow_policy = BLOCK
+
+    # Number of ring frames this stage needs to look back on
+    @property
+    def frame_buf_size(self):
+        return self._frame_buf_size
+
+    # Number of frames this stage may be processing at once
+    @property
+    def max_in_flight(self):
+        if self._backend is None:
+            return 1
+        return self._backend.max_in_flight
+
+    '''
+        update(self, seq, ring, dispatcher)
+
+        Description:
+          Called from the stage lane for each new video frame, identified by its sequence
+          number in the tracker's frame ring.  Processing is skipped when none of the
+          subscribers' event detectors is ready to fire, unless the processor asks for
+          every frame (always_update) or the stage tracks activity for a DutyCycle.
+          Each subscriber gets its own read-only window onto the ring, sized to its
+          frame_buf_size; subscribers that aren't ready only note activity.
+    '''
+    def update(self, seq, ring, dispatcher):
+        ready = [(subscriber, lane) for (subscriber, lane) in self.subscribers
+                 if subscriber.detection_ready()]
+        if (len(ready) == 0 and not self._frame_processor.always_update and
+            not self.track_activity):
+            return
+        # The window pins its frames for the processor; frames overwritten while
+        # waiting in the queue are skipped
+        frame_buf = ring.window(seq, self._frame_buf_size)
+        if not ring.valid(seq):
+            return
+        if self._backend is None:
+            with self.profiler.activate(), self.profiler.stage('process'):
+                contours, detectFrame = self._frame_processor.process(frame_buf=frame_buf,
+                                                                      frame_index=frame_buf.frame_index)
+            self._deliver(seq, ring, dispatcher, ready, contours, detectFrame)
+            frame_buf.release()
+            return
+
+        # Bound the number of frames in the pool; the stage lane absorbs the backlog.
+        # Results are delivered (and the queue shortened) by the futures' done-callbacks.
+        with self._pending_cond:
+            while len(self._pending) >= self._backend.max_in_flight:
+                self._pending_cond.wait()
+        # The window keeps the frames pinned until the worker's result is delivered
+        future = self._backend.submit(self._frame_processor, seq, self._frame_buf_size)
+        with self._pending_cond:
+            self._pending.append((seq, future, ready, frame_buf))
+        future.add_done_callback(lambda f: self._drain(ring, dispatcher))
+
+    def n_pending(self):
+        with self._pending_cond:
+            return len(self._pending)
+
+    # Blocks until frames in flight in the process backend have been delivered
+    def wait_pending(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._pending_cond:
+            while len(self._pending) > 0:
+                if deadline is None:
+                    self._pending_cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._pending_cond.wait(remaining)
+        return True
+
+    # Deliver finished results from the head of the pending queue, in frame order
+    def _drain(self, ring, dispatcher):
+        with self._pending_cond:
+            while len(self._pending) > 0 and self._pending[0][1].done():
+                seq, future, ready, frame_buf = self._pending.popleft()
+                self._pending_cond.notify_all()
+                try:
+                    if future.cancelled():
+                        continue
+                    try:
+                        contours, metadata = future.result()
+                    except Exception:
+                        log.exception("[" + self.name + "] processing failed for frame " +
+                                      str(seq))
+                        continue
+                    self.profiler.record('process', metadata.process_time_s)
+                    self.profiler.merge(metadata.profiler)
+                    self._deliver(seq, ring, dispatcher, ready, contours, None)
+                finally:
+                    frame_buf.release()
+
+    def _deliver(self, seq, ring, dispatcher, ready, contours, detectFrame):
+        if self.track_activity:
+            for (subscriber, lane) in self.subscribers:
+                if (subscriber, lane) not in ready:
+                    subscriber.note_activity(contours)
+        if len(ready) == 0:
+            return
+        # The detection image may be a processor scratch buffer (e.g. MotionKernel
+        # results), overwritten by the next frame before the subscribers get to it
+        if detectFrame is not None:
+            detectFrame = detectFrame.copy()
+        for (subscriber, lane) in ready:
+            window = ring.window(seq, subscriber._frame_buf_size)
+            dispatcher.submit(lane, contours, detectFrame, window, window.frame_index)
@@ -2,6 +2,7 @@
 
 #imports
 import cv2
+import copy
 import time
 import numpy as np
 import logging
@@ -9,7 +10,11 @@ import types
 
 import cv2utils.cv2utils as cvu
 from cv2utils.frameprocessor import FrameProcessor, MotionProcessor
-from cv2utils.tracker import Tracker
+from cv2utils.tracker import Tracker, EventDetector
+from cv2utils.dispatcher import DROP_OLDEST
+from cv2utils.profiler import Profiler
+from cv2utils.framering import FrameBuffer
+from cv2utils.zones import ZoneMap
 
 '''
     class Subscriber
@@ -30,12 +35,37 @@ class Subscriber:
                             dummy logger.
           frame_buf_size  : int, default=2.  Frame buffer size dictates how many past frames are
                             kept for processing / detection logic requiring more than 2.
+          queue_size      : int, default=2.  Number of frames that may wait for this subscriber's
+                            worker before the overflow policy applies.
+          overflow_policy : 'drop_oldest' (default), 'drop_newest' or 'block'.  What to do with a
+                            new frame when the queue is full.  'block' stalls the capture thread.
+          async_handler   : Boolean, default=False.  Under a Tracker, run the handler on a separate
+                            handler worker so event detection never waits on handler I/O.  Events
+                            arriving while the handler is busy coalesce: only the newest is kept.
+                            Each dispatched event copies the handler's frame window, so enable it
+                            for slow handlers only.
+          handler_timeout_s : float, default=1.0.  Handler calls taking longer are logged and
+                            counted, and reported in the heartbeat while still running.
+          object_tracker  : optional ObjectTracker.  Contours are associated across frames into
+                            tracks with persistent ids, which the event detector uses for its
+                            sequential frame count and handlers get as frame_buf.tracks.
+                            Every frame is then processed, to keep tracks continuous.
+          zones           : optional dict of name : polygon ((x, y) full-frame pixels), or a
+                            ZoneMap.  The detected area in each zone is measured every frame
+                            and passed to the event detector (see EventDetector require_zones
+                            / exclude_zones); handlers get it as frame_buf.zones.
     '''
     def __init__(self, frame_processor=None,
                  event_detector=None,
                  handler=None, frame_buf_size=2,
                  name='subscriber1',
-                 log_events=True):
+                 log_events=True,
+                 queue_size=2,
+                 overflow_policy=DROP_OLDEST,
+                 async_handler=False,
+                 handler_timeout_s=1.0,
+                 object_tracker=None,
+                 zones=None):
 
         if (frame_processor is None):
             # Default motion processor
@@ -51,16 +81,38 @@ class Subscriber:
             self._handler = Subscriber.get_dummy_handler_obj(handler)
         else:
             self._handler = handler
+        self._frame_hook = Subscriber.get_frame_hook(self._handler)
+        self._object_tracker = object_tracker
+        self.tracks = list()
+        if zones is not None and not isinstance(zones, ZoneMap):
+            zones = ZoneMap(zones)
+        self._zones = zones
+        self.zone_occupancy = None
         self._frame_buf_size = frame_buf_size
-        self._frame_buf = [None] * self._frame_buf_size
+        self._frame_buf = FrameBuffer(self._frame_buf_size)
         self._frame_index = 0
         self.name = name
         self.log_events = log_events
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.async_handler = async_handler
+        self.handler_timeout_s = handler_timeout_s
+        self.n_handler_timeouts = 0
+        self._handler_started = None
+        # (dispatcher, lane) the Tracker runs this subscriber's handler on
+        self._handler_executor = None
+        self._event_listeners = list()
+        # Last processor result with activity, seen while the detector wasn't ready
+        self._activity_time = 0.
+        # detect / handle times and capture-to-decision latency
+        self.profiler = Profiler(name)
 
     ''' update(self, frame)
 
         Description:
-          Called by tracker object for each new video frame.
+          Called for each new video frame when the subscriber runs its own frame processor.
+          (A Tracker instead shares processing between subscribers through a ProcessingStage
+          and calls process_result directly.)
         Arguments:
           frame : CV2 image frame passed to subscriber
         Returns:
@@ -70,23 +122,208 @@ class Subscriber:
         # Store the frame in the frame buffer
         self._frame_buf[self._frame_index] = frame
 
-        if (self._event_detector.detection_ready() is False):
-            return
-        # Run image processing to identify regions of interest
-        contours, detectFrame = self._frame_processor.process(frame_buf=self._frame_buf,
-                                                              frame_index=self._frame_index)
+        ready = self.detection_ready()
+        if ready or self._frame_processor.always_update:
+            # Run image processing to identify regions of interest
+            with self.profiler.activate(), self.profiler.stage('process'):
+                contours, detectFrame = self._frame_processor.process(frame_buf=self._frame_buf,
+                                                                      frame_index=self._frame_index)
+            if ready:
+                self.process_result(contours, detectFrame, self._frame_buf, self._frame_index)
+            else:
+                self.note_activity(contours)
+
+        self._frame_index = (self._frame_index + 1) % self._frame_buf_size
+
+    # Frames are processed while the detector can fire, or always for frame hooks and
+    # object tracking
+    def detection_ready(self):
+        return (self._frame_hook is not None or self._object_tracker is not None or
+                self._event_detector.detection_ready())
+
+    ''' process_result(self, contours, detectFrame, frame_buf, frame_index)
+
+        Description:
+          Runs event detection on a frame processor result and invokes the handler if the
+          event detector is triggered.
+        Arguments:
+          contours    : detected contours from the frame processor
+          detectFrame : detection image from the frame processor
+          frame_buf   : frame buffer the result was computed from
+          frame_index : index of the current frame in frame_buf
+        Returns:
+          none
+    '''
+    def process_result(self, contours, detectFrame, frame_buf, frame_index):
         # If event detector is triggered by detection artifact, then run
         # the event handler.
-        if (self._event_detector.detect(contours)):
+        captured = frame_buf.timestamp() if hasattr(frame_buf, 'timestamp') else None
+        # Zone occupancy goes to the event detector only for subscribers with zones, so
+        # detectors without zone support keep working
+        zone_args = dict()
+        if self._zones is not None:
+            zone_args['zones'] = self._zone_occupancy(contours, frame_buf, frame_index)
+        if self._object_tracker is not None:
+            with self.profiler.stage('track'):
+                self.tracks = self._object_tracker.update(contours, captured)
+            if hasattr(frame_buf, 'tracks'):
+                frame_buf.tracks = self.tracks
+            with self.profiler.stage('detect'):
+                detected = self._event_detector.detect(contours, self.tracks, **zone_args)
+        else:
+            with self.profiler.stage('detect'):
+                detected = self._event_detector.detect(contours, **zone_args)
+        if self._frame_hook is not None:
+            with self.profiler.stage('on_frame'):
+                self._frame_hook(contours, frame_buf, frame_index)
+        if captured is not None:
+            self.profiler.record('latency', time.time() - captured)
+        if (detected):
             if self.log_events:
                 log = Tracker.get_logger()
                 log.info('[' + self.name + '] event detected')
                 log.debug(self._event_detector.event_metadata)
-            if (self._handler is not None):
-                self._handler.handle(contours, self._frame_buf, self._frame_index)
+            for listener in self._event_listeners:
+                listener(self, contours, frame_buf, frame_index)
+            if (self._handler is None):
+                return
+            if self._handler_executor is None:
+                self.run_handler(contours, frame_buf, frame_index)
+                return
+            # The handler may run after these frames have left the ring
+            if hasattr(frame_buf, 'snapshot'):
+                frame_buf = frame_buf.snapshot()
+            dispatcher, lane = self._handler_executor
+            dispatcher.submit(lane, contours, frame_buf, frame_index)
 
-        self._frame_index = (self._frame_index + 1) % self._frame_buf_size
+    # Detected area per zone for this frame, also published as frame_buf.zones
+    def _zone_occupancy(self, contours, frame_buf, frame_index):
+        frame = frame_buf[frame_index]
+        if contours is None or frame is None:
+            occupancy = None
+        else:
+            with self.profiler.stage('zones'):
+                occupancy = self._zones.occupancy(contours, frame.shape)
+        self.zone_occupancy = occupancy
+        if hasattr(frame_buf, 'zones'):
+            frame_buf.zones = occupancy
+        return occupancy
+
+    ''' add_event_listener(self, listener)
+
+        Description:
+          Calls listener(subscriber, contours, frame_buf, frame_index) on the detection
+          worker for every detected event, before the handler is dispatched.  Listeners
+          must not block.
+    '''
+    def add_event_listener(self, listener):
+        self._event_listeners.append(listener)
+
+    ''' note_activity(self, contours)
 
+        Description:
+          Records activity from a frame processor result that doesn't go to event
+          detection (the detector is cooling down): contours larger than the detector's
+          min_contour_area_px count, so a DutyCycle stays active through
+          ongoing motion.
+    '''
+    def note_activity(self, contours):
+        if contours is None or len(contours) == 0:
+            return
+        stats = cvu.contour_stats(contours)
+        if stats.area[stats.largest()] > getattr(self._event_detector, 'min_contour_area_px', 0):
+            self._activity_time = time.time()
+
+    # Last time the event detector saw contours meeting its criteria, or activity was
+    # noted while it was cooling down
+    @property
+    def last_activity_time(self):
+        return max(getattr(self._event_detector, 'last_activity_time', 0.), self._activity_time)
+
+    @property
+    def event_metadata(self):
+        return getattr(self._event_detector, 'event_metadata', None)
+
+    ''' run_handler(self, contours, frame_buf, frame_index)
+
+        Description:
+          Invokes the handler for a detected event, timing it against handler_timeout_s.
+          Runs on the handler worker for asynchronous handlers.
+    '''
+    def run_handler(self, contours, frame_buf, frame_index):
+        self._handler_started = time.time()
+        try:
+            with self.profiler.stage('handle'):
+                self._handler.handle(contours, frame_buf, frame_index)
+        finally:
+            elapsed = time.time() - self._handler_started
+            self._handler_started = None
+            if self.handler_timeout_s is not None and elapsed > self.handler_timeout_s:
+                self.n_handler_timeouts += 1
+                Tracker.get_logger().warning('[' + self.name + '] handler took ' +
+                                             str(np.round(elapsed,2)) + 's (timeout ' +
+                                             str(self.handler_timeout_s) + 's)')
+
+    # Seconds the running handler call is over handler_timeout_s, or 0
+    def handler_overdue(self):
+        started = self._handler_started
+        if started is None or self.handler_timeout_s is None:
+            return 0.
+        return max(0., time.time() - started - self.handler_timeout_s)
+
+    ''' for_stream(self, stream_name)
+
+        Description:
+          Returns a copy of this subscriber for one stream of a TrackerGroup, named
+          '<name>@<stream_name>'.  The copy has its own event detector state, frame buffer
+          and profiler; stateful frame processors are cloned, while stateless processors
+          are shared.  Handler objects are copied too, so handler state (e.g. a
+          closed-loop MotorController's target filter) is kept per stream: through the
+          handler's own for_stream(stream_name) if it has one, else copy.copy().  Plain
+          handler functions are shared.
+    '''
+    def for_stream(self, stream_name):
+        subscriber = copy.copy(self)
+        subscriber.name = self.name + '@' + stream_name
+        subscriber._event_detector = copy.copy(self._event_detector)
+        if self._handler is not None and not isinstance(self._handler, type):
+            if hasattr(self._handler, 'for_stream'):
+                subscriber._handler = self._handler.for_stream(stream_name)
+            else:
+                subscriber._handler = copy.copy(self._handler)
+            subscriber._frame_hook = Subscriber.get_frame_hook(subscriber._handler)
+        if not self._frame_processor.stateless:
+            subscriber._frame_processor = self._frame_processor.clone()
+        subscriber._frame_buf = FrameBuffer(self._frame_buf_size)
+        subscriber._frame_index = 0
+        subscriber.profiler = Profiler(subscriber.name)
+        subscriber.n_handler_timeouts = 0
+        subscriber._handler_started = None
+        subscriber._handler_executor = None
+        subscriber._activity_time = 0.
+        subscriber._event_listeners = list(self._event_listeners)
+        if self._object_tracker is not None:
+            subscriber._object_tracker = copy.deepcopy(self._object_tracker)
+            subscriber.tracks = list()
+        if self._zones is not None:
+            subscriber._zones = copy.copy(self._zones)
+            subscriber.zone_occupancy = None
+        return subscriber
+
+    @property
+    def frame_processor(self):
+        return self._frame_processor
+
+
+    # Handlers with an on_frame(contours, frame_buf, frame_index) method see every
+    # processed frame (e.g. closed-loop control), not just detected events, unless their
+    # wants_frames attribute is False.  A frame hook keeps frames processed while the
+    # event detector cools down, so handlers only ask for it when they use it.
+    @staticmethod
+    def get_frame_hook(handler):
+        if not getattr(handler, 'wants_frames', True):
+            return None
+        return getattr(handler, 'on_frame', None)
 
     # Create a dummy wrapper object for handler function not requiring any
     # state information.
@@ -0,0 +1,11 @@
+import pytest
+
+# Tests import the package as cv2utils through the tests/cv2utils symlink (as the
+# examples do); don't collect the package again through it.
+collect_ignore = ['cv2utils']
+
+# Run each test in its own temporary directory, so files written to the working
+# directory (e.g. Tracker.log, see Tracker._get_default_logger) stay out of the tree.
+@pytest.fixture(autouse=True)
+def _run_in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
@@ -0,0 +1,56 @@
+import time
+
+from cv2utils.actuator import ProcessChannel, RecordingChannel
+from cv2utils.espeakcontroller import EspeakController
+
+def test_one_line_per_speech_item():
+    channel = RecordingChannel()
+    controller = EspeakController(speech_items=['hello!', 'goodbye!'], sequential=True,
+                                  channel=channel)
+    for i in range(0, 3):
+        controller.handle(None, None, 0)
+        assert channel.flush(1.)
+    assert channel.commands == ['hello!', 'goodbye!', 'hello!']
+    assert [len(batch) for (timestamp, batch) in channel.batches] == [1, 1, 1]
+    channel.close()
+
+def test_speech_queued_behind_a_busy_channel_coalesces():
+    channel = RecordingChannel(delay_s=0.2)
+    controller = EspeakController(speech_items=['a', 'b', 'c', 'd'], sequential=True,
+                                  channel=channel)
+    controller._speak(0)
+    time.sleep(0.05)
+    # Spoken while 'a' is still playing: only the newest item is kept
+    for idx in (1, 2, 3):
+        controller._speak(idx)
+    assert channel.flush(2.)
+    assert channel.commands == ['a', 'd']
+    assert channel.n_coalesced == 2
+    channel.close()
+
+def test_unkeyed_commands_batch_in_order():
+    channel = RecordingChannel(delay_s=0.1, max_batch=2)
+    channel.send('first')
+    time.sleep(0.05)
+    for command in ('second', 'third', 'fourth'):
+        channel.send(command)
+    assert channel.flush(2.)
+    assert [batch for (timestamp, batch) in channel.batches] == \
+        [['first'], ['second', 'third'], ['fourth']]
+    channel.close()
+
+def test_process_channel_delivers_each_line_before_close(tmp_path):
+    output = tmp_path / 'lines'
+    channel = ProcessChannel(['sh', '-c', 'while read line; do echo "$line" >> ' +
+                              str(output) + '; done'], name='lines')
+    channel.send('hello\nworld')
+    channel.send('again')
+    assert channel.flush(2.)
+    deadline = time.time() + 2.
+    while time.time() < deadline:
+        if output.exists() and output.read_text() == 'hello world\nagain\n':
+            break
+        time.sleep(0.01)
+    # The helper sees the lines while the channel is still open
+    assert output.read_text() == 'hello world\nagain\n'
+    channel.close()
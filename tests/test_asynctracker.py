@@ -0,0 +1,124 @@
+import asyncio
+
+import numpy as np
+
+from cv2utils.asynctracker import AsyncTracker
+from cv2utils.subscriber import Subscriber
+from cv2utils.tracker import EventDetector
+from cv2utils.framesource import MemorySource
+
+def moving_square(n_frames):
+    frames = list()
+    for i in range(0, n_frames):
+        frame = np.zeros((120, 160, 3), dtype=np.uint8)
+        x = (i*7) % 130
+        frame[30:60, x:x+30] = 255
+        frames.append(frame)
+    return frames
+
+def detector():
+    return EventDetector(time_between_triggers_s=0., min_contour_area_px=50)
+
+def async_tracker():
+    return AsyncTracker(heartbeat_frames=10**9, skip_stale_frames=False)
+
+def test_stream_yields_frames_and_events():
+    async def main():
+        async with async_tracker() as tracker:
+            tracker.add_subscriber(Subscriber(event_detector=detector(), log_events=False,
+                                              overflow_policy='block'))
+            await tracker.start(MemorySource(moving_square(40)))
+            n_frames = 0
+            events = list()
+            async for frame, new_events in tracker.stream():
+                if frame is not None:
+                    assert frame.shape == (120, 160, 3)
+                    n_frames += 1
+                events += new_events
+            return n_frames, events
+    n_frames, events = asyncio.run(main())
+    assert n_frames > 0
+    assert len(events) > 0
+    seqs = [event.seq for event in events]
+    assert seqs == sorted(seqs)
+
+def test_async_handler_runs_on_the_loop():
+    class Handler():
+        def __init__(self):
+            self.n = 0
+            self.loops = set()
+        async def handle(self, contours, frame_buf, frame_index):
+            self.loops.add(asyncio.get_running_loop())
+            await asyncio.sleep(0)
+            self.n += 1
+    handler = Handler()
+    async def main():
+        async with async_tracker() as tracker:
+            subscriber = Subscriber(handler=handler, event_detector=detector(),
+                                    log_events=False, overflow_policy='block')
+            tracker.add_subscriber(subscriber)
+            assert subscriber.async_handler
+            await tracker.start(MemorySource(moving_square(30)))
+            await tracker.wait()
+            return asyncio.get_running_loop()
+    loop = asyncio.run(main())
+    assert handler.n > 0
+    assert handler.loops == { loop }
+
+def test_events_not_kept_without_a_stream():
+    async def main():
+        async with async_tracker() as tracker:
+            tracker.add_subscriber(Subscriber(event_detector=detector(), log_events=False,
+                                              overflow_policy='block'))
+            await tracker.start(MemorySource(moving_square(30)))
+            await tracker.wait()
+            await asyncio.sleep(0.05)
+            return tracker.tracker.subscribers[0], len(tracker._pending_events)
+    subscriber, n_pending = asyncio.run(main())
+    assert subscriber.profiler.summary() is not None
+    assert n_pending == 0
+
+def test_cancelled_stream_leaves_no_pending_read():
+    async def main():
+        async with async_tracker() as tracker:
+            tracker.add_subscriber(Subscriber(event_detector=detector(), log_events=False))
+            await tracker.start(MemorySource(moving_square(10), loop=True, fps=5))
+            async def consume():
+                async for frame, events in tracker.stream():
+                    pass
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.3)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            assert not tracker._streaming
+            # Only this test's own task is left
+            others = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            assert all([t.done() for t in others])
+            # A new stream picks up frames again
+            stream = tracker.stream()
+            frame, events = await asyncio.wait_for(stream.__anext__(), 2.)
+            assert frame is not None
+            await stream.aclose()
+            assert not tracker._streaming
+    asyncio.run(main())
+
+def test_stop_ends_a_live_stream_and_is_idempotent():
+    async def main():
+        tracker = async_tracker()
+        tracker.add_subscriber(Subscriber(event_detector=detector(), log_events=False))
+        await tracker.start(MemorySource(moving_square(10), loop=True, fps=20))
+        async def consume():
+            n = 0
+            async for frame, events in tracker.stream():
+                n += 1
+            return n
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.3)
+        await tracker.stop()
+        n = await asyncio.wait_for(task, 2.)
+        await tracker.stop()
+        return n
+    assert asyncio.run(main()) > 0
@@ -0,0 +1,90 @@
+import pickle
+
+import cv2
+import numpy as np
+import pytest
+
+import cv2utils.cv2utils as cvu
+from cv2utils.tracker import EventDetector
+from cv2utils.frameprocessor import MotionProcessor
+from cv2utils.zones import ZoneMap
+
+def mask():
+    image = np.zeros((240, 320), dtype=np.uint8)
+    cv2.rectangle(image, (20, 30), (79, 89), 255, cv2.FILLED)
+    cv2.circle(image, (200, 150), 30, 255, cv2.FILLED)
+    cv2.rectangle(image, (280, 10), (289, 19), 255, cv2.FILLED)
+    return image
+
+def test_blobs_match_contours():
+    blobs, _ = cvu.get_blobs(mask(), erode=False, dilate=False)
+    contours, _ = cvu.get_contours(mask(), erode=False, dilate=False)
+    assert isinstance(blobs, cvu.BlobSet)
+    assert len(blobs) == len(contours) == 3
+    blob_stats = cvu.contour_stats(blobs)
+    stats = cvu.contour_stats(contours)
+    order = np.argsort(stats.cx)
+    blob_order = np.argsort(blob_stats.cx)
+    # Pixel counts include the boundary pixels the polygon area leaves out
+    assert np.all(blob_stats.area[blob_order] >= stats.area[order])
+    assert np.allclose(blob_stats.area[blob_order], stats.area[order], rtol=0.25)
+    assert np.allclose(blob_stats.cx[blob_order], stats.cx[order], atol=1.)
+    assert np.allclose(blob_stats.cy[blob_order], stats.cy[order], atol=1.)
+    assert np.array_equal(blob_stats.bbox[blob_order], stats.bbox[order])
+
+def test_contours_traced_on_demand():
+    blobs, _ = cvu.get_blobs(mask(), erode=False, dilate=False)
+    cvu.contour_stats(blobs).largest()
+    assert all([contour is None for contour in blobs._contours])
+    contour = blobs[0]
+    assert cv2.contourArea(contour) > 0
+    assert sum([contour is not None for contour in blobs._contours]) == 1
+    assert len(cvu.as_contours(blobs)) == 3
+    assert len(cvu.contour_stats(blobs).perimeter) == 3
+
+def test_event_detector_accepts_blobs():
+    blobs, _ = cvu.get_blobs(mask(), erode=False, dilate=False)
+    contours, _ = cvu.get_contours(mask(), erode=False, dilate=False)
+    detectors = [EventDetector(time_between_triggers_s=0., min_contour_area_px=2000)
+                 for i in range(0, 2)]
+    assert detectors[0].detect(blobs) and detectors[1].detect(contours)
+    assert detectors[0].event_metadata.max_contour_area == pytest.approx(
+        detectors[1].event_metadata.max_contour_area, rel=0.1)
+    assert cv2.contourArea(detectors[0]._largest_contour) > 2000
+
+def test_processor_maps_blobs_to_full_frame():
+    frames = [np.zeros((240, 320, 3), dtype=np.uint8) for i in range(0, 2)]
+    frames[1][40:120, 160:240] = 255
+    regions = list()
+    for blobs in (False, True):
+        processor = MotionProcessor(scale=0.5, blobs=blobs)
+        regions.append(processor.process(frame_buf=frames, frame_index=1)[0])
+    assert isinstance(regions[1], cvu.BlobSet)
+    stats = [cvu.contour_stats(r) for r in regions]
+    assert len(stats[1]) == len(stats[0]) == 1
+    assert stats[1].cx[0] == pytest.approx(stats[0].cx[0], abs=2.)
+    assert stats[1].cy[0] == pytest.approx(stats[0].cy[0], abs=2.)
+    assert stats[1].area[0] == pytest.approx(stats[0].area[0], rel=0.15)
+    # Traced contours are in full-frame coordinates too
+    x, y, w, h = cv2.boundingRect(regions[1][0])
+    assert abs(x - stats[0].bbox[0][0]) <= 2 and abs(w - stats[0].bbox[0][2]) <= 4
+
+def test_roi_filtering_and_pickling_keep_blobs():
+    frames = [np.zeros((240, 320, 3), dtype=np.uint8) for i in range(0, 2)]
+    frames[1][20:60, 20:60] = 255
+    frames[1][150:200, 200:260] = 255
+    processor = MotionProcessor(blobs=True, rois=[(0, 0, 100, 100), (280, 200, 40, 40)])
+    blobs = processor.process(frame_buf=frames, frame_index=1)[0]
+    assert len(blobs) == 1
+    copied = pickle.loads(pickle.dumps(blobs))
+    assert copied._labels is None
+    assert np.array_equal(copied[0], blobs[0])
+    assert cvu.contour_stats(copied).area[0] == cvu.contour_stats(blobs).area[0]
+
+def test_zone_occupancy_from_blobs():
+    zones = ZoneMap({ 'left' : [(0, 0), (160, 0), (160, 240), (0, 240)] })
+    blobs, _ = cvu.get_blobs(mask(), erode=False, dilate=False)
+    contours, _ = cvu.get_contours(mask(), erode=False, dilate=False)
+    occupancy = zones.occupancy(blobs, (240, 320, 3))['left']
+    assert occupancy == pytest.approx(60*60, rel=0.05)
+    assert occupancy == pytest.approx(zones.occupancy(contours, (240, 320, 3))['left'], rel=0.2)
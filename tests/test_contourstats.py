@@ -0,0 +1,52 @@
+import cv2
+import numpy as np
+
+import cv2utils.cv2utils as cvu
+
+def contour(points):
+    return np.array(points, dtype=np.int32).reshape(-1, 1, 2)
+
+def test_stats_match_opencv():
+    mask = np.zeros((120, 160), dtype=np.uint8)
+    cv2.rectangle(mask, (10, 10), (40, 30), 255, -1)
+    cv2.circle(mask, (100, 60), 20, 255, -1)
+    cv2.fillPoly(mask, [contour([(20, 80), (60, 70), (45, 110)])], 255)
+    contours = list(cvu.find_contours(mask))
+    # Hand-made, including a concave polygon
+    contours.append(contour([(0, 0), (30, 0), (30, 30), (15, 10), (0, 30)]))
+    stats = cvu.contour_stats(contours)
+    assert len(stats) == len(contours)
+    for (i, c) in enumerate(contours):
+        m = cv2.moments(c)
+        assert np.isclose(stats.area[i], cv2.contourArea(c))
+        assert np.isclose(stats.cx[i], m['m10'] / m['m00'])
+        assert np.isclose(stats.cy[i], m['m01'] / m['m00'])
+        assert tuple(stats.bbox[i]) == cv2.boundingRect(c)
+        assert np.isclose(stats.perimeter[i], cv2.arcLength(c, True))
+
+def test_degenerate_contours():
+    contours = [contour([(5, 7)]),
+                contour([(2, 3), (8, 3)]),
+                # Collinear: zero area
+                contour([(0, 0), (4, 4), (8, 8)])]
+    stats = cvu.contour_stats(contours)
+    for (i, c) in enumerate(contours):
+        points = c.reshape(-1, 2)
+        assert cv2.contourArea(c) == 0
+        assert stats.area[i] == 0
+        # OpenCV has no centroid here (m00 == 0): the point average is used instead
+        assert cv2.moments(c)['m00'] == 0
+        assert np.isclose(stats.cx[i], points[:,0].mean())
+        assert np.isclose(stats.cy[i], points[:,1].mean())
+        assert tuple(stats.bbox[i]) == cv2.boundingRect(c)
+        assert np.isclose(stats.perimeter[i], cv2.arcLength(c, True))
+    assert stats.largest() == -1
+    assert len(cvu.contour_stats([])) == 0
+
+def test_cached_stats_follow_list_changes():
+    contours = [contour([(0, 0), (10, 0), (10, 10), (0, 10)])]
+    assert cvu.contour_stats(contours) is cvu.contour_stats(contours)
+    contours.append(contour([(20, 20), (40, 20), (40, 40), (20, 40)]))
+    assert list(cvu.contour_stats(contours).area) == [100., 400.]
+    contours[0] = contour([(0, 0), (5, 0), (5, 5), (0, 5)])
+    assert list(cvu.contour_stats(contours).area) == [25., 400.]
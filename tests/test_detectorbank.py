@@ -0,0 +1,82 @@
+import numpy as np
+
+from cv2utils.detectorbank import DetectorBank
+from cv2utils.tracker import EventDetector
+
+def square(x, y, side):
+    return np.array([[[x, y]], [[x+side, y]], [[x+side, y+side]], [[x, y+side]]],
+                    dtype=np.int32)
+
+def random_frames(n_frames, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = list()
+    for i in range(0, n_frames):
+        n = rng.integers(0, 4)
+        frames.append([square(int(rng.integers(0, 500)), int(rng.integers(0, 400)),
+                              int(rng.integers(5, 120))) for j in range(0, n)])
+    return frames
+
+def test_bank_fires_like_event_detectors():
+    rules = [ dict(min_contour_area_px=100, max_contour_area_px=5000, min_sequential_frames=1),
+              dict(min_contour_area_px=2000, max_contour_area_px=20000, min_sequential_frames=2),
+              dict(min_contour_area_px=500, max_contour_area_px=50000, min_sequential_frames=3) ]
+    bank = DetectorBank()
+    detectors = list()
+    for (i, rule) in enumerate(rules):
+        bank.add_rule(i, time_between_triggers_s=0., **rule)
+        detectors.append(EventDetector(time_between_triggers_s=0., **rule))
+    n_fired = 0
+    for contours in random_frames(300):
+        fired = bank.detect(contours)
+        expected = [i for (i, detector) in enumerate(detectors) if detector.detect(contours)]
+        assert fired == expected
+        n_fired += len(fired)
+        for metadata in bank.event_metadata:
+            detector = detectors[metadata.rule_id]
+            assert metadata.n_seq_frames == detector.event_metadata.n_seq_frames
+            assert metadata.max_contour_area == detector.event_metadata.max_contour_area
+    assert n_fired > 0
+
+def test_bank_copies_rule_state():
+    bank = DetectorBank()
+    bank.add_rule('a', min_contour_area_px=10, min_sequential_frames=2,
+                  time_between_triggers_s=0.)
+    bank.detect([square(0, 0, 20)])
+    copied = bank.__copy__()
+    assert copied.detect([square(0, 0, 20)]) == ['a']
+    assert bank.trigger_count[0] == 1
+
+def test_bank_zone_rules_match_event_detectors():
+    rules = [ dict(require_zones=['door']),
+              dict(exclude_zones=['tree']),
+              dict(require_zones=['door'], exclude_zones=['tree'], min_zone_area_px=50),
+              dict() ]
+    bank = DetectorBank()
+    detectors = list()
+    for (i, rule) in enumerate(rules):
+        bank.add_rule(i, min_contour_area_px=10, time_between_triggers_s=0., **rule)
+        detectors.append(EventDetector(min_contour_area_px=10, time_between_triggers_s=0.,
+                                       **rule))
+    assert bank.zone_names == ['door', 'tree']
+    contours = [square(0, 0, 20)]
+    for zones in ({ 'door' : 400., 'tree' : 0. }, { 'door' : 60., 'tree' : 60. },
+                  { 'door' : 0., 'tree' : 400. }, { 'door' : 200. }, None):
+        expected = [i for (i, detector) in enumerate(detectors)
+                    if detector.detect(contours, zones=zones)]
+        assert bank.detect(contours, zones=zones) == expected
+    assert bank.detect(contours, zones={ 'door' : 400., 'tree' : 0. }) == [0, 1, 2, 3]
+    assert bank.event_metadata[0].zones == { 'door' : 400., 'tree' : 0. }
+
+def test_bank_under_subscriber_with_zones():
+    from cv2utils.subscriber import Subscriber
+    fired = list()
+    bank = DetectorBank()
+    bank.add_rule('door', min_contour_area_px=100, time_between_triggers_s=0.,
+                  require_zones=['door'])
+    subscriber = Subscriber(event_detector=bank, log_events=False,
+                            handler=lambda c, fb, i: fired.append(list(bank.event_metadata)),
+                            zones={ 'door' : [(0, 0), (80, 0), (80, 120), (0, 120)] })
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    subscriber.process_result([square(10, 10, 40)], None, [frame], 0)
+    subscriber.process_result([square(100, 10, 40)], None, [frame], 0)
+    assert len(fired) == 1 and fired[0][0].rule_id == 'door'
@@ -0,0 +1,119 @@
+import time
+from threading import Event, Thread
+
+import pytest
+
+from cv2utils.dispatcher import Dispatcher, Lane, DROP_OLDEST, DROP_NEWEST, BLOCK
+
+# Lane whose first item blocks until released, so later items stay queued
+def blocked_lane(dispatcher, overflow_policy, maxsize=2):
+    started = Event()
+    release = Event()
+    done = list()
+    def target(item):
+        if item == 0:
+            started.set()
+            release.wait(5.)
+        done.append(item)
+    lane = dispatcher.add_lane(Lane(target, maxsize=maxsize, overflow_policy=overflow_policy))
+    dispatcher.submit(lane, 0)
+    assert started.wait(5.)
+    return lane, release, done
+
+def test_drop_oldest_keeps_newest_items():
+    dispatcher = Dispatcher()
+    lane, release, done = blocked_lane(dispatcher, DROP_OLDEST)
+    for item in range(1, 5):
+        assert dispatcher.submit(lane, item)
+    release.set()
+    assert dispatcher.wait_idle(5.)
+    assert done == [0, 3, 4]
+    assert lane.n_dropped == 2
+    dispatcher.stop()
+
+def test_drop_newest_keeps_queued_items():
+    dispatcher = Dispatcher()
+    lane, release, done = blocked_lane(dispatcher, DROP_NEWEST)
+    results = [dispatcher.submit(lane, item) for item in range(1, 5)]
+    release.set()
+    assert dispatcher.wait_idle(5.)
+    assert results == [True, True, False, False]
+    assert done == [0, 1, 2]
+    assert lane.n_dropped == 2
+    dispatcher.stop()
+
+def test_block_waits_for_room():
+    dispatcher = Dispatcher()
+    lane, release, done = blocked_lane(dispatcher, BLOCK, maxsize=1)
+    dispatcher.submit(lane, 1)
+    producer = Thread(target=dispatcher.submit, args=(lane, 2))
+    producer.start()
+    producer.join(0.2)
+    # Lane full: the producer waits instead of dropping
+    assert producer.is_alive()
+    release.set()
+    producer.join(5.)
+    assert not producer.is_alive()
+    assert dispatcher.wait_idle(5.)
+    assert done == [0, 1, 2]
+    assert lane.n_dropped == 0
+    dispatcher.stop()
+
+def test_lane_items_never_run_concurrently():
+    dispatcher = Dispatcher(n_workers=4)
+    running = list()
+    overlaps = list()
+    def target(item):
+        running.append(item)
+        if len(running) > 1:
+            overlaps.append(item)
+        time.sleep(0.001)
+        running.remove(item)
+    lane = dispatcher.add_lane(Lane(target, maxsize=100, overflow_policy=BLOCK))
+    for item in range(0, 50):
+        dispatcher.submit(lane, item)
+    assert dispatcher.wait_idle(5.)
+    assert lane.n_done == 50
+    assert overlaps == []
+    dispatcher.stop()
+
+def test_priority_shares_saturated_workers():
+    dispatcher = Dispatcher(n_workers=1)
+    order = list()
+    gate = Event()
+    def target(group):
+        gate.wait(5.)
+        order.append(group)
+    high = dispatcher.add_lane(Lane(target, maxsize=100, overflow_policy=BLOCK,
+                                    group='high', priority=2))
+    low = dispatcher.add_lane(Lane(target, maxsize=100, overflow_policy=BLOCK,
+                                   group='low', priority=1))
+    for i in range(0, 30):
+        dispatcher.submit(high, 'high')
+        dispatcher.submit(low, 'low')
+    gate.set()
+    assert dispatcher.wait_idle(5.)
+    first = order[:30]
+    assert 17 <= first.count('high') <= 23
+    dispatcher.stop()
+
+def test_invalid_lane_arguments():
+    with pytest.raises(ValueError):
+        Lane(print, overflow_policy='drop_all')
+    with pytest.raises(ValueError):
+        Lane(print, maxsize=0)
+
+def test_tracker_stops_only_its_own_dispatchers():
+    from cv2utils.tracker import Tracker
+    shared = Dispatcher(n_workers=1, name='shared')
+    tracker = Tracker(dispatcher=shared)
+    tracker.stop()
+    # The stage and handler dispatchers it created are stopped, the shared one keeps running
+    assert tracker._stage_dispatcher._stopped
+    assert tracker._handler_dispatcher._stopped
+    assert not shared._stopped
+    done = Event()
+    lane = shared.add_lane(Lane(lambda item: done.set(), name='after'))
+    shared.submit(lane, 1)
+    assert done.wait(2.)
+    shared.stop()
@@ -0,0 +1,84 @@
+import os
+import time
+
+import numpy as np
+
+import cv2utils.cv2utils as cvu
+from cv2utils.eventrecorder import EventRecorder
+
+class TimedFrames():
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.t = 0.
+
+    def __getitem__(self, index):
+        return self.frame
+
+    def timestamp(self):
+        return self.t
+
+def record(recorder, frames, t):
+    frames.t = t
+    recorder.on_frame(None, frames, 0)
+    recorder._dispatcher.wait_idle(5.)
+
+def test_clip_frames_are_streamed(tmp_path):
+    recorder = EventRecorder(directory=str(tmp_path), pre_roll_s=0.5, post_roll_s=1.,
+                             fps=10., max_clip_s=2.)
+    frames = TimedFrames(np.zeros((48, 64, 3), dtype=np.uint8))
+    for i in range(0, 10):
+        record(recorder, frames, i * 0.1)
+    recorder.handle(None, frames, 0)
+    for i in range(10, 31):
+        record(recorder, frames, i * 0.1)
+        # Encoded clip frames don't pile up in memory
+        assert recorder._clip is None or len(recorder._clip.frames) == 0
+        if i % 5 == 0:
+            recorder.handle(None, frames, 0)
+    recorder.close()
+    # 0.5s pre-roll, events up to 3s plus 1s post-roll, split after 2s
+    clips = sorted(os.listdir(str(tmp_path)))
+    assert len(clips) == 2
+    assert recorder.n_clips == 2
+    assert all([os.path.getsize(os.path.join(str(tmp_path), clip)) > 0 for clip in clips])
+
+def test_disk_quota_keeps_newest(tmp_path):
+    for i in range(0, 3):
+        path = os.path.join(str(tmp_path), 'event_' + str(i))
+        with open(path, 'wb') as f:
+            f.write(b'x' * 100)
+        os.utime(path, (1000. + i, 1000. + i))
+    evicted = cvu.enforce_disk_quota(str(tmp_path), min_free_bytes=2**62,
+                                     pattern='event_*', keep_newest=1)
+    assert len(evicted) == 2
+    assert os.listdir(str(tmp_path)) == ['event_2']
+    # Files still being written are skipped
+    kept = os.path.join(str(tmp_path), 'event_2')
+    evicted = cvu.enforce_disk_quota(str(tmp_path), max_files=0, pattern='event_*',
+                                     keep={kept})
+    assert len(evicted) == 0
+    evicted = cvu.enforce_disk_quota(str(tmp_path), max_files=0, pattern='event_*')
+    assert len(evicted) == 1
+
+def test_streams_share_one_disk_quota(tmp_path):
+    parent = EventRecorder(directory=str(tmp_path), pre_roll_s=0.2, post_roll_s=0.2,
+                           fps=10., max_clips=3)
+    recorders = [parent.for_stream(name) for name in ('a', 'b')]
+    frames = TimedFrames(np.zeros((48, 64, 3), dtype=np.uint8))
+    for i in range(0, 4):
+        for (j, recorder) in enumerate(recorders):
+            t = 10.*i + j
+            record(recorder, frames, t)
+            recorder.handle(None, frames, 0)
+            record(recorder, frames, t + 0.1)
+            recorder.flush(5.)
+    # One budget for both streams, not max_clips per stream
+    clips = sorted(os.listdir(str(tmp_path)))
+    assert len(clips) == 3
+    assert sum([recorder.n_evicted for recorder in recorders]) == 5
+    # The oldest clips went first, whichever stream wrote them
+    assert [clip[:8] for clip in clips] == ['event_a_', 'event_b_', 'event_b_']
+    for recorder in recorders:
+        recorder.close()
+    parent.close()
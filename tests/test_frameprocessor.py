@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+import pytest
+
+import cv2utils.cv2utils as cvu
+from cv2utils.frameprocessor import AnalysisFrames, MotionProcessor
+
+# Full-frame rectangle (x, y, w, h)
+RECT = (100, 60, 100, 80)
+
+def frame_with_rect():
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    x, y, w, h = RECT
+    frame[y:y+h, x:x+w] = 255
+    return frame
+
+@pytest.mark.parametrize('crop, scale, pyramid_levels', [
+    ((0, 0, 320, 240), 0.5, 0),
+    ((0, 0, 320, 240), 1.0, 2),
+    ((80, 40, 200, 160), 1.0, 0),
+    ((80, 40, 200, 160), 0.5, 1)])
+def test_analysis_contours_map_to_full_frame(crop, scale, pyramid_levels):
+    frames = AnalysisFrames([frame_with_rect()], crop, scale, pyramid_levels)
+    analysis = frames[0]
+    fx, fy = frames.factors()
+    assert analysis.shape[1] == pytest.approx(crop[2]*fx)
+    assert analysis.shape[0] == pytest.approx(crop[3]*fy)
+    mask = cv2.threshold(cv2.cvtColor(analysis, cv2.COLOR_BGR2GRAY), 128, 255,
+                         cv2.THRESH_BINARY)[1]
+    contours = cvu.map_contours(cvu.find_contours(mask), (fx, fy), crop[:2])
+    assert len(contours) == 1
+    # Within one analysis pixel of the rectangle
+    x, y, w, h = cv2.boundingRect(contours[0])
+    assert abs(x - RECT[0]) <= 1/fx and abs(w - RECT[2]) <= 2/fx
+    assert abs(y - RECT[1]) <= 1/fy and abs(h - RECT[3]) <= 2/fy
+    stats = cvu.contour_stats(contours)
+    assert stats.cx[0] == pytest.approx(RECT[0] + RECT[2]/2., abs=1/fx)
+    assert stats.cy[0] == pytest.approx(RECT[1] + RECT[3]/2., abs=1/fy)
+
+def test_processor_reports_full_frame_coordinates():
+    frames = [np.zeros((240, 320, 3), dtype=np.uint8), frame_with_rect()]
+    full = MotionProcessor().process(frame_buf=frames, frame_index=1)[0]
+    reduced = MotionProcessor(scale=0.5, rois=[(60, 40, 200, 150)]).process(
+        frame_buf=frames, frame_index=1)[0]
+    assert len(full) == len(reduced) == 1
+    # Same place as at full resolution.  Erode / dilate work in analysis pixels, so the
+    # region grows more around the rectangle at half scale, but it still covers it.
+    stats = [cvu.contour_stats(contours) for contours in (full, reduced)]
+    assert stats[1].cx[0] == pytest.approx(stats[0].cx[0], abs=2.)
+    assert stats[1].cy[0] == pytest.approx(stats[0].cy[0], abs=2.)
+    x, y, w, h = cv2.boundingRect(reduced[0])
+    assert x <= RECT[0] and y <= RECT[1]
+    assert x + w >= RECT[0] + RECT[2] and y + h >= RECT[1] + RECT[3]
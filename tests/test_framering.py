@@ -0,0 +1,137 @@
+import numpy as np
+
+from cv2utils.framering import FrameRing
+
+def make_ring(size=3):
+    ring = FrameRing(size)
+    ring.allocate((4, 4), np.uint8)
+    return ring
+
+def write(ring, value, timeout=None):
+    buf = ring.begin_write(timeout)
+    if buf is None:
+        return None
+    buf[:] = value
+    return ring.commit()
+
+def test_frames_leave_the_ring_when_overwritten():
+    ring = make_ring(3)
+    for value in range(0, 5):
+        write(ring, value)
+    assert ring.seq == 4
+    assert not ring.valid(0) and not ring.valid(1)
+    assert ring.get(1) is None
+    for seq in (2, 3, 4):
+        assert ring.valid(seq)
+        assert ring.get(seq)[0, 0] == seq
+    assert not ring.get(4).flags.writeable
+
+def test_slot_is_invalid_while_being_written():
+    ring = make_ring(3)
+    for value in range(0, 3):
+        write(ring, value)
+    ring.begin_write()
+    assert not ring.valid(0)
+    assert ring.commit() == 3
+    assert ring.get(3) is not None
+
+def test_window_indexing_and_eviction():
+    ring = make_ring(4)
+    for value in range(0, 4):
+        write(ring, value)
+    window = ring.window(3, 3)
+    assert window[window.frame_index][0, 0] == 3
+    assert window[(window.frame_index-1) % 3][0, 0] == 2
+    assert window[(window.frame_index-2) % 3][0, 0] == 1
+    window.release()
+    # Frames already gone when the window is created read as None
+    write(ring, 4)
+    write(ring, 5)
+    window = ring.window(5, 5)
+    assert window[(window.frame_index-3) % 5][0, 0] == 2
+    assert window[(window.frame_index-4) % 5] is None
+    window.release()
+
+def test_pinned_frames_are_not_overwritten():
+    ring = make_ring(2)
+    write(ring, 0)
+    write(ring, 1)
+    window = ring.window(1, 2)
+    # Slot of frame 0 is pinned: the writer waits instead of overwriting it
+    assert write(ring, 2, timeout=0.05) is None
+    assert ring.n_write_waits == 1
+    assert window[window.frame_index][0, 0] == 1
+    assert window[(window.frame_index-1) % 2][0, 0] == 0
+    window.release()
+    assert ring.n_pinned() == 0
+    assert write(ring, 2, timeout=0.05) == 2
+
+def test_window_unpins_when_garbage_collected():
+    ring = make_ring(2)
+    write(ring, 0)
+    ring.window(0, 1)
+    assert ring.n_pinned() == 0
+    assert ring.pin(0)
+    assert ring.n_pinned() == 1
+    ring.unpin(0)
+    write(ring, 1)
+    write(ring, 2)
+    assert not ring.pin(0)
+
+def test_snapshot_survives_overwrite_without_pinning():
+    ring = make_ring(2)
+    write(ring, 7)
+    snapshot = ring.window(0, 1).snapshot()
+    assert ring.n_pinned() == 0
+    write(ring, 8)
+    write(ring, 9)
+    assert snapshot[0][0, 0] == 7
+    # Drawing falls back to a private copy once the frame has left the ring
+    image = snapshot.writable(0)
+    image[:] = 1
+    assert snapshot[0][0, 0] == 7
+
+def test_writable_is_copy_on_write():
+    ring = make_ring(2)
+    write(ring, 3)
+    image = ring.writable(0)
+    image[:] = 5
+    assert ring.get(0)[0, 0] == 3
+    assert ring.writable(0) is image
+    assert ring.latest_annotated() is image
+
+def test_derived_images_cached_per_ring():
+    import cv2utils.cv2utils as cvu
+    cache = cvu.derived_image_cache()
+    rings = [make_ring(3) for i in range(0, 2)]
+    for ring in rings:
+        write(ring, 7)
+    keys = [ring.window(0, 1).frame_key(0) for ring in rings]
+    assert keys[0] != keys[1]
+    for (ring, key) in zip(rings, keys):
+        cvu.derived_image(ring.get(0), key, ('blur', 3))
+    # A busy ring only evicts its own frames
+    for value in range(0, 20):
+        seq = write(rings[1], value)
+        cvu.derived_image(rings[1].get(seq), rings[1].window(seq, 1).frame_key(0),
+                          ('blur', 3))
+    assert keys[0] in cache._frames[rings[0].id]
+    assert len(cache._frames[rings[1].id]) == 2*rings[1].size
+    # A new ring never reuses a closed ring's keys
+    rings[0].close()
+    assert rings[0].id not in cache._frames
+    assert make_ring(3).id not in [ring.id for ring in rings]
+    rings[1].close()
+
+def test_discard_while_cache_locked_does_not_block():
+    import cv2utils.cv2utils as cvu
+    cache = cvu.DerivedImageCache()
+    frame = np.zeros((4, 4, 3), np.uint8)
+    cache.get(frame, ('a', 1), 'gray')
+    # As when the garbage collector runs a FrameBuffer.__del__ inside a cache call
+    with cache._lock:
+        cache.discard('a')
+    assert 'a' in cache._frames
+    cache.get(frame, ('b', 1), 'gray')
+    assert 'a' not in cache._frames
+    assert 'b' in cache._frames
@@ -0,0 +1,31 @@
+import numpy as np
+
+from cv2utils.framesource import MemorySource
+
+def frames(n):
+    return [np.full((4, 4, 3), i, dtype=np.uint8) for i in range(0, n)]
+
+def read_all(source, n_reads):
+    return [source.read() for i in range(0, n_reads)]
+
+def test_reads_after_end_of_stream_return_false():
+    for prefetch in (0, 2):
+        source = MemorySource(frames(3), prefetch=prefetch).open()
+        results = read_all(source, 6)
+        assert [ret for (ret, frame) in results] == [True]*3 + [False]*3
+        assert [int(frame[0, 0, 0]) for (ret, frame) in results[:3]] == [0, 1, 2]
+        source.release()
+
+def test_read_into_buffer():
+    source = MemorySource(frames(2), prefetch=1).open()
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    ret, frame = source.read(image)
+    ret, frame = source.read(image)
+    assert ret and frame is image and image[0, 0, 0] == 1
+    source.release()
+
+def test_loop_restarts_sequence():
+    source = MemorySource(frames(2), loop=True).open()
+    values = [int(frame[0, 0, 0]) for (ret, frame) in read_all(source, 5)]
+    assert values == [0, 1, 0, 1, 0]
+    source.release()
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+
+from cv2utils.imagewriter import ImageWriter, unique_timestamp_name
+
+def image(value=0):
+    return np.full((16, 16, 3), value, dtype=np.uint8)
+
+def test_burst_names_are_unique_and_ordered():
+    names = [unique_timestamp_name('img_', timestamp=1000.5) for i in range(0, 12)]
+    assert len(set(names)) == len(names)
+    # '_010' sorts after '_002', unlike an unpadded counter
+    assert sorted(names) == names
+    assert names[0].endswith('_000.jpeg')
+    assert unique_timestamp_name('img_', timestamp=1000.6).endswith('_000.jpeg')
+
+def test_quota_rotates_oldest_files(tmp_path):
+    writer = ImageWriter(directory=str(tmp_path), ext='png', n_workers=1, fsync=False,
+                         max_files=3)
+    names = [writer.write(image(i)) for i in range(0, 6)]
+    writer.close()
+    assert sorted(os.listdir(str(tmp_path))) == [os.path.basename(name) for name in names[3:]]
+    assert writer.n_written == 6
+    assert writer.n_rotated == 3
+    assert len(writer._files) == 3
+
+def test_write_failures_are_counted(tmp_path, monkeypatch):
+    import cv2utils.imagewriter
+    opened = list()
+    def recording_open(*args):
+        opened.append(open(*args))
+        return opened[-1]
+    monkeypatch.setattr(cv2utils.imagewriter, 'open', recording_open, raising=False)
+    writer = ImageWriter(directory=str(tmp_path), ext='png', n_workers=1, fsync=False)
+    # open() fails
+    writer._write(os.path.join(str(tmp_path), 'missing', 'a.png'), b'x', 0.)
+    # open() succeeds and flush() fails (ENOSPC): the file is closed, not leaked
+    writer._write('/dev/full', b'x' * 100, 0.)
+    assert len(opened) == 1
+    assert opened[0].closed
+    writer.close()
+    assert writer.n_failed == 2
+    assert writer.n_written == 0
+    assert len(writer._unsynced) == 0
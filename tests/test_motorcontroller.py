@@ -0,0 +1,43 @@
+import numpy as np
+
+from cv2utils.motorcontroller import ConstantVelocityFilter, MotorController
+from cv2utils.subscriber import Subscriber
+from cv2utils.actuator import RecordingChannel
+
+def test_filter_converges_to_constant_velocity():
+    filter = ConstantVelocityFilter(process_noise=0.1, measurement_noise=0.0025)
+    rng = np.random.default_rng(1)
+    velocity = np.array([2., -1.])
+    for i in range(0, 200):
+        t = i * 0.05 + rng.uniform(0., 0.02)
+        filter.update(t, np.array([10., 15.]) + velocity * t + rng.normal(0., 0.05, 2))
+    assert np.allclose(filter.velocity, velocity, atol=0.3)
+    t = filter.t + 0.5
+    assert np.allclose(filter.predict(t), np.array([10., 15.]) + velocity * t, atol=0.3)
+
+def test_filter_holds_still_target():
+    filter = ConstantVelocityFilter()
+    for i in range(0, 30):
+        filter.update(i * 0.1, (12., 18.))
+    assert np.allclose(filter.velocity, 0., atol=1e-6)
+    assert np.allclose(filter.predict(filter.t + 1.), (12., 18.))
+
+def test_filter_ignores_late_measurement_time():
+    filter = ConstantVelocityFilter()
+    filter.update(1., (10., 10.))
+    filter.update(0.5, (10., 10.))
+    assert filter.t == 1.
+
+def test_frame_hook_only_in_closed_loop():
+    channel = RecordingChannel()
+    open_loop = Subscriber(handler=MotorController(channel=channel), log_events=False)
+    assert open_loop._frame_hook is None
+    # Open-loop control doesn't keep frames processed during the detector's cooldown
+    open_loop._event_detector._last_event_time = float("inf")
+    assert not open_loop.detection_ready()
+    closed_loop = Subscriber(handler=MotorController(channel=channel, closed_loop=True),
+                             log_events=False)
+    assert closed_loop._frame_hook is not None
+    assert closed_loop.for_stream('a')._frame_hook is not None
+    assert open_loop.for_stream('a')._frame_hook is None
+    channel.close()
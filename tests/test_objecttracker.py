@@ -0,0 +1,49 @@
+import numpy as np
+
+from cv2utils.objecttracker import ObjectTracker
+
+def square(x, y, size=10):
+    return np.array([(x, y), (x+size, y), (x+size, y+size), (x, y+size)],
+                    dtype=np.int32).reshape(-1, 1, 2)
+
+def test_track_keeps_its_id():
+    tracker = ObjectTracker(max_distance_px=30.)
+    for i in range(0, 10):
+        seen = tracker.update([square(10*i, 20)], timestamp=float(i))
+        assert [track.id for track in seen] == [1]
+        assert seen[0].contour_index == 0
+    track = tracker.tracks[0]
+    assert track.hits == 10 and track.streak == 10 and track.misses == 0
+    assert np.isclose(track.vx, 10., atol=0.1)
+    assert np.isclose(track.vy, 0.)
+
+def test_crossing_tracks_keep_their_ids():
+    # a moves right and b left, passing each other: nearest last position would swap
+    # them at the crossing, the velocity prediction doesn't
+    tracker = ObjectTracker(max_distance_px=40.)
+    for i in range(0, 10):
+        a = square(10*i, 10*i)
+        b = square(95 - 10*i, 10*i)
+        seen = tracker.update([a, b], timestamp=float(i))
+        assert [(track.id, track.contour_index) for track in seen] == [(1, 0), (2, 1)]
+    assert tracker.tracks[0].vx > 0 > tracker.tracks[1].vx
+
+def test_missing_tracks_expire():
+    tracker = ObjectTracker(max_misses=2)
+    tracker.update([square(10, 10)], timestamp=0.)
+    for i in range(1, 3):
+        assert tracker.update([], timestamp=float(i)) == []
+        assert [track.misses for track in tracker.tracks] == [i]
+        assert tracker.tracks[0].streak == 0
+    tracker.update([], timestamp=3.)
+    assert tracker.tracks == []
+    # A new object never reuses an expired id
+    seen = tracker.update([square(10, 10)], timestamp=4.)
+    assert [track.id for track in seen] == [2]
+
+def test_min_area_gates_new_tracks_only():
+    tracker = ObjectTracker(min_area_px=50)
+    assert tracker.update([square(0, 0, 5)], timestamp=0.) == []
+    tracker.update([square(0, 0)], timestamp=1.)
+    seen = tracker.update([square(2, 0, 5)], timestamp=2.)
+    assert [track.id for track in seen] == [1]
@@ -0,0 +1,60 @@
+import pickle
+
+import numpy as np
+
+from cv2utils.profiler import Histogram, Profiler, profiled
+
+# Bucket edges are 10**(1/20) apart: percentiles are upper edges within about 12%
+TOLERANCE = 10.**(1./Histogram.BUCKETS_PER_DECADE)
+
+def test_percentiles_of_uniform_samples():
+    histogram = Histogram()
+    samples = np.linspace(0.001, 0.1, 1000)
+    for seconds in samples:
+        histogram.record(seconds)
+    for q in (50, 95, 99):
+        exact = np.percentile(samples, q)
+        assert exact <= histogram.percentile(q) <= exact*TOLERANCE
+    assert histogram.n == 1000
+    assert np.isclose(histogram.mean_s(), samples.mean())
+    assert histogram.max_s == samples.max()
+
+def test_percentile_never_exceeds_max():
+    histogram = Histogram()
+    for i in range(0, 10):
+        histogram.record(0.0123)
+    assert histogram.percentile(99) == 0.0123
+    assert Histogram().percentile(50) == 0.
+
+def test_out_of_range_samples():
+    histogram = Histogram()
+    histogram.record(0.)
+    histogram.record(1e-9)
+    histogram.record(1000.)
+    assert histogram.counts[0] == 2
+    assert histogram.counts[-1] == 1
+    assert histogram.percentile(100) == 1000.
+
+def test_merge_and_pickle():
+    a = Histogram()
+    b = Histogram()
+    for i in range(0, 90):
+        a.record(0.001)
+    for i in range(0, 10):
+        b.record(0.1)
+    a.merge(b)
+    assert a.n == 100
+    assert a.percentile(50) <= 0.001*TOLERANCE
+    assert a.percentile(95) >= 0.1
+    c = pickle.loads(pickle.dumps(a))
+    assert c.percentile(95) == a.percentile(95)
+
+def test_profiled_records_into_active_profiler():
+    profiler = Profiler('test')
+    with profiled('outside'):
+        pass
+    with profiler.activate():
+        with profiled('inside'):
+            pass
+    assert 'outside' not in profiler.histograms
+    assert profiler.summary()['inside']['count'] == 1
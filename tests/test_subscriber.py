@@ -0,0 +1,92 @@
+import time
+
+import numpy as np
+
+from cv2utils.subscriber import Subscriber
+from cv2utils.tracker import EventDetector
+from cv2utils.frameprocessor import BackgroundModelProcessor
+
+def frame(level, square=False):
+    image = np.full((120, 160, 3), level, dtype=np.uint8)
+    if square:
+        image[40:80, 60:100] = 255
+    return image
+
+def test_background_model_learns_during_cooldown():
+    events = list()
+    subscriber = Subscriber(frame_processor=BackgroundModelProcessor(alpha=0.5),
+                            event_detector=EventDetector(time_between_triggers_s=0.3,
+                                                         min_contour_area_px=100),
+                            handler=lambda c, fb, i: events.append(i), log_events=False)
+    for i in range(0, 5):
+        subscriber.update(frame(100))
+    time.sleep(0.3)
+    subscriber.update(frame(100, square=True))
+    assert len(events) == 1
+    # Lighting drifts slowly while the detector is cooling down
+    for level in range(100, 161, 5):
+        subscriber.update(frame(level))
+    time.sleep(0.35)
+    for i in range(0, 3):
+        subscriber.update(frame(160))
+    assert len(events) == 1
+
+def test_for_stream_copies_handler_state():
+    from cv2utils.motorcontroller import MotorController
+    from cv2utils.actuator import RecordingChannel
+    channel = RecordingChannel()
+    controller = MotorController(closed_loop=True, channel=channel)
+    subscriber = Subscriber(handler=controller, log_events=False)
+    copies = [subscriber.for_stream(name) for name in ('a', 'b')]
+    handlers = [copied._handler for copied in copies]
+    assert handlers[0] is not controller and handlers[0] is not handlers[1]
+    assert handlers[0].filter is not handlers[1].filter
+    assert handlers[0]._lock is not handlers[1]._lock
+    # The frame hook drives the stream's own controller
+    assert copies[0]._frame_hook.__self__ is handlers[0]
+    # A channel passed in is the same hardware, so it stays shared
+    assert handlers[0].channel is channel
+    channel.close()
+
+def test_for_stream_shares_handler_functions():
+    handle = lambda c, fb, i: None
+    subscriber = Subscriber(handler=handle, log_events=False)
+    copied = subscriber.for_stream('a')
+    assert copied._handler.handle is handle
+
+def test_handler_lanes_per_subscriber():
+    from cv2utils.tracker import Tracker
+    tracker = Tracker()
+    assert Subscriber(handler=lambda c, fb, i: None)._handler_executor is None
+    subscribers = [Subscriber(handler=lambda c, fb, i: None, async_handler=True,
+                              log_events=False) for i in range(0, 2)]
+    for subscriber in subscribers:
+        tracker.add_subscriber(subscriber)
+    # Both have the default name but get their own handler lane
+    lanes = [subscriber._handler_executor[1] for subscriber in subscribers]
+    assert lanes[0] is not lanes[1]
+    assert tracker._handler_stats(subscribers[0]) is not None
+    assert len(tracker._handler_lanes) == 2
+    tracker.stop()
+
+def test_activity_during_cooldown_keeps_duty_cycle_active():
+    from cv2utils.dutycycle import DutyCycle
+    subscriber = Subscriber(frame_processor=BackgroundModelProcessor(alpha=0.5),
+                            event_detector=EventDetector(time_between_triggers_s=60.,
+                                                         min_contour_area_px=100),
+                            log_events=False)
+    subscriber._event_detector._last_event_time = 0.
+    for i in range(0, 5):
+        subscriber.update(frame(100))
+    subscriber.update(frame(100, square=True))
+    assert not subscriber.detection_ready()
+    duty_cycle = DutyCycle(idle_after_s=0.2)
+    time.sleep(0.3)
+    # Motion continues while the detector cools down
+    for i in range(0, 3):
+        subscriber.update(frame(100 if i % 2 else 160, square=(i % 2 == 0)))
+    duty_cycle.update([subscriber])
+    assert not duty_cycle.idle
+    time.sleep(0.3)
+    duty_cycle.update([subscriber])
+    assert duty_cycle.idle
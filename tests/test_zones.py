@@ -0,0 +1,55 @@
+import copy
+
+import numpy as np
+import pytest
+
+from cv2utils.zones import ZoneMap
+
+def square(x, y, side):
+    return np.array([[[x, y]], [[x+side, y]], [[x+side, y+side]], [[x, y+side]]],
+                    dtype=np.int32)
+
+SHAPE = (240, 320, 3)
+
+def test_occupancy_of_regions_inside_and_outside():
+    zones = ZoneMap({ 'left' : [(0, 0), (160, 0), (160, 240), (0, 240)],
+                      'right' : [(160, 0), (320, 0), (320, 240), (160, 240)] }, scale=1.)
+    occupancy = zones.occupancy([square(20, 20, 40)], SHAPE)
+    assert occupancy['right'] == 0.
+    assert occupancy['left'] == pytest.approx(41*41, rel=0.05)
+    # A region straddling both zones is split between them
+    occupancy = zones.occupancy([square(140, 100, 40)], SHAPE)
+    assert occupancy['left'] == pytest.approx(occupancy['right'], rel=0.1)
+    assert zones.area['left'] == pytest.approx(160*240, rel=0.02)
+
+def test_overlapping_zones_count_shared_area_in_both():
+    zones = ZoneMap({ 'all' : [(0, 0), (320, 0), (320, 240), (0, 240)],
+                      'corner' : [(0, 0), (100, 0), (100, 100), (0, 100)] })
+    occupancy = zones.occupancy([square(10, 10, 40), square(200, 150, 40)], SHAPE)
+    # Filled at quarter resolution: edges round up to whole mask pixels
+    assert occupancy['all'] == pytest.approx(2*41*41, rel=0.25)
+    assert occupancy['corner'] == pytest.approx(occupancy['all']/2)
+
+def test_empty_regions_and_frame_size_change():
+    zones = ZoneMap({ 'door' : [(0, 0), (100, 0), (100, 100), (0, 100)] })
+    assert zones.occupancy([], SHAPE) == { 'door' : 0. }
+    assert zones.occupancy(None, SHAPE) == { 'door' : 0. }
+    small = zones.occupancy([square(10, 10, 40)], SHAPE)['door']
+    # Zones are in full-frame pixels whatever the frame size
+    assert zones.occupancy([square(10, 10, 40)], (480, 640, 3))['door'] == \
+        pytest.approx(small, rel=0.25)
+    assert zones.area['door'] == pytest.approx(101*101, rel=0.05)
+
+def test_copies_have_their_own_scratch_mask():
+    zones = ZoneMap({ 'door' : [(0, 0), (100, 0), (100, 100), (0, 100)] })
+    zones.occupancy([square(10, 10, 40)], SHAPE)
+    copied = copy.copy(zones)
+    assert copied._foreground is None
+    assert copied.occupancy([square(10, 10, 40)], SHAPE) == \
+        zones.occupancy([square(10, 10, 40)], SHAPE)
+
+def test_invalid_zone_maps():
+    with pytest.raises(ValueError):
+        ZoneMap({})
+    with pytest.raises(ValueError):
+        ZoneMap({ 'door' : [(0, 0), (1, 0), (1, 1)] }, scale=0.)
@@ -2,17 +2,21 @@
 
 #imports
 import cv2
+import copy
 import time
 import numpy as np
-#from picamera.array import PiRGBArray
-#from picamera import PiCamera
 import logging
 import types
-from threading import Thread
+from threading import Thread, Condition, Lock
 
 import cv2utils.cv2utils as cvu
 #from cv2utils.subscriber import Subscriber
 from cv2utils.frameprocessor import FrameProcessor
+from cv2utils.dispatcher import Dispatcher, Lane, DROP_OLDEST
+from cv2utils.stage import ProcessingStage
+from cv2utils.framering import FrameRing, writable_frame
+from cv2utils.profiler import Profiler
+from cv2utils.framesource import UsbSource
 
 log = logging.getLogger(__name__)
 #log = Tracker._get_default_logger()
@@ -28,9 +32,30 @@ class Tracker:
         vflip   : Boolean, indicates whether to vertically flip frames (default=False)
         hflip   : Boolean, indicates whether to horizontally flip frames (default=False)
         heartbeat_frames : Int, number of frames between heartbeat / FPS measurements (default=500)
+        n_workers : Int, size of the subscriber worker pool.  Default=None runs one long-lived
+                    worker thread per subscriber.
+        ring_size : Int, number of preallocated frames in the shared frame ring.  Default=None
+                    sizes the ring from subscriber frame buffer and queue sizes.
+        backend   : optional ProcessBackend.  Runs stateless frame processors in worker
+                    processes reading frames from shared memory.  Default=None processes
+                    frames in threads of this process.
+        skip_stale_frames : Boolean, default=True.  Capture runs freely and processing always
+                    takes the newest frame, skipping (and counting) frames it had no time for.
+                    False makes capture wait for processing so every frame is processed.
+        name      : str, default=None.  Stream name for logs and stats; set by TrackerGroup.
+        priority  : float, default=1.  Share of a worker pool shared with other streams.
+        max_fps   : float, default=None.  Process at most this many frames per second.
+        dispatcher, stage_dispatcher, handler_dispatcher : optional Dispatchers shared with
+                    other trackers (see TrackerGroup).  Each one left at None is created by,
+                    and stopped with, this tracker; shared ones are left running.
+        duty_cycle : optional DutyCycle.  Drops to a low-rate, low-resolution motion probe
+                    while every event detector is quiet.  Default=None always runs at full rate.
     '''
     def __init__(self, usb_dev=0, vflip=False, hflip=False,
-                 heartbeat_frames=500, display_video=False):
+                 heartbeat_frames=500, display_video=False, n_workers=None,
+                 ring_size=None, backend=None, skip_stale_frames=True,
+                 name=None, priority=1, max_fps=None, dispatcher=None,
+                 stage_dispatcher=None, handler_dispatcher=None, duty_cycle=None):
 
         self._fr_count = 0
         self._hb_time = 0
@@ -40,14 +65,62 @@ class Tracker:
         self.hflip = hflip
         self.display_video = display_video
         self.subscribers = list()
+        self._lanes = list()
+        self._stages = list()
+        self.name = name
+        self.priority = priority
+        self.max_fps = max_fps
+        self.duty_cycle = duty_cycle
+        # stop() only stops the dispatchers created here
+        self._owns_dispatcher = dispatcher is None
+        self._owns_stage_dispatcher = stage_dispatcher is None
+        self._owns_handler_dispatcher = handler_dispatcher is None
+        self._dispatcher = dispatcher or Dispatcher(n_workers=n_workers, name='subscriber')
+        # One worker per distinct frame processor
+        self._stage_dispatcher = stage_dispatcher or Dispatcher(name='stage')
+        # One worker per asynchronous handler, so a stuck handler only stalls its own events
+        self._handler_dispatcher = handler_dispatcher or Dispatcher(name='handler')
+        # Handler lanes by id(subscriber): default subscriber names collide
+        self._handler_lanes = dict()
+        self._frame_listeners = list()
+        self.ring_size = ring_size
+        self._ring = None
+        self._cap = None
+        self._backend = backend
+        self.skip_stale_frames = skip_stale_frames
+        self._capture_thread = None
+        self._process_thread = None
+        self._frame_cond = Condition()
+        self._processed_seq = -1
+        self._skipped = 0
+        self._hb_seq = -1
+        self._hb_fr_count = 0
+        self._hb_skipped = 0
+        self._fps = 0.
+        self._next_process_time = 0.
+        # Capture thread stages: camera read and flip
+        self._profiler = Profiler(name or 'tracker')
         self._logger = Tracker._get_default_logger()
         self._prev_frame = None
         print(__name__)
 
-    def _update_subscribers(self, frame):
-        for subscriber in self.subscribers:
-            Thread(target=subscriber.update, args=(frame,)).start()
-            #subscriber.update(frame)
+    def _update_subscribers(self, seq):
+        # Hand the frame sequence number to each processing stage's bounded queue.
+        # Stages fan their results out to subscriber queues, whose overflow policy
+        # decides what happens when a subscriber's worker falls behind.
+        for stage in self._stages:
+            self._stage_dispatcher.submit(stage.lane, seq, self._ring, self._dispatcher)
+
+    # Readers pin the frames they use, so a small ring is never unsafe, but capture
+    # waits when it catches up with a pinned frame.  Room for every frame that can be in
+    # a subscriber's frame buffer or queued / in flight between capture and handler lets
+    # capture run freely.
+    def _default_ring_size(self):
+        frame_buf_size = max([2] + [stage.frame_buf_size for stage in self._stages])
+        stage_queue = max([2] + [stage.lane.maxsize + stage.max_in_flight
+                                 for stage in self._stages])
+        subscriber_queue = max([1] + [lane.maxsize for lane in self._lanes])
+        return frame_buf_size + stage_queue + (subscriber_queue+1) + 1
 
     def get_logger():
         log = logging.getLogger(__name__)
@@ -57,25 +130,88 @@ class Tracker:
         log = Tracker.get_logger()
         if ( self._fr_count % self._heartbeat_frames ) == 0:
             now = time.time()
-            fps = self._heartbeat_frames / (now-self._hb_time);
+            # Rates over frames actually seen since the previous heartbeat
+            fps = (self._fr_count-self._hb_fr_count) / (now-self._hb_time)
+            capture_fps = (self._ring.seq-self._hb_seq) / (now-self._hb_time)
+            self._fps = fps
             self._hb_time = now
-            log.info("[heartbeat] fr=" + str(self._fr_count) +
-                  " fps=" + str(np.round(fps,2)))
+            self._hb_fr_count = self._fr_count
+            self._hb_seq = self._ring.seq
+            skipped = self._skipped - self._hb_skipped
+            self._hb_skipped = self._skipped
+            lanes = "".join([" " + str(stage.lane) for stage in self._stages])
+            lanes += "".join([" " + str(lane) + " lat=" +
+                              str(subscriber.profiler.histogram('latency'))
+                              for (subscriber, lane) in zip(self.subscribers, self._lanes)])
+            lanes += "".join([" " + str(lane) for lane in self._handler_lanes.values()])
+            log.info("[heartbeat]" + ("[" + self.name + "]" if self.name else "") +
+                  " fr=" + str(self._fr_count) +
+                  " fps=" + str(np.round(fps,2)) +
+                  " capture_fps=" + str(np.round(capture_fps,2)) +
+                  " skipped=" + str(skipped) + lanes)
+            if self.duty_cycle is not None:
+                log.info("[heartbeat]" + ("[" + self.name + "]" if self.name else "") +
+                         "[duty_cycle] " + str(self.duty_cycle))
+            # Per-stage p50/p95/p99
+            for profiler in ([self._profiler] + [stage.profiler for stage in self._stages] +
+                             [subscriber.profiler for subscriber in self.subscribers]):
+                log.info("[heartbeat][" + profiler.name + "] " + str(profiler))
+            for subscriber in self.subscribers:
+                overdue = subscriber.handler_overdue()
+                if overdue > 0:
+                    log.warning("[heartbeat][" + subscriber.name + "] handler running " +
+                                str(np.round(overdue,2)) + "s past its timeout")
 
-    def _process_frame(self, frame):
+    '''
+        stats(self)
+
+        Description:
+          Returns a dict of pipeline statistics: frame counts and rates, and for the capture
+          thread, each processing stage and each subscriber the queue counters and the
+          per-stage latency histogram summaries (count, mean, p50, p95, p99, max in ms).
+    '''
+    def stats(self):
+        captured = 0 if self._ring is None else self._ring.seq+1
+        return { 'frames' : self._fr_count,
+                 'captured' : captured,
+                 'skipped' : self._skipped,
+                 'fps' : self._fps,
+                 'capture' : self._profiler.summary(),
+                 'stages' : { stage.name : { 'queue' : stage.lane.stats(),
+                                             'profile' : stage.profiler.summary() }
+                              for stage in self._stages },
+                 'subscribers' : { subscriber.name : { 'queue' : lane.stats(),
+                                                       'handler' : self._handler_stats(subscriber),
+                                                       'profile' : subscriber.profiler.summary() }
+                                   for (subscriber, lane) in zip(self.subscribers, self._lanes) },
+                 'duty_cycle' : None if self.duty_cycle is None else self.duty_cycle.stats() }
+
+    # Handler queue counters ('dropped' are coalesced events) and timeouts
+    def _handler_stats(self, subscriber):
+        lane = self._handler_lanes.get(id(subscriber))
+        stats = dict() if lane is None else lane.stats()
+        stats['timeouts'] = subscriber.n_handler_timeouts
+        return stats
+
+    # Flip in place so the frame stays in its ring buffer
+    def _flip(self, frame):
         if (self.vflip and self.hflip):
-            frame = cv2.flip(frame,-1)
+            cv2.flip(frame, -1, dst=frame)
         elif (self.vflip):
-            frame = cv2.flip(frame,0)
+            cv2.flip(frame, 0, dst=frame)
         elif (self.hflip):
-            frame = cv2.flip(frame,1)
+            cv2.flip(frame, 1, dst=frame)
+
+    def _process_frame(self, seq):
         self._fr_count += 1
-        self._update_subscribers(frame)
+        self._update_subscribers(seq)
+        for listener in self._frame_listeners:
+            listener(seq, self._ring.get(seq))
         self._heartbeat()
 
         if self.display_video:
-            time.sleep(0.05) # sufficient time for subscriber updates???
-            cv2.imshow('Tracker', frame)
+            # Show annotations drawn by handlers on their copy-on-write frames
+            cv2.imshow(self.name or 'Tracker', self._ring.latest_annotated())
             cv2.waitKey(1)
 
     '''
@@ -87,61 +223,288 @@ class Tracker:
           none
     '''
     def run_usb(self):
+        self.run(UsbSource(self.usb_dev))
+
+    '''
+        run - starts processing of video frames from a frame source
+        Arguments:
+          source : FrameSource (UsbSource, VideoFileSource, ImageDirectorySource,
+                   StreamSource, MemorySource, PiCameraSource, ...).  Opened here if it
+                   hasn't been already, and released by stop().  Sources that are not
+                   live (files, directories, memory) end the capture when exhausted; use
+                   wait() to block until every frame has been processed.
+
+        Returns:
+          none
+    '''
+    def run(self, source):
+        log = Tracker.get_logger()
+        log.info("Started tracking on " + source.name)
+        if not source.opened:
+            source.open()
+        self.run_capture(source, stop_at_end=not source.live)
+
+    '''
+        run_capture - starts processing of video frames from a capture object
+        Arguments:
+          cap         : object with a cv2.VideoCapture-style read(image=None) -> (ret, frame)
+                        method, e.g. a VideoCapture opened on a file
+          stop_at_end : Boolean, default=False.  If True, a failed read is treated as the end
+                        of the stream: capture stops and wait() returns once every captured
+                        frame has been processed.  If False, failed reads are retried.
+
+        Returns:
+          none
+    '''
+    def run_capture(self, cap, stop_at_end=False):
         log = Tracker.get_logger()
-        log.info("Started tracking on video" + str(self.usb_dev))
         # Initialize with one frame
-        self._cap = cv2.VideoCapture(self.usb_dev)
-        self._hb_time = time.time()
+        self._cap = cap
+        self._stop_at_end = stop_at_end
+        self._end_of_stream = False
         self._stopped = False
         self._grabbed = False
         ret, frame = self._cap.read()
+        if not ret:
+            raise IOError("Could not read a first frame from the capture source.")
         log.info("Resolution = " + str(frame.shape))
+        self._ring = FrameRing(self.ring_size or self._default_ring_size())
+        self._ring.allocate(frame.shape, frame.dtype,
+                            shared=(self._backend is not None))
+        log.info("Frame ring = " + str(self._ring.size) + " frames")
+        if self._backend is not None:
+            self._backend.start(self._ring)
+        buf = self._ring.begin_write()
+        np.copyto(buf, frame)
+        self._flip(buf)
+        self._ring.commit()
+        self._hb_time = time.time()
 
         #while(True):
         #    ret, frame = self._cap.read()
         #    self._process_frame(frame)
-        Thread(target=self._capture, args=()).start()
+        self._capture_thread = Thread(target=self._capture, args=())
+        self._process_thread = Thread(target=self._process_frames, args=())
+        self._capture_thread.start()
+        self._process_thread.start()
         return
 
+    # Capture thread: only grabs frames into the ring and publishes the newest one,
+    # so a slow pipeline never backs up into the camera driver's buffer.
     def _capture(self):
         while(True):
             if (self._stopped):
                 return
-            self._grabbed, frame = self._cap.read()
-            self._process_frame(frame)
+            if self.duty_cycle is not None and self.duty_cycle.idle:
+                # Idle: only capture frames for the probe
+                delay = self.duty_cycle.next_probe_time - time.time()
+                if delay > 0:
+                    time.sleep(min(delay, 0.1))
+                    continue
+            if not self.skip_stale_frames:
+                with self._frame_cond:
+                    while self._ring.seq > self._processed_seq and not self._stopped:
+                        self._frame_cond.wait(0.1)
+            # Read straight into the next ring slot; no per-frame allocation.  Waits
+            # while a reader still has the slot's frame pinned.
+            buf = self._ring.begin_write(timeout=0.1)
+            if buf is None:
+                continue
+            with self._profiler.stage('read'):
+                self._grabbed, frame = self._cap.read(image=buf)
+            if not self._grabbed:
+                if self._stop_at_end:
+                    with self._frame_cond:
+                        self._end_of_stream = True
+                        self._frame_cond.notify_all()
+                    return
+                continue
+            if frame is not buf:
+                np.copyto(buf, frame)
+            with self._profiler.stage('flip'):
+                self._flip(buf)
+            with self._frame_cond:
+                self._ring.commit()
+                self._frame_cond.notify_all()
+
+    # Processing thread: always takes the latest published frame and counts the
+    # frames captured since the last one as skipped.
+    def _process_frames(self):
+        while(True):
+            idle = self.duty_cycle is not None and self.duty_cycle.idle
+            if idle:
+                delay = self.duty_cycle.next_probe_time - time.time()
+                if delay > 0:
+                    if self._stopped:
+                        return
+                    time.sleep(min(delay, 0.1))
+                    continue
+            elif self.max_fps is not None:
+                # Frames captured while waiting for the next slot are skipped
+                now = time.time()
+                if now < self._next_process_time:
+                    time.sleep(self._next_process_time-now)
+                self._next_process_time = max(self._next_process_time, now) + 1./self.max_fps
+            with self._frame_cond:
+                while (self._ring.seq == self._processed_seq and not self._stopped
+                       and not self._end_of_stream):
+                    self._frame_cond.wait(0.1)
+                if (self._stopped):
+                    return
+                if self._ring.seq == self._processed_seq:
+                    # End of stream, every frame taken
+                    return
+                seq = self._ring.seq
+                if self._processed_seq >= 0:
+                    self._skipped += seq - self._processed_seq - 1
+                self._processed_seq = seq
+                self._frame_cond.notify_all()
+            # Keep the frame in place while the probe and frame listeners read it
+            if not self._ring.pin(seq):
+                continue
+            try:
+                if idle:
+                    if not self.duty_cycle.probe(self._ring.get(seq)):
+                        continue
+                    log.info("Activity" + (" on " + self.name if self.name else "") +
+                             ", back to full rate")
+                self._process_frame(seq)
+            finally:
+                self._ring.unpin(seq)
+            if self.duty_cycle is not None and not self.duty_cycle.idle:
+                self.duty_cycle.update(self.subscribers)
+                if self.duty_cycle.idle:
+                    log.info("Scene idle" + (" on " + self.name if self.name else "") +
+                             ", probing at " + str(self.duty_cycle.probe_fps) + " fps")
+
+    '''
+        wait(self, timeout=None)
+
+        Description:
+          For a capture started with stop_at_end=True, blocks until the stream has ended
+          and every queued frame has gone through processing and subscriber handlers.
+          Returns False if the timeout (seconds) expired first.
+    '''
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        remaining = lambda: None if deadline is None else max(0., deadline-time.time())
+        for thread in [self._capture_thread, self._process_thread]:
+            thread.join(remaining())
+            if thread.is_alive():
+                return False
+        # Stages may still be filling subscriber queues; drain until everything is idle
+        while True:
+            if not self._stage_dispatcher.wait_idle(remaining()):
+                return False
+            for stage in self._stages:
+                if not stage.wait_pending(remaining()):
+                    return False
+            if not self._dispatcher.wait_idle(remaining()):
+                return False
+            if not self._handler_dispatcher.wait_idle(remaining()):
+                return False
+            if (self._stage_dispatcher.idle() and self._dispatcher.idle() and
+                self._handler_dispatcher.idle() and
+                all([stage.n_pending() == 0 for stage in self._stages])):
+                return True
 
     def stop(self):
-        # Stop the capture thread
+        # Stop the capture / processing threads and subscriber workers
+        self.stop_capture()
+        if self._owns_stage_dispatcher:
+            self._stage_dispatcher.stop()
+        if self._backend is not None:
+            self._backend.stop()
+        if self._owns_dispatcher:
+            self._dispatcher.stop()
+        if self._owns_handler_dispatcher:
+            self._handler_dispatcher.stop()
+        if hasattr(self._cap, 'release'):
+            self._cap.release()
+        if self._ring is not None:
+            self._ring.close()
+
+    '''
+        stop_capture(self)
+
+        Description:
+          Stops the capture and processing threads only: no new frames are handed to
+          the subscribers, while the worker pools keep running and the frame ring stays
+          allocated.  Used to stop several trackers sharing pools (TrackerGroup) before
+          the pools themselves; stop() does the full shutdown.
+    '''
+    def stop_capture(self):
         self._stopped = True
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+        for thread in [self._capture_thread, self._process_thread]:
+            if thread is not None:
+                thread.join(1.0)
 
-#    This works on raspberry pi, but not on Ubuntu because of dependencies
-#    on pi camera object.  Need to figure out how to fix this, or put a derived
-#    class in another package module so everything works on non-pi platforms.
-#    def run(self):
-#        log = Tracker.get_logger()
-#        log.info("Started tracking on RaspiCam")
-#        # Initialize with one frame
-#        self._hb_time = time.time()
-#        rawCapture = PiRGBArray(self._camera, size=self.res)
-#        self._camera.capture(rawCapture, format="bgr")
-#        log.info("Resolution = " + str(rawCapture.array.shape))
-#
-#        for frame in self._camera.capture_continuous(rawCapture, format="bgr", use_video_port=True):
-#            self._process_frame(frame)
-#            rawCapture.truncate(0)
+    '''
+        add_frame_listener(self, listener)
+
+        Description:
+          Calls listener(seq, frame) on the processing thread for every frame handed to
+          the subscribers, with a read-only view of the ring frame.  Listeners must be
+          quick and copy the frame if they keep it.
+    '''
+    def add_frame_listener(self, listener):
+        self._frame_listeners.append(listener)
 
     '''
         add_subscriber(self, subscriber)
 
         Description:
           Adds a subscriber object to the listener queue.  Each subscriber will receive frame
-          updates for processing once the camera is running.
+          updates for processing once the camera is running.  Subscribers sharing a frame
+          processor (or an equivalently configured one) share a single ProcessingStage,
+          so the processor runs once per frame for all of them.
     '''
     def add_subscriber(self, subscriber):
         log = Tracker.get_logger()
         # Should add ID to events for logging clarity...
         log.info("Added subscriber [" + subscriber.name + "]")
         self.subscribers.append(subscriber)
+        lane = Lane(subscriber.process_result, name=subscriber.name,
+                    maxsize=subscriber.queue_size,
+                    overflow_policy=subscriber.overflow_policy,
+                    group=self.name, priority=self.priority)
+        self._lanes.append(self._dispatcher.add_lane(lane))
+        if subscriber.async_handler and subscriber._handler is not None:
+            # Latest-wins: an event arriving while the handler is busy replaces the queued one
+            handler_lane = Lane(subscriber.run_handler, name=subscriber.name + ':handler',
+                                maxsize=1, overflow_policy=DROP_OLDEST,
+                                group=self.name, priority=self.priority)
+            self._handler_dispatcher.add_lane(handler_lane)
+            self._handler_lanes[id(subscriber)] = handler_lane
+            subscriber._handler_executor = (self._handler_dispatcher, handler_lane)
+
+        processor = subscriber.frame_processor
+        key = processor.config_key()
+        stage = None
+        for existing in self._stages:
+            if existing._frame_processor is processor or existing.key == key:
+                stage = existing
+                break
+        if stage is None:
+            stage = ProcessingStage(processor,
+                                    name=(self.name + '/' if self.name else '') + 'stage:' +
+                                         type(processor).__name__ + str(len(self._stages)),
+                                    backend=self._backend)
+            stage.lane.group = self.name
+            stage.lane.priority = self.priority
+            stage.track_activity = self.duty_cycle is not None
+            self._stages.append(stage)
+            self._stage_dispatcher.add_lane(stage.lane)
+        stage.add_subscriber(subscriber, lane)
+        log.info("Subscriber [" + subscriber.name + "] uses " + stage.name)
+        # The ring is sized when capture starts
+        if (self._ring is not None and self.ring_size is None and
+            self._default_ring_size() > self._ring.size):
+            log.warning("Frame ring of " + str(self._ring.size) + " frames is smaller than the " +
+                        str(self._default_ring_size()) + " subscriber [" + subscriber.name +
+                        "] needs; capture may wait for pinned frames")
 
     @staticmethod
     def _get_default_logger():
@@ -181,17 +544,17 @@ def default_handler(contours, images, state=None):
     log.debug("Largest centroid: " + str(cvu.centroid(contour)) + ", A=" + str(area))
 
 
+#  Draws on a copy-on-write copy of the frame, which the tracker display shows.
 def highlight_contours(contours, frame_buf, frame_index, color=(25, 128, 255)):
-    tmp = np.array(frame_buf[frame_index].shape) / 2
+    image = writable_frame(frame_buf, frame_index)
+    if image is None:
+        return
+    tmp = np.array(image.shape) / 2
     imcenter = (int(tmp[1]), int(tmp[0]))
-    buf_len = len(frame_buf)
-    image = frame_buf[frame_index%buf_len]
-    contour, area = cvu.largest_contour(contours)
-    #centroid = cvu.centroid(contour)
-    centroid = cvu.avg_contour_centroid(contours)
+    centroid = cvu.contour_stats(contours).avg_centroid()
     # log.debug("c = " + str(centroid))
     # Place the detected contours on the images
-    cv2.drawContours(image, contours, -1,
+    cv2.drawContours(image, cvu.as_contours(contours), -1,
                      color=color, thickness=1)
     cvu.draw_x(image,centroid,length=9)
     cvu.draw_x(image,imcenter, length=3,
@@ -202,6 +565,7 @@ def highlight_contours(contours, frame_buf, frame_index, color=(25, 128, 255)):
 #  Print detection message and save image showing detected motion contours
 def save_image_handler(contours, frame_buf, frame_index):
     highlight_contours(contours, frame_buf, frame_index)
+    image = writable_frame(frame_buf, frame_index)
 
     filename = cvu.imwrite_timestamp(image, "event_")
     log.info('Wrote ' + filename)
@@ -210,7 +574,7 @@ def save_image_handler(contours, frame_buf, frame_index):
 def show_image_handler(contours, frame_buf, frame_index):
     log.debug('[show_image_handler]')
     highlight_contours(contours, frame_buf, frame_index)
-    image = frame_buf[frame_index%len(frame_buf)]
+    image = writable_frame(frame_buf, frame_index)
     # log.info('Displaying image...')
     cv2.imshow('Show Image Handler', image)
     if cv2.waitKey(1) == 10:
@@ -228,12 +592,23 @@ def do_nothing_handler(contours, frame_buf, frame_index):
 # Area in largest detection contour < max_contour_area_px
 # Time (s) since last triggered event > time_between_triggers_s
 # Number of sequential frames meeting above criteria >= min_sequential_frames
+#
+# With zone occupancy (Subscriber(zones=...)), optionally also:
+#
+# Detected area in each of require_zones >= min_zone_area_px
+# Detected area in each of exclude_zones < min_zone_area_px
+#
+# e.g. require_zones=['door'], exclude_zones=['tree'] for motion in the doorway but
+# not in the tree.  Zones missing from the occupancy count as empty.
+#
+# contours may be a contour list or a cvu.BlobSet; only their stats are used.
 class EventDetector:
 
     def __init__(self, time_between_triggers_s=1.0,
                  min_sequential_frames=1,
                  min_contour_area_px=500, max_contour_area_px=50000,
-                 state=None):
+                 state=None, require_zones=None, exclude_zones=None,
+                 min_zone_area_px=100):
         self._last_event_time = time.time()
         self._trigger_count = 0
         self.time_between_triggers_s = time_between_triggers_s
@@ -241,6 +616,14 @@ class EventDetector:
         self.max_contour_area_px = max_contour_area_px
         self.min_sequential_frames = min_sequential_frames
         self._state = state
+        self._track = None
+        self.require_zones = list() if require_zones is None else list(require_zones)
+        self.exclude_zones = list() if exclude_zones is None else list(exclude_zones)
+        self.min_zone_area_px = min_zone_area_px
+        # Zone occupancy of the last frame, if the subscriber has zones
+        self.zones = None
+        # Last time contours met the detection criteria (see DutyCycle)
+        self.last_activity_time = time.time()
 
     def detection_ready(self):
         now = time.time()
@@ -250,14 +633,31 @@ class EventDetector:
         else:
             return True
 
-    # Apply detection criteria and invoke handler if satisfied
-    def detect(self, contours):
+    # Apply detection criteria and invoke handler if satisfied.
+    #
+    # With tracks (from an ObjectTracker) the sequential frame count is that of a single
+    # object: the longest current streak among tracks meeting the area criteria.  An
+    # object that stays in view fires again once time_between_triggers_s has passed.
+    #
+    # zones is the frame's zone occupancy (name : detected area in pixels), checked
+    # against require_zones / exclude_zones.
+    def detect(self, contours, tracks=None, zones=None):
         if (contours is None): return False
-        if len(contours) > 0 and self._meets_area_criteria(contours):
+        self._track = None
+        self.zones = zones
+        if not self._meets_zone_criteria(zones):
+            self._trigger_count = 0
+            return False
+        if tracks is not None:
+            if not self._meets_track_criteria(tracks):
+                self._trigger_count = 0
+                return False
+        elif len(contours) > 0 and self._meets_area_criteria(contours):
             self._trigger_count +=1
         else:
             self._trigger_count = 0
             return False
+        self.last_activity_time = time.time()
         if (self.detection_ready() is False):
             return False
         if self._trigger_count >= self.min_sequential_frames :
@@ -266,31 +666,83 @@ class EventDetector:
             self.event_metadata = EventMetadata(max_contour_area=self._largest_contour_area,
                                                 n_seq_frames=self._trigger_count,
                                                 time_between_triggers_s=delta_t,
-                                                n_contours=len(contours))
+                                                n_contours=len(contours),
+                                                track=copy.copy(self._track),
+                                                zones=None if zones is None else dict(zones))
             self._trigger_count = 0
             self._last_event_time = now
             return True
 
+    def _meets_zone_criteria(self, zones):
+        if len(self.require_zones) == 0 and len(self.exclude_zones) == 0:
+            return True
+        if zones is None:
+            zones = dict()
+        for name in self.require_zones:
+            if zones.get(name, 0) < self.min_zone_area_px:
+                return False
+        for name in self.exclude_zones:
+            if zones.get(name, 0) >= self.min_zone_area_px:
+                return False
+        return True
+
+    def _meets_track_criteria(self, tracks):
+        candidates = [track for track in tracks
+                      if track.area > self.min_contour_area_px and
+                         track.area < self.max_contour_area_px]
+        if len(candidates) == 0:
+            return False
+        self._track = max(candidates, key=lambda track: (track.streak, track.area))
+        self._trigger_count = self._track.streak
+        self._largest_contour_area = self._track.area
+        return True
+
     def _meets_area_criteria(self, contours):
-        contour, area = cvu.largest_contour(contours)
-        self._largest_contour = contour
-        self._largest_contour_area = area
+        # Shared with handlers through the contour_stats cache
+        stats = cvu.contour_stats(contours)
+        index = stats.largest()
+        self._largest_index = index
+        self._contours = contours
+        self._largest_contour_area = stats.area[index] if index >= 0 else 0
+        area = self._largest_contour_area
         if area > self.min_contour_area_px and area < self.max_contour_area_px:
             return True
         return False
 
+    # Largest contour of the last frame (traced on demand for a BlobSet)
+    @property
+    def _largest_contour(self):
+        return self._contours[self._largest_index] if self._largest_index >= 0 else None
+
 class EventMetadata():
 
     def __init__(self, max_contour_area, n_seq_frames,
-                 time_between_triggers_s=0, n_contours=-1):
+                 time_between_triggers_s=0, n_contours=-1, track=None, zones=None):
         self.max_contour_area = max_contour_area
         self.n_seq_frames = n_seq_frames
         self.time_between_triggers_s = time_between_triggers_s
         self.n_contours = n_contours
+        # Tracked object that triggered the event, if tracking is enabled
+        self.track = track
+        self.track_id = None if track is None else track.id
+        # Rule that fired, for DetectorBank events
+        self.rule_id = None
+        # Zone occupancy (name : detected area in pixels), if the subscriber has zones
+        self.zones = zones
 
     def __str__(self):
-        text = ("MaxArea = " + str(np.round(self.max_contour_area)) +
+        text = ("Rule " + str(self.rule_id) + ": " if self.rule_id is not None else "")
+        text += ("MaxArea = " + str(np.round(self.max_contour_area)) +
                 ", nFrames = " + str(self.n_seq_frames) +
                 ", dT = " + str(np.round(self.time_between_triggers_s,3)) +
                 ", nContours = " + str(self.n_contours) )
+        if self.track is not None:
+            text += ", " + str(self.track)
+        if self.zones is not None:
+            text += ", zones = " + str({ name : int(area) for (name, area)
+                                          in self.zones.items() })
         return text
+
+    def __repr__(self):
+        return "EventMetadata(" + str(self) + ")"
+
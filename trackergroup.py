@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+#imports
+import os
+import time
+import logging
+from collections import OrderedDict
+
+from cv2utils.tracker import Tracker
+from cv2utils.dispatcher import Dispatcher
+
+'''
+    class TrackerGroup
+
+    Description:
+      Runs several video streams (one Tracker per FrameSource, each with its own capture
+      thread and frame ring) on one bounded pool of processing and subscriber workers.
+      Each stream is a fair-share group on the pool, weighted by its priority, so a busy
+      or high-resolution camera cannot starve the others, and the number of threads is
+      fixed however many streams and subscribers there are.
+
+      n_workers       : int, subscriber event detection pool size.
+                        Default=None uses os.cpu_count().  Asynchronous handlers get one
+                        worker each, since they mostly wait on I/O.
+      n_stage_workers : int, frame processing pool size.  Default=None uses os.cpu_count().
+
+    Example:
+      group = TrackerGroup(n_workers=4)
+      group.add_stream(UsbSource(0), name='door', priority=2)
+      group.add_stream(StreamSource('rtsp://...'), name='yard', max_fps=5)
+      group.add_subscriber(Subscriber(handler=save_image_handler, name='motion'))
+      group.run()
+'''
+class TrackerGroup:
+
+    def __init__(self, n_workers=None, n_stage_workers=None, heartbeat_frames=500,
+                 display_video=False):
+        n_cpus = os.cpu_count() or 1
+        self.heartbeat_frames = heartbeat_frames
+        self.display_video = display_video
+        self.streams = OrderedDict()
+        self._sources = dict()
+        self._dispatcher = Dispatcher(n_workers=n_workers or n_cpus, name='subscriber')
+        self._stage_dispatcher = Dispatcher(n_workers=n_stage_workers or n_cpus,
+                                            name='stage')
+        self._handler_dispatcher = Dispatcher(name='handler')
+
+    '''
+        add_stream(self, source, name=None, priority=1, max_fps=None, **kwargs)
+
+        Description:
+          Adds a video stream and returns its Tracker.
+
+        Arguments:
+          source   : FrameSource for the stream
+          name     : str, stream name for logs and stats.  Default=None uses source.name.
+          priority : float, default=1.  Relative share of the worker pools.
+          max_fps  : float, default=None.  Process at most this many frames per second.
+          kwargs   : other Tracker arguments (vflip, hflip, ring_size, backend,
+                     skip_stale_frames, ...)
+    '''
+    def add_stream(self, source, name=None, priority=1, max_fps=None, **kwargs):
+        name = name or source.name
+        if name in self.streams:
+            raise ValueError("Duplicate stream name '" + name + "'")
+        tracker = Tracker(heartbeat_frames=self.heartbeat_frames,
+                          display_video=self.display_video, name=name,
+                          priority=priority, max_fps=max_fps,
+                          dispatcher=self._dispatcher,
+                          stage_dispatcher=self._stage_dispatcher,
+                          handler_dispatcher=self._handler_dispatcher, **kwargs)
+        self.streams[name] = tracker
+        self._sources[name] = source
+        return tracker
+
+    '''
+        add_subscriber(self, subscriber, streams=None)
+
+        Description:
+          Attaches a subscriber to one stream (streams='name'), a list of streams, or
+          every stream added so far (streams=None).  With more than one stream, each gets
+          its own copy of the subscriber (see Subscriber.for_stream) so detection state is
+          kept per stream.  Returns the list of subscribers added.
+    '''
+    def add_subscriber(self, subscriber, streams=None):
+        if streams is None:
+            streams = list(self.streams.keys())
+        elif isinstance(streams, str):
+            streams = [streams]
+        added = list()
+        for name in streams:
+            stream_subscriber = subscriber if len(streams) == 1 else subscriber.for_stream(name)
+            self.streams[name].add_subscriber(stream_subscriber)
+            added.append(stream_subscriber)
+        return added
+
+    def run(self):
+        log = Tracker.get_logger()
+        log.info("Started tracking on " + str(len(self.streams)) + " streams")
+        for (name, tracker) in self.streams.items():
+            tracker.run(self._sources[name])
+
+    '''
+        wait(self, timeout=None)
+
+        Description:
+          Blocks until every stream has ended (see Tracker.wait).  Returns False if the
+          timeout (seconds) expired first.
+    '''
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        for tracker in self.streams.values():
+            remaining = None if deadline is None else max(0., deadline-time.time())
+            if not tracker.wait(remaining):
+                return False
+        return True
+
+    def stop(self):
+        # Stop capture everywhere before the shared pools, and the pools before any
+        # frame ring is released
+        for tracker in self.streams.values():
+            tracker.stop_capture()
+        self._stage_dispatcher.stop()
+        self._dispatcher.stop()
+        self._handler_dispatcher.stop()
+        for tracker in self.streams.values():
+            tracker.stop()
+
+    '''
+        stats(self)
+
+        Description:
+          Returns Tracker.stats() for every stream, keyed by stream name, plus the pool
+          sizes.
+    '''
+    def stats(self):
+        return { 'streams' : { name : tracker.stats()
+                               for (name, tracker) in self.streams.items() },
+                 'workers' : { 'stage' : self._stage_dispatcher.n_workers,
+                               'subscriber' : self._dispatcher.n_workers } }
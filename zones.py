@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+#imports
+import cv2
+import numpy as np
+
+import cv2utils.cv2utils as cvu
+from cv2utils.profiler import profiled
+
+'''
+    class ZoneMap
+
+    Description:
+      Named polygon zones of a Subscriber (Subscriber(zones=...)) and their per-frame
+      occupancy: the area of detected regions inside each zone.  Zones are rasterized
+      once into a label mask (again only if the frame size changes); each frame the
+      detection regions are rendered into a single foreground mask and one
+      np.bincount of the zone labels under it gives every zone's pixel count, with no
+      per-zone contour pass.
+
+      Zones may overlap: each label stands for one combination of zones, and label
+      counts are summed into the zones they belong to.  Regions from a BlobSet are
+      counted straight from its label image at analysis resolution; contour lists are
+      filled into a mask of the frame downscaled by scale.
+
+      Occupancy is in full-frame pixels, comparable with contour areas.
+
+      zones : dict of name : polygon, polygons as lists of (x, y) full-frame pixels
+      scale : float, default=0.25.  Mask resolution for contour lists.
+
+    Example:
+      zones = ZoneMap({ 'door' : [(400, 80), (520, 80), (520, 400), (400, 400)],
+                        'tree' : [(0, 0), (200, 0), (200, 240), (0, 240)] })
+      occupancy = zones.occupancy(contours, frame.shape)   # { 'door' : 1830., ... }
+'''
+class ZoneMap():
+
+    def __init__(self, zones, scale=0.25):
+        if len(zones) == 0:
+            raise ValueError("ZoneMap requires at least one zone.")
+        if len(zones) > 64:
+            raise ValueError("ZoneMap supports at most 64 zones.")
+        if scale <= 0 or scale > 1:
+            raise ValueError("Zone mask scale must be in (0, 1].")
+        self.names = list(zones.keys())
+        self.polygons = [np.array(zones[name], dtype=np.float64).reshape(-1, 2)
+                         for name in self.names]
+        self.scale = scale
+        # Label masks by (shape, scale, shift): (labels, membership)
+        self._masks = dict()
+        self._foreground = None
+        # Zone areas in full-frame pixels, known once a frame size is seen
+        self.area = None
+        self._frame_shape = None
+
+    def __len__(self):
+        return len(self.names)
+
+    '''
+        _label_mask(self, shape, scale=(1., 1.), shift=(0., 0.))
+
+        Description:
+          Zone label mask of the given shape, for a mask whose pixel p lies at
+          p*scale + shift in the frame.  Returns (labels, membership): labels is a
+          uint8 (or uint16) image of zone combination ids, 0 outside every zone, and
+          membership a (n_labels, n_zones) matrix of the zones in each combination.
+    '''
+    def _label_mask(self, shape, scale=(1., 1.), shift=(0., 0.)):
+        key = (tuple(shape), tuple(scale), tuple(shift))
+        mask = self._masks.get(key)
+        if mask is not None:
+            return mask
+        # One bit per zone, then compact the bit patterns present into labels
+        bits = np.zeros(shape, dtype=np.uint64)
+        zone = np.empty(shape, dtype=np.uint8)
+        for (i, polygon) in enumerate(self.polygons):
+            zone[:] = 0
+            points = (polygon - np.array(shift)) / np.array(scale)
+            cv2.fillPoly(zone, [np.round(points).astype(np.int32)], 1)
+            bits |= zone.astype(np.uint64) << np.uint64(i)
+        codes, labels = np.unique(bits, return_inverse=True)
+        if codes[0] != 0:
+            # Every pixel is in some zone: keep label 0 for "no zone"
+            codes = np.concatenate(([0], codes)).astype(np.uint64)
+            labels = labels + 1
+        dtype = np.uint8 if len(codes) <= 256 else np.uint16
+        labels = labels.reshape(shape).astype(dtype)
+        membership = ((codes[:,None] >> np.arange(len(self), dtype=np.uint64)[None,:]) &
+                      np.uint64(1)).astype(np.float64)
+        mask = (labels, membership)
+        if len(self._masks) >= 8:
+            self._masks.clear()
+        self._masks[key] = mask
+        return mask
+
+    # Zone areas in full-frame pixels
+    def _zone_areas(self, frame_shape):
+        labels, membership = self._label_mask(tuple(frame_shape[:2]))
+        counts = np.bincount(labels.ravel(), minlength=len(membership))
+        return dict(zip(self.names, (counts @ membership).tolist()))
+
+    '''
+        occupancy(self, contours, frame_shape)
+
+        Description:
+          Area of the detection regions (contour list or BlobSet, full-frame
+          coordinates) inside each zone, as a dict of name : pixels.
+    '''
+    def occupancy(self, contours, frame_shape):
+        if frame_shape[:2] != self._frame_shape:
+            self.area = self._zone_areas(frame_shape)
+            self._frame_shape = frame_shape[:2]
+        if contours is None or len(contours) == 0:
+            return dict.fromkeys(self.names, 0.)
+        with profiled('zones'):
+            if isinstance(contours, cvu.BlobSet) and contours._labels is not None:
+                counts, pixel_area, membership = self._count_blobs(contours)
+            else:
+                counts, pixel_area, membership = self._count_contours(contours,
+                                                                      frame_shape)
+            return dict(zip(self.names, ((counts @ membership) * pixel_area).tolist()))
+
+    # Zone label counts under the blobs, from the BlobSet's own label image
+    def _count_blobs(self, blobs):
+        labels, membership = self._label_mask(blobs._labels.shape,
+                                              blobs._scale, blobs._shift)
+        n_labels = int(cv2.minMaxLoc(blobs._labels)[1]) + 1
+        if len(blobs._label_ids) == n_labels - 1:
+            foreground = blobs._labels > 0
+        else:
+            # Some blobs were filtered out (e.g. by region of interest)
+            keep = np.zeros(n_labels, dtype=bool)
+            keep[blobs._label_ids] = True
+            foreground = keep[blobs._labels]
+        counts = np.bincount(labels[foreground], minlength=len(membership))
+        return counts, blobs._scale[0] * blobs._scale[1], membership
+
+    # Zone label counts under the filled contours, at mask scale
+    def _count_contours(self, contours, frame_shape):
+        height, width = cvu.downscaled_size(frame_shape[:2], self.scale)
+        factors = (width / float(frame_shape[1]), height / float(frame_shape[0]))
+        labels, membership = self._label_mask((height, width), (1./factors[0], 1./factors[1]))
+        if self._foreground is None or self._foreground.shape != (height, width):
+            self._foreground = np.empty((height, width), dtype=np.uint8)
+        self._foreground[:] = 0
+        points = [np.round(contour * np.array(factors)).astype(np.int32)
+                  for contour in cvu.as_contours(contours)]
+        cv2.drawContours(self._foreground, points, -1, 1, cv2.FILLED)
+        counts = np.bincount(labels[self._foreground.view(bool)], minlength=len(membership))
+        return counts, 1. / (factors[0] * factors[1]), membership
+
+    # Copies (e.g. one per TrackerGroup stream) get their own scratch mask
+    def __copy__(self):
+        zones = ZoneMap.__new__(ZoneMap)
+        zones.__dict__.update(self.__dict__)
+        zones._masks = dict(self._masks)
+        zones._foreground = None
+        return zones
+